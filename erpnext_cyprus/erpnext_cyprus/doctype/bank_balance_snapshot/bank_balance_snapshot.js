@@ -0,0 +1,8 @@
+// Copyright (c) 2026, KAINOTOMO PH LTD and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Bank Balance Snapshot", {
+// 	refresh(frm) {
+
+// 	},
+// });
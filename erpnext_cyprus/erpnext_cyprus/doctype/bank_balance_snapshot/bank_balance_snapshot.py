@@ -0,0 +1,13 @@
+# Copyright (c) 2026, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BankBalanceSnapshot(Document):
+	pass
+
+def on_doctype_update():
+	# The latest balance and the intraday history are read per account and time
+	frappe.db.add_index("Bank Balance Snapshot", ["bank_account", "snapshot_on"])
@@ -19,7 +19,7 @@ frappe.ui.form.on('Bank Of Cyprus', {
 				});
 			});
 
-			if (frm.doc.authorization_code) {
+			if (frm.doc.access_token_2) {
 				frm.add_custom_button(__('Create Accounts'), function () {
 					frappe.confirm('Are you sure you want to proceed?', function() {
 						frappe.call({
@@ -60,8 +60,8 @@ frappe.ui.form.on('Bank Of Cyprus', {
 function update_token_status(frm) {
 	let token_status_html = "";
 	
-	// If no authorization code exists, show warning
-	if (!frm.doc.authorization_code) {
+	// If the user has not authorised the subscription yet, show warning
+	if (!frm.doc.access_token_2) {
 		token_status_html = `
 			<div class="alert alert-danger">
 				<i class="fa fa-exclamation-triangle"></i>
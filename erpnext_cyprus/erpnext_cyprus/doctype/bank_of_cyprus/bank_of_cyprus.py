@@ -2,13 +2,30 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
-import requests
+from frappe.utils import cint, flt, getdate
 import json
 from datetime import datetime
+import time
 import uuid
 from urllib.parse import urlencode, urljoin
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from erpnext_cyprus.utils.bank_accounts import provision_bank_accounts
+from erpnext_cyprus.utils.bank_api import get_bank_api_client
+from erpnext_cyprus.utils.bank_sync import (
+	SETTINGS_DOCTYPE,
+	fetch_bank_transactions,
+	get_bank_connection,
+	validate_unique_connection,
+)
+from erpnext_cyprus.utils.bank_tokens import clear_token, get_expires_at, get_token, set_token
+from erpnext_cyprus.utils.payment_context import PAYMENT_CURRENCY, BankPaymentError
+from erpnext_cyprus.utils.payment_run import TRANSFER_INITIATED, TRANSFER_PENDING, TRANSFER_UNKNOWN
 
 class BankOfCyprus(Document):
 	
@@ -18,8 +35,11 @@ class BankOfCyprus(Document):
 			"/api/method/erpnext_cyprus.erpnext_cyprus.doctype.bank_of_cyprus.bank_of_cyprus.callback/" + self.name
 		)
 		self.redirect_uri = urljoin(base_url, callback_path)
+		validate_unique_connection(self)
 
 	def get_base_url(self):
+		if frappe.conf.get("bank_of_cyprus_url"):
+			return frappe.conf.get("bank_of_cyprus_url")
 		return "https://sandbox-apis.bankofcyprus.com/df-boc-org-sb/sb/psd2" if self.is_sandbox else "https://apis.bankofcyprus.com/df-boc-org-prd/prod/psd2"
 
 	def base64_encode(self, string):
@@ -28,8 +48,30 @@ class BankOfCyprus(Document):
 		encoded_string = encoded_bytes.decode('utf-8')  # Convert the encoded bytes back to a string
 		return encoded_string
 
+	def get_api_client(self):
+		return get_bank_api_client(self.doctype)
+
+	def on_update(self):
+		clear_token(self.doctype, self.name)
+		frappe.cache.delete_value(self.get_subscription_cache_key())
+
 	def get_access_token_1(self):
+		access_token_1, expires_at = self.request_token()
+		set_token(self.doctype, self.name, access_token_1, expires_at)
+		return self.create_subscription()
+
+	def get_access_token(self):
+		"""Client credentials token, shared by all workers and requested again shortly before it expires."""
+		return get_token(self.doctype, self.name, self.load_token, self.request_token)
 
+	def load_token(self):
+		access_token_1 = frappe.db.get_value('Bank Of Cyprus', self.name, 'access_token_1')
+		if not access_token_1:
+			return None, 0
+		access_token_1 = json.loads(access_token_1)
+		return access_token_1, get_expires_at(access_token_1, access_token_1.get("consented_on"))
+
+	def request_token(self, access_token_1=None):
 		url = self.get_base_url() + "/oauth2/token"
 		payload = {
 			"grant_type": "client_credentials",
@@ -41,13 +83,25 @@ class BankOfCyprus(Document):
 			"Accept": "application/json",
 			"Content-Type": "application/x-www-form-urlencoded"
 		}
-		response = requests.post(url, data=payload, headers=headers)
+		issued_at = time.time()
+		response = self.get_api_client().post(url, data=payload, headers=headers)
 		if (response.status_code != 200):
-			return response.json()
+			frappe.throw(response.text)
 		frappe.db.set_value('Bank Of Cyprus', self.name, 'access_token_1', response.text)
 		self.access_token_1 = response.text
-		
-		return self.create_subscription()
+		response_json = response.json()
+		return response_json, get_expires_at(response_json, issued_at)
+
+	def get_subscription_cache_key(self):
+		return f"bank_of_cyprus_subscription|{self.name}"
+
+	def get_subscription_id(self):
+		return frappe.cache.get_value(
+			self.get_subscription_cache_key(),
+			generator=lambda: json.loads(
+				frappe.db.get_value('Bank Of Cyprus', self.name, 'subscription_id')
+			)["subscriptionId"],
+		)
 	
 	def get_access_token_2(self):
 
@@ -63,10 +117,11 @@ class BankOfCyprus(Document):
 			"Accept": "application/json",
 			"Content-Type": "application/x-www-form-urlencoded"
 		}
-		response = requests.post(url, data=payload, headers=headers)
+		response = self.get_api_client().post(url, data=payload, headers=headers)
 		if (response.status_code != 200):
 			return response.json()
 		frappe.db.set_value('Bank Of Cyprus', self.name, 'access_token_2', response.text)
+		self.access_token_2 = response.text
 		
 		return self.update_subscription()
 	
@@ -102,10 +157,11 @@ class BankOfCyprus(Document):
 			"timeStamp": datetime.utcnow().isoformat(),
 			"journeyId": str(uuid.uuid4())
 		}
-		response = requests.post(url, json=payload, headers=headers)
+		response = self.get_api_client().post(url, json=payload, headers=headers)
 		if (response.status_code != 200 and response.status_code != 201):
 			frappe.throw("Something went wrong with Bank Of Cyprus authorization")
 		frappe.db.set_value('Bank Of Cyprus', self.name, 'subscription_id', response.text)
+		frappe.cache.delete_value(self.get_subscription_cache_key())
 		return response.json()
 	
 	def update_subscription(self):
@@ -125,10 +181,11 @@ class BankOfCyprus(Document):
 			"journeyId": str(uuid.uuid4()),
 			"app_name": "ERPNext Integration"
 		}
-		response = requests.get(url, params=payload, headers=headers)
+		response = self.get_api_client().get(url, params=payload, headers=headers)
 		if (response.status_code != 200 and response.status_code != 201):
 			frappe.throw("Something went wrong with Bank Of Cyprus authorization")
 		frappe.db.set_value('Bank Of Cyprus', self.name, 'subscription_id', response.text)
+		frappe.cache.delete_value(self.get_subscription_cache_key())
 		response_json = response.json()[0]
 
 		# Then patch to activate subscription
@@ -147,12 +204,273 @@ class BankOfCyprus(Document):
 			"journeyId": str(uuid.uuid4()),
 			"app_name": "ERPNext Integration"
 		}
-		response = requests.patch(url=url, json=payload, headers=headers)
+		response = self.get_api_client().patch(url=url, json=payload, headers=headers)
 		if (response.status_code != 200 and response.status_code != 201):
 			frappe.throw("Something went wrong with Bank Of Cyprus authorization")
 		frappe.db.set_value('Bank Of Cyprus', self.name, 'subscription_id', response.text)
+		frappe.cache.delete_value(self.get_subscription_cache_key())
 		return response.json()
 
+	def get_statement_request(self, bank_account, bank_statement_from_date, bank_statement_to_date):
+		"""Prepare the statement request, so it can be sent from any thread."""
+		dateFrom = datetime.strptime(bank_statement_from_date, '%Y-%m-%d').strftime('%d/%m/%Y')
+		dateTo = datetime.strptime(bank_statement_to_date, '%Y-%m-%d').strftime('%d/%m/%Y')
+
+		bank_account_no = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
+		access_token_1 = self.get_access_token()
+		return {
+			"method": "GET",
+			"url": self.get_base_url() + "/v1/accounts/" + bank_account_no + "/statement",
+			"params": {
+				"startDate": dateFrom,
+				"endDate": dateTo,
+			},
+			"headers": {
+				"Content-Type": "application/json",
+				"Authorization": "Bearer " + access_token_1["access_token"],
+				"subscriptionId": self.get_subscription_id(),
+				"originUserId": self.user_id,
+				"journeyId": str(uuid.uuid4()),
+				"timeStamp": datetime.utcnow().isoformat()
+			},
+		}
+
+	def parse_statement(self, response_json):
+		"""Map Bank of Cyprus statement lines to the fields used by import_bank_transactions."""
+		transactions = []
+		for transaction in response_json["transaction"]:
+			amount = abs(transaction["transactionAmount"]["amount"])
+			transactions.append({
+				"date": datetime.strptime(transaction["valueDate"], '%d/%m/%Y').strftime('%Y-%m-%d'),
+				"reference_number": transaction["id"],
+				"description": transaction["description"],
+				"amount": amount if transaction["dcInd"] == "CREDIT" else -amount,
+			})
+		return transactions
+
+	def get_balance_request(self, bank_account):
+		"""Prepare the balance request, so it can be sent from any thread."""
+		bank_account_no = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
+		access_token_1 = self.get_access_token()
+		return {
+			"method": "GET",
+			"url": self.get_base_url() + "/v1/accounts/" + bank_account_no + "/balance",
+			"headers": {
+				"Content-Type": "application/json",
+				"Authorization": "Bearer " + access_token_1["access_token"],
+				"subscriptionId": self.get_subscription_id(),
+				"originUserId": self.user_id,
+				"journeyId": str(uuid.uuid4()),
+				"timeStamp": datetime.utcnow().isoformat()
+			},
+		}
+
+	def parse_balance(self, response_json):
+		"""Map a Bank of Cyprus balance response to the fields of a Bank Balance Snapshot."""
+		account = response_json[0]
+		balances = {balance["balanceType"]: balance["amount"] for balance in account["balances"]}
+		return {
+			"currency": account["currency"],
+			"available_balance": balances.get("AVAILABLE"),
+			"current_balance": balances.get("CURRENT"),
+		}
+
+	@frappe.whitelist()
+	def create_accounts(self):
+		url = self.get_base_url() + "/v1/accounts"
+		payload = {}
+		headers = {
+			"Content-Type": "application/json",
+			"Authorization": "Bearer " + self.get_access_token()["access_token"],
+			"subscriptionId": self.get_subscription_id(),
+			"originUserId": self.user_id,
+			"journeyId": str(uuid.uuid4()),
+			"timeStamp": datetime.utcnow().isoformat()
+		}
+
+		response = self.get_api_client().get(url, params=payload, headers=headers)
+		if (response.status_code != 200):
+			frappe.throw(response.text)
+
+		accounts = response.json()
+		summary = provision_bank_accounts(self, [
+			{
+				"account_name": account["accountName"],
+				"account_no": account["accountId"],
+				"iban": account["IBAN"],
+				"currency": account["currency"],
+			}
+			for account in accounts
+		])
+
+		return {"accounts": accounts, **summary, "errors": None}
+
+	@frappe.whitelist()
+	def get_bank_transactions(self, bank_account, bank_statement_from_date, bank_statement_to_date):
+		created = fetch_bank_transactions(bank_account, bank_statement_from_date, bank_statement_to_date, connection=self)
+		return {"created": created}
+
+	def funds_availability(self, bank_account, amount, iban=None):
+		"""Whether the available balance of a bank account covers `amount`."""
+		request = self.get_balance_request(bank_account)
+		response = self.get_api_client().request(**request)
+		if (response.status_code != 200):
+			frappe.throw(response.text)
+		return flt(self.parse_balance(response.json())["available_balance"]) >= flt(amount)
+
+	def get_payments_url(self):
+		return self.get_base_url() + "/v1/payments/"
+
+	def get_payment_headers(self):
+		"""Headers of payment calls, all sent under one subscription token."""
+		return {
+			"Content-Type": "application/json",
+			"Authorization": "Bearer " + self.get_access_token()["access_token"],
+			"subscriptionId": self.get_subscription_id(),
+			"originUserId": self.user_id,
+			"timeStamp": datetime.utcnow().isoformat(),
+		}
+
+	def get_payment_request(self, headers, debtor, beneficiary, amount, reference_no, execution_date, party_name):
+		"""Prepare a SEPA credit transfer, so it can be sent from any thread."""
+		return {
+			"url": self.get_payments_url() + "initiate",
+			"headers": {**headers, "journeyId": str(uuid.uuid4())},
+			"json": {
+				"debtor": {
+					"bankId": debtor.bic,
+					"accountId": debtor.bank_account_no,
+				},
+				"creditor": {
+					"bankId": beneficiary.bic,
+					"accountId": beneficiary.iban,
+					"name": party_name,
+				},
+				"transactionAmount": {
+					"amount": flt(amount),
+					"currency": PAYMENT_CURRENCY,
+				},
+				"endToEndId": reference_no,
+				"paymentDetails": reference_no,
+				"executionDate": getdate(execution_date).strftime('%d/%m/%Y'),
+			},
+		}
+
+	def send_payment(self, request, client, payments_url, payment_id=None):
+		"""
+		Initiate a prepared payment, unless `payment_id` was initiated already,
+		and execute it; safe to call from worker threads. Returns the payment.
+		A failure after the bank may have created or executed the payment
+		raises a BankPaymentError carrying its id and transfer status.
+		"""
+		if not payment_id:
+			try:
+				response = client.post(**request)
+			except requests.RequestException as e:
+				raise BankPaymentError(str(e), transfer_status=TRANSFER_UNKNOWN)
+			if response.status_code >= 500:
+				raise BankPaymentError(response.text, transfer_status=TRANSFER_UNKNOWN)
+			if (response.status_code not in (200, 201)):
+				raise BankPaymentError(response.text)
+			try:
+				payment_id = response.json()["payment"]["paymentId"]
+			except (ValueError, KeyError):
+				raise BankPaymentError(response.text, transfer_status=TRANSFER_UNKNOWN)
+
+		url = payments_url + payment_id + "/execute"
+		try:
+			response = client.post(url, json={}, headers={**request["headers"], "journeyId": str(uuid.uuid4())})
+		except requests.RequestException as e:
+			raise BankPaymentError(str(e), payment_id, TRANSFER_UNKNOWN)
+		if response.status_code >= 500:
+			raise BankPaymentError(response.text, payment_id, TRANSFER_UNKNOWN)
+		if (response.status_code not in (200, 201)):
+			raise BankPaymentError(response.text, payment_id, TRANSFER_INITIATED)
+		return response.json()["payment"]
+
+	def submit_payment_run(self, bank_account, payment_entries, execution_date, context):
+		"""
+		Send the payments of a run concurrently under one subscription token;
+		initiated ones are executed again under their existing payment id.
+		Returns ({Payment Entry: (payment id, transfer status)}, errors) for
+		every payment the bank accepted or may hold.
+		"""
+		debtor = context.get_bank_account(bank_account)
+		headers = self.get_payment_headers()
+		payment_requests = {
+			pe.name: self.get_payment_request(
+				headers,
+				debtor,
+				frappe._dict(iban=pe.beneficiary_account, bic=pe.beneficiary_bic),
+				pe.paid_amount,
+				pe.name,
+				execution_date,
+				pe.party_name,
+			)
+			for pe in payment_entries
+		}
+		payment_ids = {
+			pe.name: pe.custom_bank_transfer_id
+			for pe in payment_entries
+			if pe.get("custom_bank_transfer_status") == TRANSFER_INITIATED
+		}
+
+		transfers = {}
+		errors = []
+		client = self.get_api_client()
+		payments_url = self.get_payments_url()
+		max_workers = cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "bank_sync_max_workers")) or 4
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			futures = {
+				executor.submit(self.send_payment, request, client, payments_url, payment_ids.get(name)): name
+				for name, request in payment_requests.items()
+			}
+			for future in as_completed(futures):
+				name = futures[future]
+				try:
+					transfers[name] = (future.result()["paymentId"], TRANSFER_PENDING)
+				except BankPaymentError as e:
+					if e.transfer_status:
+						transfers[name] = (e.payment_id, e.transfer_status)
+					errors.append(_("{0}: {1}").format(name, e.args[0]))
+				except Exception as e:
+					# The payment may have reached the bank
+					transfers[name] = (payment_ids.get(name), TRANSFER_UNKNOWN)
+					errors.append(_("{0}: {1}").format(name, e))
+		return transfers, errors
+
+	def get_transfer_statuses(self, payment_entries):
+		"""Bank status of each payment, keyed by Payment Entry, polled concurrently."""
+		headers = self.get_payment_headers()
+		status_requests = {
+			pe.name: {
+				"method": "GET",
+				"url": self.get_payments_url() + pe.custom_bank_transfer_id + "/status",
+				"headers": {**headers, "journeyId": str(uuid.uuid4())},
+			}
+			for pe in payment_entries
+		}
+
+		statuses = {}
+		client = self.get_api_client()
+		max_workers = cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "bank_sync_max_workers")) or 4
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			futures = {executor.submit(client.request, **request): name for name, request in status_requests.items()}
+			for future in as_completed(futures):
+				name = futures[future]
+				# An unreadable status leaves only its payment pending
+				try:
+					response = future.result()
+					if response.status_code == 200:
+						statuses[name] = response.json()["code"]
+				except Exception:
+					frappe.log_error(
+						title=_("Could not read the status of payment {0}").format(name),
+						reference_doctype="Payment Entry",
+						reference_name=name,
+					)
+		return statuses
+
 	@frappe.whitelist()
 	def initiate_web_application_flow(self):
 		"""Return an authorization URL. Save state in Token Cache."""
@@ -173,111 +491,48 @@ class BankOfCyprus(Document):
 		authorization_url += "?" + urlencode(query_params)
 		return authorization_url
 
+def get_bank_of_cyprus(bank_account):
+	"""The enabled Bank Of Cyprus connection serving a bank account's bank for its company."""
+	bank, company = frappe.db.get_value("Bank Account", bank_account, ["bank", "company"])
+	doctype, name = get_bank_connection(bank, company)
+	if doctype != "Bank Of Cyprus":
+		frappe.throw(_("No Bank Of Cyprus connection is configured for bank {0}").format(bank))
+	return frappe.get_doc(doctype, name)
+
 @frappe.whitelist()
-def create_accounts():
-	bank_of_cyprus = frappe.get_doc("Bank Of Cyprus")
-	access_token_1 = json.loads(bank_of_cyprus.access_token_1)
-	subscription_id = json.loads(bank_of_cyprus.subscription_id)
-	url = get_base_url(bank_of_cyprus) + "/v1/accounts"
-	payload = {}
-	headers = {
-		"Content-Type": "application/json",
-		"Authorization": "Bearer " + access_token_1["access_token"],
-		"subscriptionId": subscription_id["subscriptionId"],
-		"originUserId": bank_of_cyprus.user_id,
-		"journeyId": str(uuid.uuid4()),
-		"timeStamp": datetime.utcnow().isoformat()
-	}
-
-	response = requests.get(url, params=payload, headers=headers)
-	if (response.status_code != 200):
-		frappe.throw(response.text)
-	
-	accounts = response.json()
-	for account in accounts:
-		if not frappe.db.exists('Bank Account', account["accountName"] + " - " + bank_of_cyprus.bank):
-			new_account = frappe.get_doc({
-				'doctype': 'Account',
-				'account_name': account["accountName"],
-				'parent_account': bank_of_cyprus.parent_account,
-				'account_type': 'Bank',
-				'account_currency': account["currency"],
-			})
-			new_account.insert()
-
-			bank_account = frappe.get_doc({
-				'doctype': 'Bank Account',
-				'account_name': account["accountName"],
-				'account': new_account.name,
-				'is_company_account': True,
-				'bank': bank_of_cyprus.bank,
-				'bank_account_no': account["accountId"],
-				'currency': account["currency"],
-				#'iban': account["IBAN"],
-			})
-			bank_account.insert()
-			frappe.db.set_value('Bank Account', bank_account.name, 'iban', account["IBAN"])
-			
-	return accounts
+def create_accounts(bank_of_cyprus):
+	bank_of_cyprus = frappe.get_doc("Bank Of Cyprus", bank_of_cyprus)
+	bank_of_cyprus.check_permission("write")
+	return bank_of_cyprus.create_accounts()
 
 @frappe.whitelist()
 def get_bank_transactions(bank_account, bank_statement_from_date, bank_statement_to_date):
+	bank_of_cyprus = get_bank_of_cyprus(bank_account)
+	bank_of_cyprus.check_permission("read")
+	return bank_of_cyprus.get_bank_transactions(bank_account, bank_statement_from_date, bank_statement_to_date)
 
-	dateFrom = datetime.strptime(bank_statement_from_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-	dateTo = datetime.strptime(bank_statement_to_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-
-	bank_of_cyprus = frappe.get_doc("Bank Of Cyprus")
-	bank_account_doc = frappe.get_doc("Bank Account", bank_account)
-	access_token_1 = json.loads(bank_of_cyprus.access_token_1)
-	subscription_id = json.loads(bank_of_cyprus.subscription_id)
-	url = get_base_url(bank_of_cyprus) + "/v1/accounts/" + bank_account_doc.bank_account_no + "/statement"
-	payload = {
-		"startDate": dateFrom,
-		"endDate": dateTo,
-	}
-	headers = {
-		"Content-Type": "application/json",
-		"Authorization": "Bearer " + access_token_1["access_token"],
-		"subscriptionId": subscription_id["subscriptionId"],
-		"originUserId": bank_of_cyprus.user_id,
-		"journeyId": str(uuid.uuid4()),
-		"timeStamp": datetime.utcnow().isoformat()
-	}
-
-	response = requests.get(url, params=payload, headers=headers)
-	response_json = response.json()
-	if (response.status_code != 200):
-		frappe.throw(response.text)
-
-	transactions = response_json["transaction"]
-	for transaction in transactions:
-		valueDate = datetime.strptime(transaction["valueDate"], '%d/%m/%Y').strftime('%Y-%m-%d')
-		filters = {
-			'date': valueDate,
-			'reference_number': transaction["id"]
-		}
-		amount = transaction["transactionAmount"]["amount"]
-		if transaction["dcInd"] == "CREDIT":
-			filters["deposit"] = abs(amount)
-		else:
-			filters["withdrawal"] = abs(amount)
-		existing = frappe.db.get_list('Bank Transaction', filters=filters)
-
-		if (len(existing) == 0):
-			bank_transaction = frappe.get_doc({
-				"doctype": "Bank Transaction",
-				"bank_account": bank_account,
-				"status": "Pending",
-				"date": valueDate,
-				"reference_number": transaction["id"],
-				"description": transaction["description"],
-			})
-			if transaction["dcInd"] == "CREDIT":
-				bank_transaction.deposit = abs(amount)
-			else:
-				bank_transaction.withdrawal = abs(amount)
-
-			bank_transaction.insert()
-			bank_transaction.submit()
-			
-	return response_json
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def callback(code=None, state=None, error=None):
+	"""Handle the code sent back by Bank of Cyprus once the user authorised a connection's subscription."""
+
+	if frappe.session.user == "Guest":
+		frappe.local.response["type"] = "redirect"
+		frappe.local.response["location"] = "/login?" + urlencode({"redirect-to": frappe.request.url})
+		return
+
+	path = frappe.request.path[1:].split("/")
+	if len(path) != 4 or not path[3]:
+		frappe.throw(_("Invalid Parameters."))
+
+	bank_of_cyprus = frappe.get_doc("Bank Of Cyprus", path[3])
+
+	if not error:
+		if state != bank_of_cyprus.state:
+			frappe.throw(_("Invalid token state! Check if the token has been created by the OAuth user."))
+		frappe.db.set_value('Bank Of Cyprus', bank_of_cyprus.name, 'code', code)
+		bank_of_cyprus.code = code
+		bank_of_cyprus.get_access_token_2()
+		frappe.db.commit()
+
+	frappe.local.response["type"] = "redirect"
+	frappe.local.response["location"] = bank_of_cyprus.get_url()
@@ -1,9 +1,201 @@
 # Copyright (c) 2023, KAINOTOMO PH LTD and Contributors
 # See license.txt
 
-# import frappe
+import json
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from erpnext_cyprus.erpnext_cyprus.doctype.bank_of_cyprus.bank_of_cyprus import (
+	get_bank_of_cyprus,
+	get_bank_transactions,
+)
+from erpnext_cyprus.tests.bank_server import DEFAULT_ACCOUNTS, FakeBankServer
+from erpnext_cyprus.utils.bank_sync import SETTINGS_DOCTYPE
+from erpnext_cyprus.utils.bank_tokens import clear_token
+from erpnext_cyprus.utils.payment_context import PaymentContext
+from erpnext_cyprus.utils.payment_run import TRANSFER_INITIATED, TRANSFER_PENDING, TRANSFER_UNKNOWN
+
+BANK = "_Test Fake Bank Of Cyprus"
+BANK_ACCOUNT = "_Test Fake Bank Of Cyprus Account"
+PARTY_BANK_ACCOUNT = "_Test Fake Bank Of Cyprus Party Account"
+TEST_SETTINGS = {"bank_api_max_retries": 3, "archive_bank_statements": 0}
+
 
 class TestBankOfCyprus(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = FakeBankServer(transactions_per_day=5).start()
+		cls.site_config = {key: frappe.conf.get(key) for key in cls.server.site_config}
+		frappe.local.conf.update(cls.server.site_config)
+		cls.settings = frappe.db.get_singles_dict(SETTINGS_DOCTYPE)
+		frappe.db.set_single_value(SETTINGS_DOCTYPE, TEST_SETTINGS)
+		frappe.clear_document_cache(SETTINGS_DOCTYPE, SETTINGS_DOCTYPE)
+
+		if not frappe.db.exists("Bank", BANK):
+			frappe.get_doc({"doctype": "Bank", "bank_name": BANK, "swift_number": "BCYPCY2N"}).insert()
+		for account_name, account in ((BANK_ACCOUNT, DEFAULT_ACCOUNTS[0]), (PARTY_BANK_ACCOUNT, DEFAULT_ACCOUNTS[1])):
+			if not frappe.db.exists("Bank Account", {"account_name": account_name}):
+				frappe.get_doc({
+					"doctype": "Bank Account",
+					"account_name": account_name,
+					"bank": BANK,
+					"bank_account_no": account["account_id"],
+					"iban": account["iban"],
+				}).insert()
+		cls.bank_account = frappe.db.get_value("Bank Account", {"account_name": BANK_ACCOUNT})
+		cls.party_bank_account = frappe.db.get_value("Bank Account", {"account_name": PARTY_BANK_ACCOUNT})
+
+		# Payments are sent from EUR accounts only
+		parent_account = frappe.db.get_value(
+			"Account", {"is_group": 1, "root_type": "Asset"}, ["name", "company"], as_dict=True
+		)
+		ledger_account = frappe.db.get_value("Account", {"account_name": BANK_ACCOUNT, "company": parent_account.company})
+		if not ledger_account:
+			ledger_account = frappe.get_doc({
+				"doctype": "Account",
+				"account_name": BANK_ACCOUNT,
+				"parent_account": parent_account.name,
+				"company": parent_account.company,
+				"account_type": "Bank",
+				"account_currency": "EUR",
+			}).insert().name
+		frappe.db.set_value(
+			"Bank Account", cls.bank_account, {"account": ledger_account, "company": parent_account.company}
+		)
+
+		cls.bank_of_cyprus = frappe.get_doc({
+			"doctype": "Bank Of Cyprus",
+			"title": BANK,
+			"bank": BANK,
+			"parent_account": parent_account.name,
+			"client_id": "test-client",
+			"client_secret": "test-secret",
+			"user_id": "test-user",
+			"allow_payments": 1,
+			"subscription_id": json.dumps({"subscriptionId": "Subid000000000001"}),
+		}).insert()
+
+	@classmethod
+	def tearDownClass(cls):
+		frappe.db.delete("Bank Transaction", {"bank_account": cls.bank_account})
+		frappe.delete_doc("Bank Of Cyprus", cls.bank_of_cyprus.name, force=True)
+		frappe.db.commit()
+		frappe.db.set_single_value(SETTINGS_DOCTYPE, {key: cls.settings.get(key) for key in TEST_SETTINGS})
+		frappe.clear_document_cache(SETTINGS_DOCTYPE, SETTINGS_DOCTYPE)
+		frappe.local.conf.update(cls.site_config)
+		cls.server.stop()
+		super().tearDownClass()
+
+	def setUp(self):
+		frappe.db.set_value("Bank Of Cyprus", self.bank_of_cyprus.name, "access_token_1", None)
+		clear_token("Bank Of Cyprus", self.bank_of_cyprus.name)
+
+	def test_access_token_is_requested_once(self):
+		requests = self.server.count("/boc/oauth2/token")
+		first = self.bank_of_cyprus.get_access_token()
+		second = self.bank_of_cyprus.get_access_token()
+		self.assertEqual(first["access_token"], second["access_token"])
+		self.assertEqual(self.server.count("/boc/oauth2/token"), requests + 1)
+
+	def test_statement_import_is_idempotent(self):
+		response = get_bank_transactions(self.bank_account, "2026-03-01", "2026-03-02")
+		self.assertEqual(response["created"], 10)
+
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": self.bank_account},
+			fields=["deposit", "withdrawal", "status"],
+		)
+		self.assertEqual(len(transactions), 10)
+		self.assertTrue(all(t.status == "Unreconciled" and bool(t.deposit) != bool(t.withdrawal) for t in transactions))
+
+		response = get_bank_transactions(self.bank_account, "2026-03-01", "2026-03-02")
+		self.assertEqual(response["created"], 0)
+
+	def test_one_connection_per_bank_and_company(self):
+		duplicate = frappe.copy_doc(self.bank_of_cyprus)
+		self.assertRaises(frappe.ValidationError, duplicate.insert)
+
+		duplicate.disabled = 1
+		duplicate.insert()
+		self.assertEqual(get_bank_of_cyprus(self.bank_account).name, self.bank_of_cyprus.name)
+		frappe.delete_doc("Bank Of Cyprus", duplicate.name, force=True)
+
+	def test_payment_run(self):
+		transfers, errors = self.bank_of_cyprus.submit_payment_run(
+			self.bank_account, [self.get_run_entry("PE-RUN-2")], "2026-01-15", PaymentContext(self.bank_of_cyprus)
+		)
+		payment_id, status = transfers["PE-RUN-2"]
+		self.assertEqual((status, errors), (TRANSFER_PENDING, []))
+		sent = self.server.payments[payment_id]
+		self.assertEqual(sent["status"]["code"], "CPLT")
+		self.assertEqual(sent["debtor"]["accountId"], DEFAULT_ACCOUNTS[0]["account_id"])
+		self.assertEqual(sent["creditor"]["accountId"], DEFAULT_ACCOUNTS[1]["iban"])
+		self.assertEqual(sent["executionDate"], "15/01/2026")
+
+	def test_insufficient_funds(self):
+		payments = len(self.server.payments)
+		self.assertRaises(
+			frappe.ValidationError, PaymentContext(self.bank_of_cyprus).reserve_funds, self.bank_account, 10**9
+		)
+		self.assertEqual(len(self.server.payments), payments)
+
+	def test_transfer_statuses_are_polled(self):
+		transfers, errors = self.bank_of_cyprus.submit_payment_run(
+			self.bank_account,
+			[self.get_run_entry(f"PE-{i}") for i in range(3)],
+			"2026-01-15",
+			PaymentContext(self.bank_of_cyprus),
+		)
+		statuses = self.bank_of_cyprus.get_transfer_statuses([
+			frappe._dict(name=name, custom_bank_transfer_id=payment_id)
+			for name, (payment_id, status) in transfers.items()
+		])
+		self.assertEqual(statuses, {"PE-0": "CPLT", "PE-1": "CPLT", "PE-2": "CPLT"})
+
+	def get_run_entry(self, name, **kwargs):
+		return frappe._dict(
+			name=name,
+			paid_amount=10,
+			beneficiary_account=DEFAULT_ACCOUNTS[1]["iban"],
+			beneficiary_bic="BCYPCY2N",
+			party_name="Test Supplier",
+			**kwargs,
+		)
+
+	def test_unanswered_initiation_is_not_sent_again(self):
+		self.server.fail("/boc/v1/payments/initiate", 503)
+		transfers, errors = self.bank_of_cyprus.submit_payment_run(
+			self.bank_account, [self.get_run_entry("PE-RUN-0")], "2026-01-15", PaymentContext(self.bank_of_cyprus)
+		)
+		self.assertEqual(transfers, {"PE-RUN-0": (None, TRANSFER_UNKNOWN)})
+		self.assertEqual(len(errors), 1)
+
+	def test_failed_execution_is_executed_again(self):
+		context = PaymentContext(self.bank_of_cyprus)
+		request = self.bank_of_cyprus.get_payment_request(
+			self.bank_of_cyprus.get_payment_headers(),
+			context.get_bank_account(self.bank_account),
+			context.get_bank_account(self.party_bank_account),
+			10,
+			"PE-RUN-1",
+			"2026-01-15",
+			"Test Supplier",
+		)
+		payment_id = self.bank_of_cyprus.get_api_client().post(**request).json()["payment"]["paymentId"]
+		initiated = self.server.count("/boc/v1/payments/initiate")
+
+		self.server.fail(f"/boc/v1/payments/{payment_id}/execute", 400)
+		entry = self.get_run_entry(
+			"PE-RUN-1", custom_bank_transfer_id=payment_id, custom_bank_transfer_status=TRANSFER_INITIATED
+		)
+		transfers, errors = self.bank_of_cyprus.submit_payment_run(self.bank_account, [entry], "2026-01-15", context)
+		self.assertEqual(transfers, {"PE-RUN-1": (payment_id, TRANSFER_INITIATED)})
+		self.assertEqual(self.server.payments[payment_id]["status"]["code"], "PNDG")
+
+		transfers, errors = self.bank_of_cyprus.submit_payment_run(self.bank_account, [entry], "2026-01-15", context)
+		self.assertEqual(transfers, {"PE-RUN-1": (payment_id, TRANSFER_PENDING)})
+		self.assertEqual(self.server.payments[payment_id]["status"]["code"], "CPLT")
+		self.assertEqual(self.server.count("/boc/v1/payments/initiate"), initiated)
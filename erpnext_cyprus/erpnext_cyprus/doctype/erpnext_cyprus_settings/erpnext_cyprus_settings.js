@@ -1,8 +1,38 @@
 // Copyright (c) 2025, KAINOTOMO PH LTD and contributors
 // For license information, please see license.txt
 
-// frappe.ui.form.on("Erpnext Cyprus Settings", {
-// 	refresh(frm) {
+frappe.ui.form.on("Erpnext Cyprus Settings", {
+	refresh(frm) {
+		frm.add_custom_button(__("Revalidate Customer VAT Numbers"), function () {
+			frappe.confirm(__("Revalidate the VAT number of every customer through VIES?"), function () {
+				frappe.call({
+					method: "erpnext_cyprus.utils.vat_revalidation.revalidate_customer_vat_numbers"
+				});
+			});
+		}, __("VIES"));
 
-// 	},
-// });
+		frm.add_custom_button(__("Sync All Bank Accounts"), function () {
+			frappe.call({
+				method: "erpnext_cyprus.utils.bank_sync.enqueue_bank_sync"
+			});
+		}, __("Banks"));
+
+		frm.add_custom_button(__("Refresh Bank Balances"), function () {
+			frappe.call({
+				method: "erpnext_cyprus.utils.bank_balances.enqueue_balance_snapshot"
+			});
+		}, __("Banks"));
+
+		frm.add_custom_button(__("Import Archived Statements"), function () {
+			frappe.confirm(
+				__("Import the transactions of every archived bank statement again?") + "<br><br>" +
+				__("Only missing transactions are created. Transactions imported before are not updated, so cancel and delete wrongly imported ones first."),
+				function () {
+					frappe.call({
+						method: "erpnext_cyprus.utils.bank_sync.enqueue_replay"
+					});
+				}
+			);
+		}, __("Banks"));
+	},
+});
@@ -5,11 +5,20 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 import base64
-import requests
 import json
+import time
 from datetime import datetime
 from urllib.parse import urlencode, urljoin
 
+import requests
+
+from erpnext_cyprus.utils.bank_accounts import provision_bank_accounts
+from erpnext_cyprus.utils.bank_api import get_bank_api_client
+from erpnext_cyprus.utils.bank_sync import fetch_bank_transactions, validate_unique_connection
+from erpnext_cyprus.utils.bank_tokens import clear_token, get_expires_at, get_token, set_token
+from erpnext_cyprus.utils.payment_context import PAYMENT_CURRENCY, BankPaymentError, PaymentContext
+from erpnext_cyprus.utils.payment_run import TRANSFER_PENDING, TRANSFER_UNKNOWN
+
 class HellenicBank(Document):
 
 	scopes = {
@@ -34,6 +43,7 @@ class HellenicBank(Document):
 			"/api/method/erpnext_cyprus.erpnext_cyprus.doctype.hellenic_bank.hellenic_bank.callback/" + self.name
 		)
 		self.redirect_uri = urljoin(base_url, callback_path)
+		validate_unique_connection(self)
 
 		# run if client_secrent is changed
 		string_to_encode = self.client_id + ':' + self.get_password("client_secret")
@@ -45,10 +55,17 @@ class HellenicBank(Document):
 		encoded_string = encoded_bytes.decode('utf-8')  # Convert the encoded bytes back to a string
 		return encoded_string
 
+	def get_api_client(self):
+		return get_bank_api_client(self.doctype)
+
 	def get_base_url_auth(self):
+		if frappe.conf.get("hellenic_bank_auth_url"):
+			return frappe.conf.get("hellenic_bank_auth_url")
 		return "https://sandbox-oauth.hellenicbank.com" if self.is_sandbox else "https://oauthprod.hellenicbank.com"
 
 	def get_base_url_api(self):
+		if frappe.conf.get("hellenic_bank_api_url"):
+			return frappe.conf.get("hellenic_bank_api_url")
 		return "https://sandbox-apis.hellenicbank.com" if self.is_sandbox else "https://apisprod.hellenicbank.com"
 
 	@frappe.whitelist()
@@ -71,33 +88,42 @@ class HellenicBank(Document):
 		authorization_url += "?" + urlencode(query_params)
 		return authorization_url
 	
+	def on_update(self):
+		clear_token(self.doctype, self.name)
+
 	def refresh_token(self):
-		authorization_code = json.loads(self.authorization_code)
-
-		# Check if the token is expired
-		now = datetime.now()
-		expires_at = datetime.fromtimestamp(authorization_code["expires_at"] / 1000)
-		if now > expires_at:
-			url = self.get_base_url_auth() + "/token"
-			payload = {
-				"grant_type": "refresh_token",
-				"refresh_token": authorization_code["refresh_token"]
-			}
-			string_to_encode = self.client_id + ':' + self.get_password("client_secret")
-			headers = {
-				"Authorization": "Basic " + base64.b64encode(string_to_encode.encode("utf-8")).decode("utf-8")
-			}
+		"""Current token, shared by all workers and refreshed by one of them shortly before it expires."""
+		return get_token(self.doctype, self.name, self.load_token, self.request_token)
+
+	def load_token(self):
+		authorization_code = frappe.db.get_value('Hellenic Bank', self.name, 'authorization_code')
+		if not authorization_code:
+			frappe.throw(_("Hellenic Bank {0} is not authorized").format(self.name))
+		authorization_code = json.loads(authorization_code)
+		return authorization_code, get_expires_at(authorization_code)
+
+	def request_token(self, authorization_code):
+		url = self.get_base_url_auth() + "/token"
+		payload = {
+			"grant_type": "refresh_token",
+			"refresh_token": authorization_code["refresh_token"]
+		}
+		string_to_encode = self.client_id + ':' + self.get_password("client_secret")
+		headers = {
+			"Authorization": "Basic " + base64.b64encode(string_to_encode.encode("utf-8")).decode("utf-8")
+		}
+
+		issued_at = time.time()
+		response = self.get_api_client().post(url, data=payload, headers=headers)
+		response_json = response.json()
+		if (response.status_code != 200):
+			frappe.throw(response_json["error"] + " - Authorize and try again")
+		# The refresh token is single use, store the new one before anything can roll back
+		frappe.db.set_value('Hellenic Bank', self.name, 'authorization_code', response.text)
+		frappe.db.commit()
+		self.authorization_code = response.text
+		return response_json, get_expires_at(response_json, issued_at)
 
-			response = requests.post(url, data=payload, headers=headers)
-			response_json = response.json()
-			if (response.status_code != 200):
-				frappe.throw(response_json["error"] + " - Authorize and try again")
-			frappe.db.set_value('Hellenic Bank', self.name, 'authorization_code', response.text)
-			frappe.db.commit()
-			return response.json()
-		else:
-			return authorization_code
-		
 	@frappe.whitelist()
 	def create_accounts(self):
 		authorization_code = self.refresh_token()
@@ -108,100 +134,93 @@ class HellenicBank(Document):
 			"x-client-id": self.client_id	
 		}
 
-		response = requests.get(url, params=payload, headers=headers)
+		response = self.get_api_client().get(url, params=payload, headers=headers)
 		response_json = response.json()
 		if (response.status_code != 200):
 			return response_json
 		
-		accounts = response_json["payload"]["accounts"]
-		for account in accounts:
-			if not frappe.db.exists('Bank Account', account["accountName"] + " - " + self.bank):
-				new_account = frappe.get_doc({
-					'doctype': 'Account',
-					'account_name': account["accountName"],
-					'parent_account': self.parent_account,
-					'account_type': 'Bank',
-					'account_currency': account["accountCurrencyCodes"],
-				})
-				new_account.insert()
-
-				bank_account = frappe.get_doc({
-					'doctype': 'Bank Account',
-					'account_name': account["accountName"],
-					'account': new_account.name,
-					'is_company_account': True,
-					'bank': self.bank,
-					'bank_account_no': account["accountNumber"],
-					'currency': account["accountCurrencyCodes"],
-					'iban': account["iban"],
-				})
-				bank_account.insert()
-				
+		provision_bank_accounts(self, [
+			{
+				"account_name": account["accountName"],
+				"account_no": account["accountNumber"],
+				"iban": account["iban"],
+				"currency": account["accountCurrencyCodes"],
+			}
+			for account in response_json["payload"]["accounts"]
+		])
 		return response_json
 
-	@frappe.whitelist()
-	def get_bank_transactions(self, bank_account, bank_statement_from_date, bank_statement_to_date):
-
-		bank_account_doc = frappe.get_doc("Bank Account", bank_account)
+	def get_statement_request(self, bank_account, bank_statement_from_date, bank_statement_to_date):
+		"""Prepare the statement request, so it can be sent from any thread."""
+		iban = frappe.db.get_value("Bank Account", bank_account, "iban")
 		dateFrom = datetime.strptime(bank_statement_from_date, '%Y-%m-%d').strftime('%Y%m%d0000')
 		dateTo = datetime.strptime(bank_statement_to_date, '%Y-%m-%d').strftime('%Y%m%d2359')
 
 		authorization_code = self.refresh_token()
-		url = self.get_base_url_api() + "/v1/b2b/account/report"
-		payload = {
-			"dateTo": dateTo,
-			"dateFrom": dateFrom,
-			"account": bank_account_doc.iban
-		}
-		headers = {
-			"Authorization": "Bearer " + authorization_code["access_token"],
-			"x-client-id": self.client_id	
+		return {
+			"method": "GET",
+			"url": self.get_base_url_api() + "/v1/b2b/account/report",
+			"params": {
+				"dateTo": dateTo,
+				"dateFrom": dateFrom,
+				"account": iban
+			},
+			"headers": {
+				"Authorization": "Bearer " + authorization_code["access_token"],
+				"x-client-id": self.client_id
+			},
 		}
 
-		response = requests.get(url, params=payload, headers=headers)
-		response_json = response.json()
-		if (response.status_code != 200):
-			return response_json
-		
-		transactions = response_json["payload"]["transactions"]
-		for transaction in transactions:
-			filters = {
-				'date': transaction["transactionValueDate"],
-				'reference_number': transaction["customerReference"]
+	@frappe.whitelist()
+	def get_bank_transactions(self, bank_account, bank_statement_from_date, bank_statement_to_date):
+
+		created = fetch_bank_transactions(bank_account, bank_statement_from_date, bank_statement_to_date, connection=self)
+		return {"created": created}
+
+	def parse_statement(self, response_json):
+		"""Map Hellenic Bank statement lines to the fields used by import_bank_transactions."""
+		return [
+			{
+				"date": transaction["transactionValueDate"],
+				"reference_number": transaction["customerReference"],
+				"description": transaction["paymentNotes"],
+				"amount": transaction["transactionAmount"],
 			}
-			amount = transaction["transactionAmount"]
-			if amount > 0:
-				filters["deposit"] = abs(amount)
-			else:
-				filters["withdrawal"] = abs(amount)
-			existing = frappe.db.get_list('Bank Transaction', filters=filters)
-
-			if (len(existing) == 0):
-				bank_transaction = frappe.get_doc({
-					"doctype": "Bank Transaction",
-					"bank_account": bank_account,
-					"status": "Pending",
-					"date": transaction["transactionValueDate"],
-					"reference_number": transaction["customerReference"],
-					"description": transaction["paymentNotes"],
-				})
-				if amount > 0:
-					bank_transaction.deposit = abs(amount)
-				else:
-					bank_transaction.withdrawal = abs(amount)
-
-				bank_transaction.insert()
-				bank_transaction.submit()
-				
-		return response_json
+			for transaction in response_json["payload"]["transactions"]
+		]
 	
-	def funds_availability(self, bank_account, amount):
-		iban = frappe.db.get_value('Bank Account', bank_account, 'iban')
+	def get_balance_request(self, bank_account):
+		"""Prepare the account details request, which carries the balances, so it can be sent from any thread."""
+		iban = frappe.db.get_value("Bank Account", bank_account, "iban")
+		authorization_code = self.refresh_token()
+		return {
+			"method": "GET",
+			"url": self.get_base_url_api() + "/v1/b2b/account/details",
+			"params": {
+				"account": iban
+			},
+			"headers": {
+				"Authorization": "Bearer " + authorization_code["access_token"],
+				"x-client-id": self.client_id
+			},
+		}
+
+	def parse_balance(self, response_json):
+		"""Map Hellenic Bank account details to the fields of a Bank Balance Snapshot."""
+		account = response_json["payload"]
+		return {
+			"currency": account["accountCurrencyCodes"],
+			"available_balance": account["availableBalance"],
+			"current_balance": account["ledgerBalance"],
+		}
+
+	def funds_availability(self, bank_account, amount, iban=None):
+		iban = iban or frappe.db.get_value('Bank Account', bank_account, 'iban')
 		authorization_code = self.refresh_token()
 		url = self.get_base_url_api() + "/v1/b2b/funds/availability"
 		payload = {
 			"amount": amount,
-			"accountCurrency": "EUR",
+			"accountCurrency": PAYMENT_CURRENCY,
 			"account": iban
 		}
 		headers = {
@@ -209,70 +228,26 @@ class HellenicBank(Document):
 			"x-client-id": self.client_id,
 		}
 
-		response = requests.get(url, params=payload, headers=headers)
+		response = self.get_api_client().get(url, params=payload, headers=headers)
 		response_json = response.json()
 		
 		if (response.status_code != 200):
-			error_message = "Error processing payment"
-			
-			try:
-				if "errors" in response_json and response_json["errors"]:
-					errors = []
-					for error in response_json["errors"]:
-						if "message" in error and error["message"]:
-							errors.append(error["message"])
-						elif "code" in error:
-							errors.append(f"Error code: {error['code']}")
-						
-						# Handle the nested params structure
-						if "params" in error and error["params"]:
-							for param_group in error["params"]:
-								for param in param_group:
-									if "errorCode" in param and "field" in param and "exposedName" in param["field"]:
-										field_name = param["field"]["exposedName"]
-										error_code = param["errorCode"]
-										errors.append(f"Field '{field_name}': {error_code}")
-					
-					if errors:
-						error_message = "Payment errors:\n• " + "\n• ".join(errors)
-				elif "payload" in response_json and "message" in response_json["payload"]:
-					error_message = response_json["payload"]["message"]
-			except Exception as e:
-				frappe.log_error(f"Error parsing Hellenic Bank response: {str(e)}\nResponse: {response_json}", 
-								 "Hellenic Bank API Error")
-			
-			frappe.throw(error_message)
+			frappe.throw(get_error_message(response_json))
 		
 		return True if response_json['payload'] == 'true' else False
 
-	@frappe.whitelist()
-	def single_payment(self, bank_account, party_bank_account, paid_amount, reference_no, reference_date, party_name):
-
-		available_funds = self.funds_availability(bank_account, paid_amount)
-		if not available_funds:
-			frappe.throw(_("Not enough funds available in the selected bank account."))
-
-		debtorBank = frappe.db.get_value('Bank Account', bank_account, 'bank')
-		debtorBic = frappe.db.get_value('Bank', debtorBank, 'swift_number')
-		debtorAccount = frappe.db.get_value('Bank Account', bank_account, 'iban')
-
-		beneficiaryBank = frappe.db.get_value('Bank Account', party_bank_account, 'bank')
-		beneficiaryBankBic = frappe.db.get_value('Bank', beneficiaryBank, 'swift_number')
-		beneficiaryAccount = frappe.db.get_value('Bank Account', party_bank_account, 'iban') 
+	def mass_payment(self, bank_account, transfers, execution_date, context=None):
+		"""Send many credit transfers from one account in a single request and return the mass transfer id."""
+		debtor = (context or PaymentContext(self)).get_bank_account(bank_account)
 
 		authorization_code = self.refresh_token()
-		url = self.get_base_url_api() + "/v1/b2b/credit/transfer"
+		url = self.get_base_url_api() + "/v1/b2b/credit/transfer/mass"
 		payload = {
-			"executionDate": reference_date,
-			"amount": paid_amount,
-			"debtorAccount": debtorAccount,
-			"beneficiaryAccount": beneficiaryAccount,
-			"beneficiaryName": party_name,
-			"currency": "EUR",
-			"debtorBic": debtorBic,
-			"beneficiaryBankBic": beneficiaryBankBic,
-			"customerReference": reference_no,
-			"paymentNotes": reference_no
+			"executionDate": execution_date,
+			"debtorAccount": debtor.iban,
+			"debtorBic": debtor.bic,
+			"currency": PAYMENT_CURRENCY,
+			"transfers": transfers
 		}
 		headers = {
 			"Authorization": "Bearer " + authorization_code["access_token"],
@@ -280,40 +255,112 @@ class HellenicBank(Document):
 			'Content-Type': 'application/json'
 		}
 
-		response = requests.post(url, json=payload, headers=headers)
+		# Without an answer the bank may have made the transfers
+		try:
+			response = self.get_api_client().post(url, json=payload, headers=headers)
+		except requests.RequestException as e:
+			raise BankPaymentError(str(e), transfer_status=TRANSFER_UNKNOWN)
+		if response.status_code >= 500:
+			raise BankPaymentError(response.text, transfer_status=TRANSFER_UNKNOWN)
+		if (response.status_code != 200):
+			frappe.throw(get_error_message(response.json()))
+
+		# Accepted without a readable id, the transfers may have been made
+		try:
+			return response.json()["payload"]["massTransferId"]
+		except (ValueError, KeyError, TypeError):
+			raise BankPaymentError(response.text, transfer_status=TRANSFER_UNKNOWN)
+
+	def submit_payment_run(self, bank_account, payment_entries, execution_date, context):
+		"""
+		Pay the entries of a run with one mass transfer.
+		Returns ({Payment Entry: (mass transfer id, transfer status)}, errors).
+		"""
+		transfers = [
+			{
+				"amount": pe.paid_amount,
+				"beneficiaryAccount": pe.beneficiary_account,
+				"beneficiaryName": pe.party_name,
+				"beneficiaryBankBic": pe.beneficiary_bic,
+				# The report is matched back to the Payment Entries by this reference
+				"customerReference": pe.name,
+				"paymentNotes": pe.reference_no,
+			}
+			for pe in payment_entries
+		]
+		try:
+			mass_transfer_id = self.mass_payment(bank_account, transfers, execution_date, context=context)
+		except BankPaymentError as e:
+			if not e.transfer_status:
+				raise
+			return {pe.name: (None, e.transfer_status) for pe in payment_entries}, [_("{0}: {1}").format(bank_account, e)]
+		return {pe.name: (mass_transfer_id, TRANSFER_PENDING) for pe in payment_entries}, []
+
+	def get_transfer_statuses(self, payment_entries):
+		"""Bank status of each payment, keyed by Payment Entry, with one report per mass transfer."""
+		mass_transfers = {}
+		for pe in payment_entries:
+			mass_transfers.setdefault(pe.custom_bank_transfer_id, []).append(pe.name)
+
+		statuses = {}
+		for mass_transfer_id, names in mass_transfers.items():
+			report = self.mass_payment_report(mass_transfer_id)
+			statuses.update({name: report[name] for name in names if report.get(name)})
+		return statuses
+
+	def mass_payment_report(self, mass_transfer_id):
+		"""Status of every transfer of a mass transfer, keyed by customer reference."""
+		authorization_code = self.refresh_token()
+		url = self.get_base_url_api() + "/v1/b2b/report/credit/transfer/mass"
+		payload = {
+			"massTransferId": mass_transfer_id
+		}
+		headers = {
+			"Authorization": "Bearer " + authorization_code["access_token"],
+			"x-client-id": self.client_id,
+		}
+
+		response = self.get_api_client().get(url, params=payload, headers=headers)
 		response_json = response.json()
 		if (response.status_code != 200):
-			error_message = "Error processing payment"
-			
-			try:
-				if "errors" in response_json and response_json["errors"]:
-					errors = []
-					for error in response_json["errors"]:
-						if "message" in error and error["message"]:
-							errors.append(error["message"])
-						elif "code" in error:
-							errors.append(f"Error code: {error['code']}")
-						
-						# Handle the nested params structure
-						if "params" in error and error["params"]:
-							for param_group in error["params"]:
-								for param in param_group:
-									if "errorCode" in param and "field" in param and "exposedName" in param["field"]:
-										field_name = param["field"]["exposedName"]
-										error_code = param["errorCode"]
-										errors.append(f"Field '{field_name}': {error_code}")
-					
-					if errors:
-						error_message = "Payment errors:\n• " + "\n• ".join(errors)
-				elif "payload" in response_json and "message" in response_json["payload"]:
-					error_message = response_json["payload"]["message"]
-			except Exception as e:
-				frappe.log_error(f"Error parsing Hellenic Bank response: {str(e)}\nResponse: {response_json}", 
-								 "Hellenic Bank API Error")
+			frappe.throw(get_error_message(response_json))
+
+		return {
+			transfer["customerReference"]: transfer["status"]
+			for transfer in response_json["payload"]["transfers"]
+		}
+
+def get_error_message(response_json):
+	"""Readable message out of a Hellenic Bank error response."""
+	error_message = "Error processing payment"
+	
+	try:
+		if "errors" in response_json and response_json["errors"]:
+			errors = []
+			for error in response_json["errors"]:
+				if "message" in error and error["message"]:
+					errors.append(error["message"])
+				elif "code" in error:
+					errors.append(f"Error code: {error['code']}")
+				
+				# Handle the nested params structure
+				if "params" in error and error["params"]:
+					for param_group in error["params"]:
+						for param in param_group:
+							if "errorCode" in param and "field" in param and "exposedName" in param["field"]:
+								field_name = param["field"]["exposedName"]
+								error_code = param["errorCode"]
+								errors.append(f"Field '{field_name}': {error_code}")
 			
-			frappe.throw(error_message)
-		
-		return response_json
+			if errors:
+				error_message = "Payment errors:\n• " + "\n• ".join(errors)
+		elif "payload" in response_json and "message" in response_json["payload"]:
+			error_message = response_json["payload"]["message"]
+	except Exception as e:
+		frappe.log_error(f"Error parsing Hellenic Bank response: {str(e)}\nResponse: {response_json}", 
+						 "Hellenic Bank API Error")
+	
+	return error_message
 
 @frappe.whitelist(methods=["GET"], allow_guest=True)
 def callback(code=None, state=None, error=None):
@@ -353,12 +400,15 @@ def callback(code=None, state=None, error=None):
 		"Authorization": "Basic " + hellenic_bank.encoded_auth
 	}
 
-	response = requests.post(url, data=payload, headers=headers)
+	issued_at = time.time()
+	response = hellenic_bank.get_api_client().post(url, data=payload, headers=headers)
 	if (response.status_code != 200):
 		frappe.throw(response.text)
 	frappe.db.set_value('Hellenic Bank', hellenic_bank.name, 'authorization_code', response.text)
 	frappe.db.set_value('Hellenic Bank', hellenic_bank.name, 'code', code)
 	frappe.db.commit()
+	response_json = response.json()
+	set_token('Hellenic Bank', hellenic_bank.name, response_json, get_expires_at(response_json, issued_at))
 
 	frappe.local.response["type"] = "redirect"
 	frappe.local.response["location"] = hellenic_bank.get_url()
@@ -1,9 +1,174 @@
 # Copyright (c) 2023, KAINOTOMO PH LTD and Contributors
 # See license.txt
 
-# import frappe
+import json
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from erpnext_cyprus.tests.bank_server import DEFAULT_ACCOUNTS, FakeBankServer
+from erpnext_cyprus.utils.bank_sync import SETTINGS_DOCTYPE
+from erpnext_cyprus.utils.bank_tokens import clear_token
+from erpnext_cyprus.utils.payment_context import PaymentContext
+from erpnext_cyprus.utils.payment_run import TRANSFER_PENDING, TRANSFER_UNKNOWN
+
+BANK = "_Test Fake Hellenic Bank"
+BANK_ACCOUNT = "_Test Fake Hellenic Account"
+PARTY_BANK_ACCOUNT = "_Test Fake Hellenic Party Account"
+TEST_SETTINGS = {"bank_api_max_retries": 3, "archive_bank_statements": 0}
+
 
 class TestHellenicBank(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = FakeBankServer(transactions_per_day=4).start()
+		cls.site_config = {key: frappe.conf.get(key) for key in cls.server.site_config}
+		frappe.local.conf.update(cls.server.site_config)
+		cls.settings = frappe.db.get_singles_dict(SETTINGS_DOCTYPE)
+		frappe.db.set_single_value(SETTINGS_DOCTYPE, TEST_SETTINGS)
+		frappe.clear_document_cache(SETTINGS_DOCTYPE, SETTINGS_DOCTYPE)
+
+		if not frappe.db.exists("Bank", BANK):
+			frappe.get_doc({"doctype": "Bank", "bank_name": BANK, "swift_number": "HEBACY2N"}).insert()
+		for account_name, iban in ((BANK_ACCOUNT, DEFAULT_ACCOUNTS[0]["iban"]), (PARTY_BANK_ACCOUNT, DEFAULT_ACCOUNTS[1]["iban"])):
+			if not frappe.db.exists("Bank Account", {"account_name": account_name}):
+				frappe.get_doc({
+					"doctype": "Bank Account",
+					"account_name": account_name,
+					"bank": BANK,
+					"iban": iban,
+				}).insert()
+		cls.bank_account = frappe.db.get_value("Bank Account", {"account_name": BANK_ACCOUNT})
+		cls.party_bank_account = frappe.db.get_value("Bank Account", {"account_name": PARTY_BANK_ACCOUNT})
+
+		# Payments are sent from EUR accounts only
+		parent_account = frappe.db.get_value(
+			"Account", {"is_group": 1, "root_type": "Asset"}, ["name", "company"], as_dict=True
+		)
+		ledger_account = frappe.db.get_value("Account", {"account_name": BANK_ACCOUNT, "company": parent_account.company})
+		if not ledger_account:
+			ledger_account = frappe.get_doc({
+				"doctype": "Account",
+				"account_name": BANK_ACCOUNT,
+				"parent_account": parent_account.name,
+				"company": parent_account.company,
+				"account_type": "Bank",
+				"account_currency": "EUR",
+			}).insert().name
+		frappe.db.set_value(
+			"Bank Account", cls.bank_account, {"account": ledger_account, "company": parent_account.company}
+		)
+
+		cls.hellenic_bank = frappe.get_doc({
+			"doctype": "Hellenic Bank",
+			"title": BANK,
+			"bank": BANK,
+			"parent_account": parent_account.name,
+			"client_id": "test-client",
+			"client_secret": "test-secret",
+			"allow_payments": 1,
+		}).insert()
+
+	@classmethod
+	def tearDownClass(cls):
+		frappe.db.delete("Bank Transaction", {"bank_account": cls.bank_account})
+		frappe.delete_doc("Hellenic Bank", cls.hellenic_bank.name, force=True)
+		frappe.db.commit()
+		frappe.db.set_single_value(SETTINGS_DOCTYPE, {key: cls.settings.get(key) for key in TEST_SETTINGS})
+		frappe.clear_document_cache(SETTINGS_DOCTYPE, SETTINGS_DOCTYPE)
+		frappe.local.conf.update(cls.site_config)
+		cls.server.stop()
+		super().tearDownClass()
+
+	def setUp(self):
+		self.authorize()
+
+	def authorize(self, ttl=None):
+		token = self.server.issue_token(ttl)
+		frappe.db.set_value("Hellenic Bank", self.hellenic_bank.name, "authorization_code", json.dumps(token))
+		clear_token("Hellenic Bank", self.hellenic_bank.name)
+		self.hellenic_bank.reload()
+		return token
+
+	def test_statement_import_is_idempotent(self):
+		response = self.hellenic_bank.get_bank_transactions(self.bank_account, "2026-01-01", "2026-01-03")
+		self.assertEqual(response["created"], 12)
+		self.assertEqual(frappe.db.count("Bank Transaction", {"bank_account": self.bank_account}), 12)
+
+		response = self.hellenic_bank.get_bank_transactions(self.bank_account, "2026-01-01", "2026-01-03")
+		self.assertEqual(response["created"], 0)
+
+	def test_expired_token_is_refreshed_once(self):
+		self.authorize(ttl=-60)
+		requests = self.server.count("/hellenic/auth/token")
+
+		first = self.hellenic_bank.refresh_token()
+		second = self.hellenic_bank.refresh_token()
+		self.assertEqual(first["access_token"], second["access_token"])
+		self.assertEqual(self.server.count("/hellenic/auth/token"), requests + 1)
+
+		# The single use refresh token was replaced in the database
+		stored = json.loads(frappe.db.get_value("Hellenic Bank", self.hellenic_bank.name, "authorization_code"))
+		self.assertEqual(stored["access_token"], first["access_token"])
+
+	def test_transient_errors_are_retried(self):
+		self.server.fail("/hellenic/api/v1/b2b/account/report", 503, 429)
+		response = self.hellenic_bank.get_bank_transactions(self.bank_account, "2026-02-01", "2026-02-01")
+		self.assertEqual(response["created"], 4)
+
+	def get_run_entry(self, name):
+		return frappe._dict(
+			name=name,
+			paid_amount=150,
+			beneficiary_account=DEFAULT_ACCOUNTS[1]["iban"],
+			beneficiary_bic="HEBACY2N",
+			party_name="Test Supplier",
+			reference_no=name,
+		)
+
+	def test_payment_run(self):
+		transfers, errors = self.hellenic_bank.submit_payment_run(
+			self.bank_account, [self.get_run_entry("PE-RUN-0")], "2026-01-15", PaymentContext(self.hellenic_bank)
+		)
+		mass_transfer_id, status = transfers["PE-RUN-0"]
+		self.assertEqual((status, errors), (TRANSFER_PENDING, []))
+		transfer = self.server.mass_transfers[mass_transfer_id]["transfers"][0]
+		self.assertEqual(transfer["beneficiaryAccount"], DEFAULT_ACCOUNTS[1]["iban"])
+		self.assertEqual(transfer["beneficiaryBankBic"], "HEBACY2N")
+
+	def test_payment_is_not_retried(self):
+		path = "/hellenic/api/v1/b2b/credit/transfer/mass"
+		requests = self.server.count(path)
+		self.server.fail(path, 503)
+		transfers, errors = self.hellenic_bank.submit_payment_run(
+			self.bank_account, [self.get_run_entry("PE-RUN-1")], "2026-01-15", PaymentContext(self.hellenic_bank)
+		)
+		self.assertEqual(transfers, {"PE-RUN-1": (None, TRANSFER_UNKNOWN)})
+		self.assertEqual(len(errors), 1)
+		self.assertEqual(self.server.count(path), requests + 1)
+
+	def test_insufficient_funds(self):
+		self.assertRaises(
+			frappe.ValidationError, PaymentContext(self.hellenic_bank).reserve_funds, self.bank_account, 10**9
+		)
+
+	def test_mass_payment_report(self):
+		transfers = [
+			{"amount": 10, "beneficiaryAccount": DEFAULT_ACCOUNTS[1]["iban"], "customerReference": f"PE-{i}"}
+			for i in range(3)
+		]
+		mass_transfer_id = self.hellenic_bank.mass_payment(self.bank_account, transfers, "2026-01-15")
+		report = self.hellenic_bank.mass_payment_report(mass_transfer_id)
+		self.assertEqual(report, {"PE-0": "EXECUTED", "PE-1": "EXECUTED", "PE-2": "EXECUTED"})
+
+	def test_create_accounts_matches_existing_accounts(self):
+		self.hellenic_bank.create_accounts()
+		self.hellenic_bank.create_accounts()
+
+		# Both remote accounts matched the test Bank Accounts by IBAN
+		self.assertEqual(frappe.db.count("Bank Account", {"bank": BANK}), 2)
+		self.assertEqual(
+			frappe.db.get_value("Bank Account", self.bank_account, "bank_account_no"),
+			DEFAULT_ACCOUNTS[0]["account_id"],
+		)
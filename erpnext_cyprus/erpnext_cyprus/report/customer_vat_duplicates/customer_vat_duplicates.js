@@ -0,0 +1,14 @@
+// Copyright (c) 2026, KAINOTOMO PH LTD and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Customer VAT Duplicates"] = {
+	"filters": [
+		{
+			fieldname: "customer_group",
+			label: __("Customer Group"),
+			fieldtype: "Link",
+			options: "Customer Group",
+			reqd: 0
+		}
+	]
+};
@@ -0,0 +1,93 @@
+# Copyright (c) 2026, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+
+from erpnext_cyprus.utils.vat_number import normalize_vat_number
+
+def get_columns():
+	columns = [
+		{
+			"label": _("VAT Number"),
+			"fieldname": "vat_number",
+			"fieldtype": "Data",
+			"width": 150,
+		},
+		{
+			"label": _("Customers"),
+			"fieldname": "cluster_size",
+			"fieldtype": "Int",
+			"width": 100,
+		},
+		{
+			"label": _("Customer"),
+			"fieldtype": "Link",
+			"fieldname": "name",
+			"options": "Customer",
+			"width": 200,
+		},
+		{
+			"label": _("Customer Name"),
+			"fieldname": "customer_name",
+			"fieldtype": "Data",
+			"width": 250,
+		},
+		{
+			"label": _("Tax ID"),
+			"fieldname": "tax_id",
+			"fieldtype": "Data",
+			"width": 150,
+		},
+		{
+			"label": _("Customer Group"),
+			"fieldname": "customer_group",
+			"fieldtype": "Link",
+			"options": "Customer Group",
+			"width": 150,
+		},
+		{
+			"label": _("Created On"),
+			"fieldname": "creation",
+			"fieldtype": "Datetime",
+			"width": 160,
+		},
+	]
+
+	return columns
+
+def get_duplicate_customers(customer_group=None):
+	"""All customers whose normalised VAT number is shared, found with one grouped query."""
+	conditions = ""
+	values = []
+	if customer_group:
+		conditions = "WHERE c.customer_group = %s"
+		values.append(customer_group)
+
+	return frappe.db.sql(
+		"""
+		SELECT c.name, c.customer_name, c.tax_id, c.customer_group, c.creation, dup.cluster_size
+		FROM `tabCustomer` c
+		INNER JOIN (
+			SELECT custom_tax_id_hash, COUNT(*) AS cluster_size
+			FROM `tabCustomer`
+			WHERE IFNULL(custom_tax_id_hash, '') != ''
+			GROUP BY custom_tax_id_hash
+			HAVING COUNT(*) > 1
+		) dup ON dup.custom_tax_id_hash = c.custom_tax_id_hash
+		{conditions}
+		ORDER BY dup.cluster_size DESC, c.custom_tax_id_hash, c.creation
+		""".format(conditions=conditions),
+		values,
+		as_dict=True,
+	)
+
+def execute(filters=None):
+	filters = filters or {}
+	columns = get_columns()
+
+	data = get_duplicate_customers(filters.get("customer_group"))
+	for row in data:
+		row.vat_number = normalize_vat_number(row.tax_id)
+
+	return columns, data
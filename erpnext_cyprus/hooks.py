@@ -47,7 +47,7 @@ doctype_js = {
     "Bank Reconciliation Tool": "public/js/bank_reconciliation_tool.js",
     "Payment Entry": "public/js/payment_entry.js",
 }
-# doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
+doctype_list_js = {"Payment Entry": "public/js/payment_entry_list.js"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
 
@@ -142,7 +142,10 @@ override_doctype_class = {
 
 doc_events = {
     "Customer": {
-        "validate": "erpnext_cyprus.utils.customer_group_assignment.assign_customer_group_based_on_vat"
+        "validate": [
+            "erpnext_cyprus.utils.vat_number.set_customer_vat_hash",
+            "erpnext_cyprus.utils.customer_group_assignment.assign_customer_group_based_on_vat",
+        ]
     },
     "Address": {
         "after_insert": "erpnext_cyprus.utils.customer_group_assignment.assign_customer_territory_based_on_country"
@@ -173,6 +176,24 @@ doc_events = {
 # 	],
 # }
 
+scheduler_events = {
+    "cron": {
+        "*/5 * * * *": [
+            "erpnext_cyprus.utils.vat_revalidation.retry_pending_vies_checks",
+            "erpnext_cyprus.utils.payment_run.update_pending_transfers",
+        ],
+        "*/15 * * * *": [
+            "erpnext_cyprus.utils.bank_balances.snapshot_all_bank_balances",
+        ],
+    },
+    "hourly_long": [
+        "erpnext_cyprus.utils.bank_sync.sync_all_bank_accounts",
+    ],
+    "daily": [
+        "erpnext_cyprus.utils.bank_balances.delete_old_snapshots",
+    ],
+}
+
 # Testing
 # -------
 
@@ -204,12 +225,12 @@ doc_events = {
 # Request Events
 # ----------------
 # before_request = ["erpnext_cyprus.utils.before_request"]
-# after_request = ["erpnext_cyprus.utils.after_request"]
+after_request = ["erpnext_cyprus.utils.bank_telemetry.flush"]
 
 # Job Events
 # ----------
 # before_job = ["erpnext_cyprus.utils.before_job"]
-# after_job = ["erpnext_cyprus.utils.after_job"]
+after_job = ["erpnext_cyprus.utils.bank_telemetry.flush"]
 
 # User Data Protection
 # --------------------
@@ -3,7 +3,9 @@ from frappe import _
 import json
 from erpnext.setup.doctype.company.company import Company
 from erpnext.setup.setup_wizard.operations.taxes_setup import setup_taxes_and_charges, from_detailed_data, update_regional_tax_settings
-from erpnext_cyprus.utils.customer_group_assignment import assign_customer_territory_based_on_country
+from erpnext_cyprus.utils.customer_group_assignment import bulk_assign_customer_territory
+
+CUSTOMER_ASSIGNMENT_CHECKPOINT_KEY = "erpnext_cyprus_customer_assignment_checkpoint"
 
 class CustomCompany(Company):
 	@frappe.whitelist()
@@ -12,7 +14,15 @@ class CustomCompany(Company):
 		setup_tax_template(company_name)
 		setup_tax_rules(company_name)
 		make_salary_components(company_name)
-		assign_customer_group_territory()
+		frappe.enqueue(
+			"erpnext_cyprus.overrides.company.assign_customer_group_territory",
+			queue="long",
+			timeout=60 * 60,
+			job_id="erpnext_cyprus_customer_group_territory",
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+		frappe.msgprint(_("Customer groups and territories are being assigned in the background."), alert=True)
 	
 	def create_default_accounts(self):
 		if self.country == "Cyprus":
@@ -786,78 +796,56 @@ def cyprus_coa():
 		},
 	}
 
-def assign_customer_group_territory():
+def assign_customer_group_territory(chunk_size=1000):
 	"""
-	Run assignment methods for all customers and their addresses
+	Background job assigning customer groups from tax_id and territories from
+	customer addresses, one chunk of customers at a time with set-based SQL.
+	The last committed chunk is checkpointed so a restarted job resumes there.
 	"""
-	print("\n=== Starting Customer Group and Territory Assignment ===\n")
-	
-	# Process all customers for VAT group assignment
-	customers = frappe.get_all("Customer", filters={"customer_name": ["!=", ""]}, fields=["name"])
-	count = 0
-	total = len(customers)
-	
-	for customer in customers:
-		try:
-			customer_doc = frappe.get_doc("Customer", customer.name)
-			assign_customer_group_based_on_vat(customer_doc)
-			customer_doc.save(ignore_permissions=True)
-			
-			count += 1                
-			if count % 100 == 0:
-				frappe.db.commit()
-				frappe.publish_progress(
-					percent=int(count * 100 / total),
-					title="Processing Customers",
-					description=f"Assigning customer groups ({count}/{total})"
-				)
-		except Exception as e:
-			frappe.log_error(f"Error processing customer {customer.name}: {str(e)}")
-	
-	frappe.db.commit()
-	
-	# Process all customer addresses for territory assignment
-	addresses = frappe.get_all(
-		"Address", 
-		filters=[["Dynamic Link", "link_doctype", "=", "Customer"]],
-		fields=["name"]
-	)
-	
-	count = 0
-	total = len(addresses)
-	
-	for address in addresses:
-		try:
-			address_doc = frappe.get_doc("Address", address.name)
-			assign_customer_territory_based_on_country(address_doc)
-			
-			count += 1
-			if count % 100 == 0:
-				frappe.db.commit()
-				frappe.publish_progress(
-					percent=int(count * 100 / total),
-					title="Processing Customers",
-					description=f"Assigning customer territory ({count}/{total})"
-				)
-		except Exception as e:
-			frappe.log_error(f"Error processing address {address.name}: {str(e)}")
-	
-	frappe.db.commit()
+	checkpoint = frappe.cache.get_value(CUSTOMER_ASSIGNMENT_CHECKPOINT_KEY) or ""
+
+	total = frappe.db.count("Customer", {"customer_name": ["!=", ""]})
+	done = frappe.db.count("Customer", {"customer_name": ["!=", ""], "name": ["<=", checkpoint]}) if checkpoint else 0
+
+	while True:
+		customers = frappe.db.sql_list(
+			"""
+			SELECT name FROM `tabCustomer`
+			WHERE name > %s AND customer_name != ''
+			ORDER BY name
+			LIMIT %s
+			""",
+			(checkpoint, chunk_size),
+		)
+		if not customers:
+			break
+
+		frappe.db.sql(
+			"""
+			UPDATE `tabCustomer`
+			SET
+				customer_group = IF(IFNULL(tax_id, '') != '', 'Commercial', 'Individual'),
+				customer_type = IF(IFNULL(tax_id, '') != '', 'Company', 'Individual')
+			WHERE name IN %s
+			""",
+			(tuple(customers),),
+		)
+		bulk_assign_customer_territory(customers)
+
+		frappe.db.commit()
+		checkpoint = customers[-1]
+		frappe.cache.set_value(CUSTOMER_ASSIGNMENT_CHECKPOINT_KEY, checkpoint, expires_in_sec=24 * 60 * 60)
+
+		done += len(customers)
+		frappe.publish_progress(
+			percent=int(done * 100 / total) if total else 100,
+			title="Processing Customers",
+			description=f"Assigning customer groups and territories ({done}/{total})"
+		)
+
+	frappe.cache.delete_value(CUSTOMER_ASSIGNMENT_CHECKPOINT_KEY)
 	frappe.publish_progress(
 		percent=100,
 		title="Processing Customers",
-		description="Completed territory assignment for {total} addresses"
+		description=f"Completed group and territory assignment for {total} customers"
 	)
-
-def assign_customer_group_based_on_vat(doc, method=None):
-	"""
-	Assigns 'Commercial' group if tax_id is a valid VIES VAT number, else 'Individual'.
-	Only proceeds if tax_id field is modified (dirty) and not empty.
-	"""
-		
-	if doc.tax_id and doc.tax_id != "":
-		doc.customer_group = "Commercial"
-		doc.customer_type = "Company"
-	else:
-		doc.customer_group = "Individual"
-		doc.customer_type = "Individual"
@@ -0,0 +1,31 @@
+import frappe
+from frappe.modules.utils import sync_customizations
+from frappe.utils import flt
+
+from erpnext_cyprus.utils.bank_transactions import get_import_key
+
+def execute():
+	# Custom fields are normally synced after patches; the unique column is needed now
+	sync_customizations("erpnext_cyprus")
+
+	transactions = frappe.get_all(
+		"Bank Transaction",
+		filters={"bank_account": ["is", "set"], "custom_import_key": ["is", "not set"]},
+		fields=["name", "bank_account", "reference_number", "date", "deposit", "withdrawal"],
+		order_by="creation",
+	)
+	existing = set(frappe.get_all(
+		"Bank Transaction", filters={"custom_import_key": ["is", "set"]}, pluck="custom_import_key"
+	))
+
+	updates = {}
+	for transaction in transactions:
+		amount = flt(transaction.deposit) - flt(transaction.withdrawal)
+		key = get_import_key(transaction.bank_account, transaction.reference_number, transaction.date, amount)
+		# Only the oldest of already duplicated transactions gets the key
+		if key in existing:
+			continue
+		existing.add(key)
+		updates[transaction.name] = {"custom_import_key": key}
+
+	frappe.db.bulk_update("Bank Transaction", updates, chunk_size=1000, update_modified=False)
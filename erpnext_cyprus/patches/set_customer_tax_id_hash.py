@@ -0,0 +1,16 @@
+import frappe
+from frappe.modules.utils import sync_customizations
+
+from erpnext_cyprus.utils.vat_number import get_vat_hash
+
+def execute():
+	# Custom fields are normally synced after patches; the hash column is needed now
+	sync_customizations("erpnext_cyprus")
+
+	customers = frappe.get_all(
+		"Customer",
+		filters={"tax_id": ["is", "set"]},
+		fields=["name", "tax_id"],
+	)
+	updates = {customer.name: {"custom_tax_id_hash": get_vat_hash(customer.tax_id)} for customer in customers}
+	frappe.db.bulk_update("Customer", updates, chunk_size=1000, update_modified=False)
@@ -1,10 +1,99 @@
 frappe.ui.form.on('Bank Reconciliation Tool', {
     refresh: function (frm) {
         frm.trigger('check_hellenic_bank');
+        frm.trigger('check_bank_of_cyprus');
+        frm.trigger('add_auto_match_button');
+        frm.trigger('add_statement_file_button');
     },
     
     bank_account: function(frm) {
         frm.trigger('check_hellenic_bank');
+        frm.trigger('check_bank_of_cyprus');
+        frm.trigger('add_auto_match_button');
+        frm.trigger('add_statement_file_button');
+    },
+    
+    add_auto_match_button: function(frm) {
+        frm.remove_custom_button(__('Auto Match'));
+        
+        if(frm.doc.bank_account) {
+            // Reconcile lines with the open payment or invoice of the same amount and reference
+            frm.add_custom_button(__('Auto Match'), function() {
+                frappe.call({
+                    method: "erpnext_cyprus.utils.bank_matching.enqueue_auto_matching",
+                    args: {
+                        bank_account: frm.doc.bank_account
+                    }
+                });
+            });
+        }
+    },
+    
+    add_statement_file_button: function(frm) {
+        frm.remove_custom_button(__('Import Statement File'));
+        
+        if(frm.doc.bank_account) {
+            // CAMT.053 or MT940 files downloaded from e-banking
+            frm.add_custom_button(__('Import Statement File'), function() {
+                const dialog = new frappe.ui.Dialog({
+                    title: __('Import Statement File'),
+                    fields: [
+                        {
+                            fieldname: 'file_url',
+                            fieldtype: 'Attach',
+                            label: __('CAMT.053 or MT940 File'),
+                            reqd: 1
+                        }
+                    ],
+                    primary_action_label: __('Import'),
+                    primary_action: function(values) {
+                        frappe.call({
+                            method: "erpnext_cyprus.utils.statement_files.enqueue_statement_file_import",
+                            args: {
+                                bank_account: frm.doc.bank_account,
+                                file_url: values.file_url
+                            }
+                        });
+                        dialog.hide();
+                    }
+                });
+                dialog.show();
+            });
+        }
+    },
+    
+    check_bank_of_cyprus: function(frm) {
+        frm.remove_custom_button(__('Retrieve Bank Transactions'), "Bank Of Cyprus");
+        
+        if(frm.doc.bank_account) {
+            // The connection serving the bank account's bank for its company
+            frappe.xcall('erpnext_cyprus.utils.bank_sync.get_bank_account_connection', {
+                bank_account: frm.doc.bank_account
+            }).then(function(connection) {
+                if(connection && connection.doctype == 'Bank Of Cyprus') {
+                    frm.add_custom_button(__('Retrieve Bank Transactions'), function() {
+                        if(frm.doc.bank_statement_from_date && frm.doc.bank_statement_to_date) {
+                            frappe.call({
+                                method: "erpnext_cyprus.erpnext_cyprus.doctype.bank_of_cyprus.bank_of_cyprus.get_bank_transactions",
+                                args: {
+                                    bank_account: frm.doc.bank_account,
+                                    bank_statement_from_date: frm.doc.bank_statement_from_date,
+                                    bank_statement_to_date: frm.doc.bank_statement_to_date
+                                },
+                                freeze: true,
+                                freeze_message: __('Retrieving transactions from Bank Of Cyprus...'),
+                                callback: function(response) {
+                                    frappe.msgprint(__("Successfully retrieved bank transactions"));
+                                    frm.trigger("make_reconciliation_tool");
+                                }
+                            });
+                        } else {
+                            frappe.msgprint(__("Please select From Date and To Date"));
+                        }
+                    }, __("Bank Of Cyprus"));
+                }
+            });
+        }
     },
     
     check_hellenic_bank: function(frm) {
@@ -12,54 +101,47 @@ frappe.ui.form.on('Bank Reconciliation Tool', {
         frm.remove_custom_button(__('Retrieve Bank Transactions'), "Hellenic Bank");
         
         if(frm.doc.bank_account) {
-            // Get the bank of the selected bank account
-            frappe.db.get_value('Bank Account', frm.doc.bank_account, 'bank', function(r) {
-                if(r && r.bank) {
-                    // Find the specific Hellenic Bank document that serves this bank
-                    frappe.db.get_list('Hellenic Bank', {
-                        filters: {'bank': r.bank, 'disabled': 0},
-                        fields: ['name'],
-                        limit: 1
-                    }).then(function(hellenic_banks) {
-                        if(hellenic_banks && hellenic_banks.length > 0) {
-                            const hellenic_bank_name = hellenic_banks[0].name;
-                            
-                            // Show the Retrieve Bank Transactions button
-                            frm.add_custom_button(__('Retrieve Bank Transactions'), function() {
-                                if(frm.doc.bank_statement_from_date && frm.doc.bank_statement_to_date) {
-                                    // Get the actual document first
-                                    frappe.model.with_doc('Hellenic Bank', hellenic_bank_name, function() {
-                                        var hellenic_bank_doc = frappe.model.get_doc('Hellenic Bank', hellenic_bank_name);
-                                        
-                                        // Now call the method directly on the document
-                                        frappe.call({
-                                            method: "get_bank_transactions",
-                                            doc: hellenic_bank_doc,
-                                            args: {
-                                                bank_account: frm.doc.bank_account,
-                                                bank_statement_from_date: frm.doc.bank_statement_from_date,
-                                                bank_statement_to_date: frm.doc.bank_statement_to_date
-                                            },
-                                            freeze: true,
-                                            freeze_message: __('Retrieving transactions from Hellenic Bank...'),
-                                            callback: function(response) {
-                                                if(response.message && response.message.errors) {
-                                                    frappe.msgprint(__("Error retrieving transactions: {0}", 
-                                                        [response.message.errors]), __("Error"));
-                                                } else {
-                                                    frappe.msgprint(__("Successfully retrieved bank transactions"));
-                                                    // Refresh the reconciliation tool to show new transactions
-                                                    frm.trigger("make_reconciliation_tool");
-                                                }
-                                            }
-                                        });
-                                    });
-                                } else {
-                                    frappe.msgprint(__("Please select From Date and To Date"));
-                                }
-                            }, __("Hellenic Bank"));
+            // The connection serving the bank account's bank for its company
+            frappe.xcall('erpnext_cyprus.utils.bank_sync.get_bank_account_connection', {
+                bank_account: frm.doc.bank_account
+            }).then(function(connection) {
+                if(connection && connection.doctype == 'Hellenic Bank') {
+                    const hellenic_bank_name = connection.name;
+                    
+                    // Show the Retrieve Bank Transactions button
+                    frm.add_custom_button(__('Retrieve Bank Transactions'), function() {
+                        if(frm.doc.bank_statement_from_date && frm.doc.bank_statement_to_date) {
+                            // Get the actual document first
+                            frappe.model.with_doc('Hellenic Bank', hellenic_bank_name, function() {
+                                var hellenic_bank_doc = frappe.model.get_doc('Hellenic Bank', hellenic_bank_name);
+                                
+                                // Now call the method directly on the document
+                                frappe.call({
+                                    method: "get_bank_transactions",
+                                    doc: hellenic_bank_doc,
+                                    args: {
+                                        bank_account: frm.doc.bank_account,
+                                        bank_statement_from_date: frm.doc.bank_statement_from_date,
+                                        bank_statement_to_date: frm.doc.bank_statement_to_date
+                                    },
+                                    freeze: true,
+                                    freeze_message: __('Retrieving transactions from Hellenic Bank...'),
+                                    callback: function(response) {
+                                        if(response.message && response.message.errors) {
+                                            frappe.msgprint(__("Error retrieving transactions: {0}", 
+                                                [response.message.errors]), __("Error"));
+                                        } else {
+                                            frappe.msgprint(__("Successfully retrieved bank transactions"));
+                                            // Refresh the reconciliation tool to show new transactions
+                                            frm.trigger("make_reconciliation_tool");
+                                        }
+                                    }
+                                });
+                            });
+                        } else {
+                            frappe.msgprint(__("Please select From Date and To Date"));
                         }
-                    });
+                    }, __("Hellenic Bank"));
                 }
             });
         }
@@ -1,78 +1,77 @@
 frappe.ui.form.on('Payment Entry', {
     refresh: function (frm) {
-        frm.trigger('check_hellenic_bank_transfer');
+        frm.trigger('check_wire_transfer');
+        frm.trigger('check_unknown_bank_transfer');
     },
     
     bank_account: function(frm) {
-        frm.trigger('check_hellenic_bank_transfer');
+        frm.trigger('check_wire_transfer');
     },
     
     party_bank_account: function(frm) {
-        frm.trigger('check_hellenic_bank_transfer');
+        frm.trigger('check_wire_transfer');
     },
     
-    check_hellenic_bank_transfer: function(frm) {
-        // Clear any existing Hellenic Bank buttons
-        frm.remove_custom_button(__('Wire Transfer'), "Hellenic Bank");
-        
-        if(frm.doc.bank_account && frm.doc.party_bank_account && frm.doc.docstatus == 1) {
-            // Get the bank of the selected bank account
-            frappe.db.get_value('Bank Account', frm.doc.bank_account, 'bank', function(r) {
-                if(r && r.bank) {
-                    // Check if this bank is linked to any Hellenic Bank doctype
-                    frappe.db.get_list('Hellenic Bank', {
-                        filters: {'bank': r.bank, 'disabled': 0, 'allow_payments': 1},
-                        fields: ['name'],
-                        limit: 1
-                    }).then(function(hellenic_banks) {
-                        if(hellenic_banks && hellenic_banks.length > 0) {
-                            const hellenic_bank_name = hellenic_banks[0].name;
-                            
-                            // Add the Wire Transfer button
-                            frm.add_custom_button(__('Wire Transfer'), function() {
-                                if(frm.doc.payment_type == "Pay" && 
-                                   frm.doc.paid_amount && 
-                                   frm.doc.reference_no && 
-                                   frm.doc.reference_date && 
-                                   frm.doc.party_name) {
-                                    
-                                    // Get the Hellenic Bank doc and call the method
-                                    frappe.model.with_doc('Hellenic Bank', hellenic_bank_name, function() {
-                                        var hellenic_bank_doc = frappe.model.get_doc('Hellenic Bank', hellenic_bank_name);
-                                        
-                                        frappe.call({
-                                            method: "single_payment",
-                                            doc: hellenic_bank_doc,
-                                            args: {
-                                                bank_account: frm.doc.bank_account,
-                                                party_bank_account: frm.doc.party_bank_account,
-                                                paid_amount: frm.doc.paid_amount,
-                                                reference_no: frm.doc.reference_no,
-                                                reference_date: frm.doc.reference_date,
-                                                party_name: frm.doc.party_name
-                                            },
-                                            freeze: true,
-                                            freeze_message: __('Processing payment via Hellenic Bank...'),
-                                            callback: function(response) {
-                                                if(response.message && !response.message.errors) {
-                                                    frappe.msgprint(response.message, __("Error"));
-                                                    frm.reload_doc();
-                                                }
-                                                if(response.message.payload && !response.message.errors) {
-                                                    frappe.msgprint(response.message.payload, __("Success"));
-                                                    frm.reload_doc();
-                                                }
-                                            }
-                                        });
-                                    });
-                                } else {
-                                    frappe.msgprint(__("Payment type must be Pay, and all of these fields are required: Paid Amount, Reference No, Reference Date, and Party Name"));
-                                }
-                            }, __("Hellenic Bank"));
+    check_unknown_bank_transfer: function(frm) {
+        const status = frm.doc.custom_bank_transfer_status;
+        if(frm.doc.docstatus == 1 && (status == "Unknown" || status == "Processing")) {
+            frm.dashboard.set_headline_alert(
+                status == "Unknown"
+                    ? __("The bank did not confirm this transfer, it may have been made. Check with the bank before paying it again.")
+                    : __("This transfer is being sent to the bank. If its payment run stopped, check with the bank before paying it again."),
+                "orange"
+            );
+            frm.add_custom_button(__('Reset Bank Transfer'), function() {
+                frappe.confirm(__('Has the bank confirmed that this transfer was not made? It can then be paid again.'), function() {
+                    frappe.call({
+                        method: 'erpnext_cyprus.utils.payment_run.reset_bank_transfer',
+                        args: {
+                            payment_entry: frm.doc.name
+                        },
+                        callback: function() {
+                            frm.reload_doc();
                         }
                     });
+                });
+            });
+        }
+    },
+
+    check_wire_transfer: function(frm) {
+        frm.remove_custom_button(__('Wire Transfer'), "Bank Of Cyprus");
+        frm.remove_custom_button(__('Wire Transfer'), "Hellenic Bank");
+
+        // Entries with a transfer status were sent already, rejected ones can be sent again
+        const status = frm.doc.custom_bank_transfer_status;
+        if(frm.doc.bank_account && frm.doc.party_bank_account && frm.doc.docstatus == 1 &&
+           frm.doc.payment_type == "Pay" && (!status || status == "Rejected" || status == "Initiated")) {
+            // The connection serving the bank account's bank for its company
+            frappe.xcall('erpnext_cyprus.utils.bank_sync.get_bank_account_connection', {
+                bank_account: frm.doc.bank_account
+            }).then(function(connection) {
+                if(connection && connection.allow_payments) {
+                    frm.add_custom_button(__('Wire Transfer'), function() {
+                        frappe.call({
+                            method: 'erpnext_cyprus.utils.payment_run.pay_payment_entry',
+                            args: {
+                                payment_entry: frm.doc.name
+                            },
+                            freeze: true,
+                            freeze_message: __('Processing payment via {0}...', [connection.doctype]),
+                            callback: function(response) {
+                                if(response.message) {
+                                    if(response.message.errors.length) {
+                                        frappe.msgprint(response.message.errors.join('<br>'), __("Error"));
+                                    } else {
+                                        frappe.msgprint(__("Payment {0} submitted to the bank", [response.message.transfers[frm.doc.name]]), __("Success"));
+                                    }
+                                }
+                                frm.reload_doc();
+                            }
+                        });
+                    }, __(connection.doctype));
                 }
             });
         }
     }
-});
\ No newline at end of file
+});
@@ -0,0 +1,35 @@
+frappe.listview_settings['Payment Entry'] = frappe.listview_settings['Payment Entry'] || {};
+
+const erpnext_cyprus_payment_entry_onload = frappe.listview_settings['Payment Entry'].onload;
+
+frappe.listview_settings['Payment Entry'].onload = function(listview) {
+    if (erpnext_cyprus_payment_entry_onload) {
+        erpnext_cyprus_payment_entry_onload(listview);
+    }
+
+    listview.page.add_action_item(__('Bank Transfer'), function() {
+        const payment_entries = listview.get_checked_items(true);
+        if (!payment_entries.length) {
+            frappe.msgprint(__('Select the Payment Entries to pay'));
+            return;
+        }
+
+        frappe.confirm(__('Transfer {0} payments through their banks?', [payment_entries.length]), function() {
+            frappe.call({
+                method: 'erpnext_cyprus.utils.payment_run.create_payment_run',
+                args: {
+                    payment_entries: payment_entries
+                },
+                callback: function(response) {
+                    if (response.message) {
+                        frappe.msgprint(
+                            __('{0} payments are being sent to their banks, their statuses are updated as the banks process them.', [response.message.length]),
+                            __('Bank Transfer')
+                        );
+                        listview.refresh();
+                    }
+                }
+            });
+        });
+    });
+};
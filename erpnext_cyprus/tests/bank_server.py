@@ -0,0 +1,497 @@
+"""
+Local stand-in for the Bank of Cyprus and Hellenic Bank APIs.
+
+Serves the OAuth, account list, balance, statement, funds availability and
+payment endpoints used by the connectors, with synthetic statements of any
+size, so tests and benchmarks run without the banks' sandboxes. Point a site
+at it with `bank_of_cyprus_url`, `hellenic_bank_auth_url` and
+`hellenic_bank_api_url` in site config (see `FakeBankServer.site_config`), or
+start it from the command line:
+
+	python -m erpnext_cyprus.tests.bank_server --port 8090 --transactions-per-day 50 --latency 0.05
+
+With `--recordings` every answer is served from, or with `--upstream-*` first
+recorded to, a directory of captured responses, so real sandbox traffic can
+be replayed offline.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+
+BANK_OF_CYPRUS = "bank_of_cyprus"
+HELLENIC_BANK_AUTH = "hellenic_bank_auth"
+HELLENIC_BANK_API = "hellenic_bank_api"
+PREFIXES = {
+	BANK_OF_CYPRUS: "/boc",
+	HELLENIC_BANK_AUTH: "/hellenic/auth",
+	HELLENIC_BANK_API: "/hellenic/api",
+}
+
+DEFAULT_ACCOUNTS = [
+	{"account_id": "351012345671", "iban": "CY17002001280000001200527600", "name": "Current Account", "currency": "EUR", "balance": 100000},
+	{"account_id": "351012345672", "iban": "CY21002001950000357001234567", "name": "Savings Account", "currency": "EUR", "balance": 2500},
+]
+
+class FakeBankServer:
+	"""
+	Threaded fake of both banks' APIs.
+
+	- `accounts`: dicts with `account_id`, `iban`, `name`, `currency` and `balance`
+	- `transactions_per_day`: statement lines generated per account and day
+	- `latency`: seconds to wait before every answer
+	- `error_status`, `error_rate`: status returned for a random share of API requests
+	- `retry_after`: `Retry-After` header sent with injected 429 and 503 errors
+	- `token_ttl`: lifetime in seconds of issued access tokens
+	- `recordings`, `upstreams`: replay captured responses, recording missing ones from the real APIs
+
+	Payments sent are kept in `transfers`, `mass_transfers` and `payments`.
+	"""
+
+	def __init__(self, accounts=None, transactions_per_day=3, latency=0, error_status=503, error_rate=0,
+			retry_after=0, token_ttl=3600, recordings=None, upstreams=None, host="127.0.0.1", port=0):
+		self.accounts = [dict(account) for account in accounts or DEFAULT_ACCOUNTS]
+		self.transactions_per_day = transactions_per_day
+		self.latency = latency
+		self.error_status = error_status
+		self.error_rate = error_rate
+		self.retry_after = retry_after
+		self.token_ttl = token_ttl
+		self.recordings = recordings
+		self.upstreams = upstreams or {}
+		self.requests = {}
+		self.queued_errors = {}
+		self.access_tokens = {}
+		self.refresh_tokens = set()
+		self.subscriptions = {}
+		self.transfers = []
+		self.mass_transfers = {}
+		self.payments = {}
+		self.lock = threading.Lock()
+		self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+		self.httpd.daemon_threads = True
+		self.thread = None
+
+	@property
+	def base_url(self):
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}"
+
+	@property
+	def site_config(self):
+		"""Site config keys pointing the connectors at this server."""
+		return {
+			"bank_of_cyprus_url": self.base_url + PREFIXES[BANK_OF_CYPRUS],
+			"hellenic_bank_auth_url": self.base_url + PREFIXES[HELLENIC_BANK_AUTH],
+			"hellenic_bank_api_url": self.base_url + PREFIXES[HELLENIC_BANK_API],
+		}
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def count(self, path):
+		"""Requests received for a path, e.g. "/hellenic/auth/token"."""
+		return self.requests.get(path, 0)
+
+	def fail(self, path, *statuses):
+		"""Answer the next requests for `path` with `statuses`, one each, before serving it again."""
+		with self.lock:
+			self.queued_errors.setdefault(path, []).extend(statuses)
+
+	def issue_token(self, ttl=None):
+		"""A Hellenic Bank style token response; `ttl` may be negative to get an expired token."""
+		access_token = uuid.uuid4().hex
+		refresh_token = uuid.uuid4().hex
+		expires_at = time.time() + (self.token_ttl if ttl is None else ttl)
+		with self.lock:
+			self.access_tokens[access_token] = expires_at
+			self.refresh_tokens.add(refresh_token)
+		return {
+			"access_token": access_token,
+			"refresh_token": refresh_token,
+			"token_type": "Bearer",
+			"expires_in": max(int(expires_at - time.time()), 0),
+			"expires_at": int(expires_at * 1000),
+		}
+
+	def get_account(self, key, value):
+		return next((account for account in self.accounts if account[key] == value), None)
+
+	def get_transactions(self, account, from_date, to_date):
+		"""Deterministic synthetic statement lines of an account, the same on every call."""
+		transactions = []
+		day = from_date
+		while day <= to_date:
+			generator = random.Random(f"{account['account_id']}|{day}")
+			for i in range(self.transactions_per_day):
+				amount = round(generator.uniform(1, 5000), 2)
+				transactions.append({
+					"id": f"{account['account_id']}-{day:%Y%m%d}-{i:04d}",
+					"date": day,
+					"amount": amount if generator.random() < 0.5 else -amount,
+					"description": f"Synthetic transaction {i + 1} of {day}",
+				})
+			day += timedelta(days=1)
+		return transactions
+
+	# Routing
+
+	def handle(self, method, path, query, body, headers):
+		"""Return (status, payload, headers) for one request."""
+		api, route = get_route(path)
+		if not api:
+			return 404, {"error": "not_found"}, {}
+
+		with self.lock:
+			queued = self.queued_errors.get(path)
+			status = queued.pop(0) if queued else None
+		if status is None and self.error_rate and api != HELLENIC_BANK_AUTH and random.random() < self.error_rate:
+			status = self.error_status
+		if status:
+			extra_headers = {"Retry-After": str(self.retry_after)} if status in (429, 503) else {}
+			return status, {"errors": [{"code": str(status), "message": "Injected error"}]}, extra_headers
+
+		if api == BANK_OF_CYPRUS:
+			return self.handle_bank_of_cyprus(method, route, query, body, headers)
+		if api == HELLENIC_BANK_AUTH:
+			return self.handle_hellenic_auth(method, route, query, body, headers)
+		return self.handle_hellenic_api(method, route, query, body, headers)
+
+	def is_authorized(self, headers):
+		token = (headers.get("Authorization") or "").removeprefix("Bearer ")
+		with self.lock:
+			expires_at = self.access_tokens.get(token)
+		return bool(expires_at) and expires_at > time.time()
+
+	def handle_bank_of_cyprus(self, method, route, query, body, headers):
+		if method == "POST" and route == "/oauth2/token":
+			token = self.issue_token()
+			token.pop("expires_at")
+			token["consented_on"] = int(time.time())
+			return 200, token, {}
+
+		if not self.is_authorized(headers):
+			return 401, {"error": "invalid_token"}, {}
+
+		if method == "POST" and route == "/v1/subscriptions":
+			subscription_id = "Subid" + uuid.uuid4().hex[:12]
+			self.subscriptions[subscription_id] = json.loads(body or "{}")
+			return 201, {"subscriptionId": subscription_id, "status": "AWAU"}, {}
+
+		if route.startswith("/v1/subscriptions/"):
+			subscription_id = route.rsplit("/", 1)[1]
+			subscription = {
+				"subscriptionId": subscription_id,
+				"status": "ACTV",
+				"selectedAccounts": [{"accountId": a["account_id"]} for a in self.accounts],
+				"accounts": {"transactionHistory": True, "balance": True, "details": True, "checkFundsAvailability": True},
+				"payments": {"limit": 99999999, "currency": "EUR", "amount": 99999999},
+				"customerInformation": {},
+			}
+			return 200, [subscription] if method == "GET" else subscription, {}
+
+		if method == "GET" and route == "/v1/accounts":
+			return 200, [
+				{
+					"accountId": a["account_id"],
+					"accountName": a["name"],
+					"IBAN": a["iban"],
+					"currency": a["currency"],
+					"balances": [{"amount": a["balance"], "balanceType": "AVAILABLE"}],
+				}
+				for a in self.accounts
+			], {}
+
+		if method == "POST" and route == "/v1/payments/initiate":
+			payment = json.loads(body)
+			payment["paymentId"] = "PMT" + uuid.uuid4().hex[:12]
+			payment["status"] = {"code": "PNDG", "description": "Pending"}
+			with self.lock:
+				self.payments[payment["paymentId"]] = payment
+			return 201, {"payment": payment, "authCodeNeeded": False}, {}
+
+		if route.startswith("/v1/payments/"):
+			payment = self.payments.get(route.split("/")[3])
+			if not payment:
+				return 404, {"error": "payment_not_found"}, {}
+			if method == "POST" and route.endswith("/execute"):
+				payment["status"] = {"code": "CPLT", "description": "Completed"}
+				return 200, {"payment": payment}, {}
+			if method == "GET" and route.endswith("/status"):
+				return 200, payment["status"], {}
+
+		if method == "GET" and route.startswith("/v1/accounts/") and route.endswith("/balance"):
+			account = self.get_account("account_id", route.split("/")[3])
+			if not account:
+				return 404, {"error": "account_not_found"}, {}
+			return 200, [{
+				"accountId": account["account_id"],
+				"currency": account["currency"],
+				"balances": [
+					{"amount": account["balance"], "balanceType": "AVAILABLE"},
+					{"amount": account["balance"], "balanceType": "CURRENT"},
+				],
+			}], {}
+
+		if method == "GET" and route.startswith("/v1/accounts/") and route.endswith("/statement"):
+			account = self.get_account("account_id", route.split("/")[3])
+			if not account:
+				return 404, {"error": "account_not_found"}, {}
+			from_date = datetime.strptime(query["startDate"], "%d/%m/%Y").date()
+			to_date = datetime.strptime(query["endDate"], "%d/%m/%Y").date()
+			return 200, {
+				"account": {"accountId": account["account_id"]},
+				"transaction": [
+					{
+						"id": t["id"],
+						"dcInd": "CREDIT" if t["amount"] > 0 else "DEBIT",
+						"transactionAmount": {"amount": abs(t["amount"]), "currency": account["currency"]},
+						"description": t["description"],
+						"postingDate": f"{t['date']:%d/%m/%Y}",
+						"valueDate": f"{t['date']:%d/%m/%Y}",
+						"transactionType": "TRANSFER",
+					}
+					for t in self.get_transactions(account, from_date, to_date)
+				],
+			}, {}
+
+		return 404, {"error": "not_found"}, {}
+
+	def handle_hellenic_auth(self, method, route, query, body, headers):
+		if method == "GET" and route == "/oauth2/auth":
+			location = query["redirect_uri"] + "?" + urlencode({"code": uuid.uuid4().hex, "state": query.get("state", "")})
+			return 302, {}, {"Location": location}
+
+		form = {key: values[0] for key, values in parse_qs(body).items()}
+		if method == "POST" and route == "/token/exchange" and form.get("code"):
+			return 200, self.issue_token(), {}
+
+		if method == "POST" and route == "/token":
+			with self.lock:
+				valid = form.get("refresh_token") in self.refresh_tokens
+				# Refresh tokens are single use
+				self.refresh_tokens.discard(form.get("refresh_token"))
+			if not valid:
+				return 400, {"error": "invalid_grant"}, {}
+			return 200, self.issue_token(), {}
+
+		return 404, {"error": "not_found"}, {}
+
+	def handle_hellenic_api(self, method, route, query, body, headers):
+		if not self.is_authorized(headers):
+			return 401, {"errors": [{"code": "401", "message": "Invalid token"}]}, {}
+
+		if method == "GET" and route == "/v1/b2b/account/list":
+			return 200, {"payload": {"accounts": [
+				{
+					"accountNumber": a["account_id"],
+					"accountName": a["name"],
+					"iban": a["iban"],
+					"accountCurrencyCodes": a["currency"],
+				}
+				for a in self.accounts
+			]}}, {}
+
+		if method == "GET" and route == "/v1/b2b/account/report":
+			account = self.get_account("iban", query.get("account"))
+			if not account:
+				return 404, {"errors": [{"code": "404", "message": "Account not found"}]}, {}
+			from_date = datetime.strptime(query["dateFrom"][:8], "%Y%m%d").date()
+			to_date = datetime.strptime(query["dateTo"][:8], "%Y%m%d").date()
+			return 200, {"payload": {"transactions": [
+				{
+					"transactionValueDate": f"{t['date']:%Y-%m-%d}",
+					"customerReference": t["id"],
+					"paymentNotes": t["description"],
+					"transactionAmount": t["amount"],
+				}
+				for t in self.get_transactions(account, from_date, to_date)
+			]}}, {}
+
+		if method == "GET" and route == "/v1/b2b/account/details":
+			account = self.get_account("iban", query.get("account"))
+			if not account:
+				return 404, {"errors": [{"code": "404", "message": "Account not found"}]}, {}
+			return 200, {"payload": {
+				"accountNumber": account["account_id"],
+				"iban": account["iban"],
+				"accountCurrencyCodes": account["currency"],
+				"availableBalance": account["balance"],
+				"ledgerBalance": account["balance"],
+			}}, {}
+
+		if method == "GET" and route == "/v1/b2b/funds/availability":
+			account = self.get_account("iban", query.get("account"))
+			available = bool(account) and account["balance"] >= float(query.get("amount") or 0)
+			return 200, {"payload": "true" if available else "false"}, {}
+
+		if method == "POST" and route == "/v1/b2b/credit/transfer":
+			transfer = json.loads(body)
+			with self.lock:
+				self.transfers.append(transfer)
+			return 200, {"payload": {"transferId": uuid.uuid4().hex, "status": "PENDING"}}, {}
+
+		if method == "POST" and route == "/v1/b2b/credit/transfer/mass":
+			mass_transfer = json.loads(body)
+			mass_transfer_id = uuid.uuid4().hex
+			with self.lock:
+				self.mass_transfers[mass_transfer_id] = mass_transfer
+			return 200, {"payload": {"massTransferId": mass_transfer_id}}, {}
+
+		if method == "GET" and route == "/v1/b2b/report/credit/transfer/mass":
+			mass_transfer = self.mass_transfers.get(query.get("massTransferId"))
+			if not mass_transfer:
+				return 404, {"errors": [{"code": "404", "message": "Mass transfer not found"}]}, {}
+			return 200, {"payload": {"transfers": [
+				{"customerReference": t["customerReference"], "status": "EXECUTED"}
+				for t in mass_transfer["transfers"]
+			]}}, {}
+
+		return 404, {"errors": [{"code": "404", "message": "Not found"}]}, {}
+
+	# Record and replay
+
+	def get_recording_path(self, method, path, query):
+		key = hashlib.sha1(f"{method} {path}?{urlencode(sorted(query.items()))}".encode()).hexdigest()
+		return os.path.join(self.recordings, f"{key}.json")
+
+	def replay(self, method, path, query, body, headers):
+		"""Serve a captured response, capturing it from the upstream API first if missing."""
+		recording_path = self.get_recording_path(method, path, query)
+		if not os.path.exists(recording_path):
+			api, route = get_route(path)
+			if api not in self.upstreams:
+				return None
+			response = requests.request(
+				method,
+				self.upstreams[api] + route,
+				params=query,
+				data=body,
+				headers={k: v for k, v in headers.items() if k.lower() not in ("host", "content-length")},
+				timeout=60,
+			)
+			with open(recording_path, "w") as f:
+				json.dump({"status": response.status_code, "body": response.text}, f)
+
+		with open(recording_path) as f:
+			recording = json.load(f)
+		return recording["status"], recording["body"], {}
+
+	def make_handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				self.answer("GET")
+
+			def do_POST(self):
+				self.answer("POST")
+
+			def do_PATCH(self):
+				self.answer("PATCH")
+
+			def answer(self, method):
+				parts = urlsplit(self.path)
+				query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+				body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+				with server.lock:
+					server.requests[parts.path] = server.requests.get(parts.path, 0) + 1
+
+				if server.latency:
+					time.sleep(server.latency)
+
+				result = None
+				if server.recordings:
+					result = server.replay(method, parts.path, query, body, dict(self.headers))
+				if result is None:
+					result = server.handle(method, parts.path, query, body, self.headers)
+				status, payload, headers = result
+
+				payload = (payload if isinstance(payload, str) else json.dumps(payload, default=str)).encode("utf-8")
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(payload)))
+				for key, value in headers.items():
+					self.send_header(key, value)
+				self.end_headers()
+				self.wfile.write(payload)
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+def get_route(path):
+	"""(api, path below the api's prefix), or (None, None) for unknown paths."""
+	for api, prefix in PREFIXES.items():
+		if path.startswith(prefix + "/"):
+			return api, path[len(prefix):]
+	return None, None
+
+def main():
+	parser = argparse.ArgumentParser(description="Local Bank of Cyprus and Hellenic Bank API stand-in")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8090)
+	parser.add_argument("--transactions-per-day", type=int, default=3)
+	parser.add_argument("--latency", type=float, default=0)
+	parser.add_argument("--error-status", type=int, default=503)
+	parser.add_argument("--error-rate", type=float, default=0)
+	parser.add_argument("--retry-after", type=int, default=0)
+	parser.add_argument("--token-ttl", type=int, default=3600)
+	parser.add_argument("--recordings", help="Directory of captured responses to replay")
+	parser.add_argument("--upstream-bank-of-cyprus", help="Real API base URL recorded on a replay miss")
+	parser.add_argument("--upstream-hellenic-bank-auth")
+	parser.add_argument("--upstream-hellenic-bank-api")
+	args = parser.parse_args()
+
+	upstreams = {
+		BANK_OF_CYPRUS: args.upstream_bank_of_cyprus,
+		HELLENIC_BANK_AUTH: args.upstream_hellenic_bank_auth,
+		HELLENIC_BANK_API: args.upstream_hellenic_bank_api,
+	}
+	if args.recordings:
+		os.makedirs(args.recordings, exist_ok=True)
+
+	server = FakeBankServer(
+		transactions_per_day=args.transactions_per_day,
+		latency=args.latency,
+		error_status=args.error_status,
+		error_rate=args.error_rate,
+		retry_after=args.retry_after,
+		token_ttl=args.token_ttl,
+		recordings=args.recordings,
+		upstreams={api: url for api, url in upstreams.items() if url},
+		host=args.host,
+		port=args.port,
+	)
+	print("Fake banks listening, site config:")
+	print(json.dumps(server.site_config, indent=1))
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		server.stop()
+
+if __name__ == "__main__":
+	main()
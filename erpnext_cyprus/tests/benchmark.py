@@ -0,0 +1,95 @@
+"""
+Offline benchmarks, run against a site with bench execute, e.g.
+
+	bench --site test.local execute erpnext_cyprus.tests.benchmark.customer_import --kwargs "{'count': 500}"
+
+All changes are rolled back, or deleted when the code under test commits, at the end.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import add_days
+
+from erpnext_cyprus.tests.bank_server import DEFAULT_ACCOUNTS, FakeBankServer
+from erpnext_cyprus.tests.vies_server import FakeViesServer
+
+def customer_import(count=200, latency=0.05, valid_ratio=0.5):
+	"""Insert `count` customers with VAT numbers, validated against the local VIES stand-in."""
+	count = int(count)
+	vat_numbers = [f"CY{i:08d}X" for i in range(count)]
+	valid = vat_numbers[: int(count * float(valid_ratio))]
+
+	vies_url = frappe.conf.get("vies_url")
+	with FakeViesServer(valid=valid, latency=float(latency)) as server:
+		frappe.local.conf.vies_url = server.url
+		try:
+			start = time.monotonic()
+			for vat_number in vat_numbers:
+				frappe.get_doc({
+					"doctype": "Customer",
+					"customer_name": f"Benchmark {vat_number}",
+					"tax_id": vat_number,
+				}).insert(ignore_permissions=True)
+			elapsed = time.monotonic() - start
+		finally:
+			frappe.local.conf.vies_url = vies_url
+			frappe.db.rollback()
+
+	result = {
+		"customers": count,
+		"seconds": round(elapsed, 3),
+		"customers_per_second": round(count / elapsed, 1) if elapsed else None,
+		"vies_requests": server.requests,
+	}
+	print(result)
+	return result
+
+def statement_import(days=365, transactions_per_day=50, latency=0.05):
+	"""Import a long Hellenic Bank statement served by the local bank stand-in."""
+	days = int(days)
+	with FakeBankServer(transactions_per_day=int(transactions_per_day), latency=float(latency)) as server:
+		site_config = {key: frappe.conf.get(key) for key in server.site_config}
+		frappe.local.conf.update(server.site_config)
+
+		bank = frappe.get_doc({"doctype": "Bank", "bank_name": "Benchmark Bank " + frappe.generate_hash(length=6)}).insert()
+		bank_account = frappe.get_doc({
+			"doctype": "Bank Account",
+			"account_name": "Benchmark Account",
+			"bank": bank.name,
+			"iban": DEFAULT_ACCOUNTS[0]["iban"],
+		}).insert()
+		hellenic_bank = frappe.get_doc({
+			"doctype": "Hellenic Bank",
+			"title": bank.name,
+			"bank": bank.name,
+			"parent_account": frappe.db.get_value("Account", {"is_group": 1}),
+			"client_id": "benchmark",
+			"client_secret": "benchmark",
+			"authorization_code": json.dumps(server.issue_token()),
+		}).insert()
+
+		try:
+			to_date = frappe.utils.getdate("2026-01-01")
+			from_date = add_days(to_date, -days + 1)
+			start = time.monotonic()
+			created = hellenic_bank.get_bank_transactions(bank_account.name, str(from_date), str(to_date))["created"]
+			elapsed = time.monotonic() - start
+		finally:
+			frappe.local.conf.update(site_config)
+			frappe.db.rollback()
+			frappe.db.delete("Bank Transaction", {"bank_account": bank_account.name})
+			for doctype, name in (("Hellenic Bank", hellenic_bank.name), ("Bank Account", bank_account.name), ("Bank", bank.name)):
+				frappe.delete_doc(doctype, name, force=True, ignore_permissions=True)
+			frappe.db.commit()
+
+	result = {
+		"days": days,
+		"transactions": created,
+		"seconds": round(elapsed, 3),
+		"transactions_per_second": round(created / elapsed, 1) if elapsed else None,
+		"statement_requests": server.count("/hellenic/api/v1/b2b/account/report"),
+	}
+	print(result)
+	return result
@@ -0,0 +1,141 @@
+# Copyright (c) 2026, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+from datetime import date
+from io import BytesIO
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext_cyprus.utils.bank_sync import BankStatementError
+from erpnext_cyprus.utils.statement_files import iter_statement_file, validate_statement_account
+
+IBAN = "CY17002001280000001200527600"
+OTHER_IBAN = "CY21002001950000357001234567"
+BANK = "_Test Statement File Bank"
+BANK_ACCOUNT = "_Test Statement File Account"
+
+MT940 = f"""\
+:20:STMT0001
+:25:{IBAN}
+:28C:1/1
+:60F:C260101EUR1000,00
+:61:2601020102C100,00NTRFINV-0001//BANKREF1
+:86:Payment for
+invoice INV-0001
+:61:2601030103D25,50NTRFNONREF//BANKREF2
+:86:Card fee
+:61:2601040104RC10,00NTRFNONREF//BANKREF3
+:61:2601050105RD5,00NTRFREF-0004
+:62F:C260105EUR1069,50
+-
+"""
+
+CAMT053 = f"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.08">
+  <BkToCstmrStmt>
+    <Stmt>
+      <Id>STMT0001</Id>
+      <Acct><Id><IBAN>{IBAN}</IBAN></Id></Acct>
+      <Ntry>
+        <Amt Ccy="EUR">100.00</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <Sts><Cd>BOOK</Cd></Sts>
+        <ValDt><Dt>2026-01-02</Dt></ValDt>
+        <AcctSvcrRef>BANKREF1</AcctSvcrRef>
+        <NtryDtls><TxDtls><RmtInf><Ustrd>INV-0001</Ustrd></RmtInf></TxDtls></NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">25.50</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts><Cd>PDNG</Cd></Sts>
+        <ValDt><Dt>2026-01-03</Dt></ValDt>
+        <AcctSvcrRef>BANKREF2</AcctSvcrRef>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">10.00</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts>BOOK</Sts>
+        <BookgDt><DtTm>2026-01-04T10:00:00</DtTm></BookgDt>
+        <NtryDtls><TxDtls><Refs><EndToEndId>PAY-0003</EndToEndId></Refs></TxDtls></NtryDtls>
+        <AddtlNtryInf>Card fee</AddtlNtryInf>
+      </Ntry>
+    </Stmt>
+  </BkToCstmrStmt>
+</Document>
+"""
+
+
+def parse(content):
+	return list(iter_statement_file(BytesIO(content.encode("utf-8"))))
+
+
+class TestStatementFiles(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		if not frappe.db.exists("Bank", BANK):
+			frappe.get_doc({"doctype": "Bank", "bank_name": BANK}).insert()
+		if not frappe.db.exists("Bank Account", {"account_name": BANK_ACCOUNT}):
+			frappe.get_doc({
+				"doctype": "Bank Account",
+				"account_name": BANK_ACCOUNT,
+				"bank": BANK,
+				"iban": IBAN,
+			}).insert()
+		cls.bank_account = frappe.db.get_value("Bank Account", {"account_name": BANK_ACCOUNT})
+
+	def test_mt940_signs(self):
+		amounts = [line["amount"] for account, line in parse(MT940)]
+		# A reversed credit takes money out, a reversed debit puts it back
+		self.assertEqual(amounts, [100.0, -25.5, -10.0, 5.0])
+
+	def test_mt940_references(self):
+		lines = [line for account, line in parse(MT940)]
+		self.assertEqual(
+			[line["reference_number"] for line in lines], ["INV-0001", "BANKREF2", "BANKREF3", "REF-0004"]
+		)
+		self.assertEqual(lines[0]["date"], date(2026, 1, 2))
+		self.assertTrue(all(account == IBAN for account, line in parse(MT940)))
+
+	def test_mt940_information_continues_over_lines(self):
+		lines = [line for account, line in parse(MT940)]
+		self.assertEqual(lines[0]["description"], "Payment for invoice INV-0001")
+		self.assertEqual(lines[1]["description"], "Card fee")
+		self.assertIsNone(lines[2]["description"])
+
+	def test_unrecognised_mt940_line(self):
+		self.assertRaises(BankStatementError, parse, ":25:123\n:61:not a statement line\n-\n")
+
+	def test_camt_booked_entries(self):
+		lines = parse(CAMT053)
+		# The pending entry is skipped, both status layouts are read
+		self.assertEqual(len(lines), 2)
+		self.assertTrue(all(account == IBAN for account, line in lines))
+
+		first, second = (line for account, line in lines)
+		self.assertEqual(first, {
+			"date": "2026-01-02",
+			"reference_number": "BANKREF1",
+			"description": "INV-0001",
+			"amount": 100.0,
+		})
+		self.assertEqual(second, {
+			"date": "2026-01-04",
+			"reference_number": "PAY-0003",
+			"description": "Card fee",
+			"amount": -10.0,
+		})
+
+	def test_camt_entry_without_date(self):
+		content = CAMT053.replace("<BookgDt><DtTm>2026-01-04T10:00:00</DtTm></BookgDt>", "")
+		self.assertRaises(BankStatementError, parse, content)
+
+	def test_statement_of_another_account_is_refused(self):
+		validate_statement_account(self.bank_account, IBAN)
+		validate_statement_account(self.bank_account, "cy17 0020 0128 0000 0012 0052 7600")
+		self.assertRaises(BankStatementError, validate_statement_account, self.bank_account, OTHER_IBAN)
+		# Part of the IBAN, or the IBAN within a longer number, is another account
+		self.assertRaises(BankStatementError, validate_statement_account, self.bank_account, "1200527600")
+		self.assertRaises(BankStatementError, validate_statement_account, self.bank_account, IBAN + "01")
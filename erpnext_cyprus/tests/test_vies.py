@@ -0,0 +1,66 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext_cyprus.tests.vies_server import FakeViesServer
+from erpnext_cyprus.utils.circuit_breaker import CircuitBreaker
+from erpnext_cyprus.utils.customer_group_assignment import (
+	VIES_INVALID,
+	VIES_UNKNOWN,
+	VIES_VALID,
+	check_vies_vat,
+)
+
+
+class TestVies(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = FakeViesServer(
+			valid=["CY10000000X"],
+			faults={"CY99999999L": "MS_UNAVAILABLE", "CY00000000A": "INVALID_INPUT"},
+		).start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.stop()
+		super().tearDownClass()
+
+	def setUp(self):
+		self.circuit_breaker = CircuitBreaker("vies_test", failure_threshold=2, reset_timeout=60)
+		self.circuit_breaker.record_success()
+		self.vies_url = frappe.conf.get("vies_url")
+		frappe.local.conf.vies_url = self.server.url
+
+	def tearDown(self):
+		frappe.local.conf.vies_url = self.vies_url
+		self.circuit_breaker.record_success()
+
+	def check(self, vat_number):
+		return check_vies_vat(vat_number, self.circuit_breaker)
+
+	def test_valid_and_invalid_numbers(self):
+		self.assertEqual(self.check("CY10000000X"), VIES_VALID)
+		self.assertEqual(self.check("CY12345678Z"), VIES_INVALID)
+		self.assertEqual(self.check("CY"), VIES_INVALID)
+
+	def test_invalid_input_fault_is_invalid(self):
+		self.assertEqual(self.check("CY00000000A"), VIES_INVALID)
+		self.assertFalse(self.circuit_breaker.is_open())
+
+	def test_unavailable_is_unknown_and_trips_breaker(self):
+		self.assertEqual(self.check("CY99999999L"), VIES_UNKNOWN)
+		self.assertFalse(self.circuit_breaker.is_open())
+		self.assertEqual(self.check("CY99999999L"), VIES_UNKNOWN)
+		self.assertTrue(self.circuit_breaker.is_open())
+
+		# Short-circuited without reaching the server
+		requests = self.server.requests
+		self.assertEqual(self.check("CY10000000X"), VIES_UNKNOWN)
+		self.assertEqual(self.server.requests, requests)
+
+	def test_unreachable_service_is_unknown(self):
+		frappe.local.conf.vies_url = "http://127.0.0.1:9/checkVatService"
+		self.assertEqual(self.check("CY10000000X"), VIES_UNKNOWN)
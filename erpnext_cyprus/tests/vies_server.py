@@ -0,0 +1,184 @@
+"""
+Local stand-in for the VIES `checkVatService` SOAP endpoint.
+
+Used by the tests and benchmarks so that VAT validation runs without reaching
+ec.europa.eu. Point the app at it with `vies_url` in site config, or start it
+from the command line:
+
+	python -m erpnext_cyprus.tests.vies_server --port 8089 --valid CY10000000X --latency 0.05
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/">
+	<env:Header/>
+	<env:Body>
+		<ns2:checkVatResponse xmlns:ns2="urn:ec.europa.eu:taxud:vies:services:checkVat:types">
+			<ns2:countryCode>{country_code}</ns2:countryCode>
+			<ns2:vatNumber>{vat_number}</ns2:vatNumber>
+			<ns2:requestDate>{request_date}</ns2:requestDate>
+			<ns2:valid>{valid}</ns2:valid>
+			<ns2:name>{name}</ns2:name>
+			<ns2:address>---</ns2:address>
+		</ns2:checkVatResponse>
+	</env:Body>
+</env:Envelope>"""
+
+FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/">
+	<env:Header/>
+	<env:Body>
+		<env:Fault>
+			<faultcode>env:Server</faultcode>
+			<faultstring>{fault}</faultstring>
+		</env:Fault>
+	</env:Body>
+</env:Envelope>"""
+
+class FakeViesServer:
+	"""
+	Threaded fake VIES server.
+
+	- `valid`: VAT numbers (with country prefix) reported as valid
+	- `latency`: seconds to wait before every answer
+	- `faults`: VAT number -> SOAP fault returned for it, e.g. "MS_UNAVAILABLE"
+	- `fault`, `fault_rate`: fault returned for a random share of all requests
+	- `hang`: seconds to stall every request, to trigger client timeouts
+	- `max_concurrent`: requests above this are answered with MS_MAX_CONCURRENT_REQ
+	"""
+
+	def __init__(self, valid=None, latency=0, faults=None, fault=None, fault_rate=0,
+			hang=0, max_concurrent=0, host="127.0.0.1", port=0):
+		self.valid = {v.upper() for v in valid or []}
+		self.latency = latency
+		self.faults = faults or {}
+		self.fault = fault
+		self.fault_rate = fault_rate
+		self.hang = hang
+		self.max_concurrent = max_concurrent
+		self.requests = 0
+		self.active = 0
+		self.lock = threading.Lock()
+		self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+		self.httpd.daemon_threads = True
+		self.thread = None
+
+	@property
+	def url(self):
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}/taxation_customs/vies/services/checkVatService"
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def check_vat(self, country_code, vat_number):
+		"""Return (status code, body) for one checkVat request."""
+		full_number = f"{country_code}{vat_number}".upper()
+		fault = self.faults.get(full_number)
+		if not fault and self.fault and random.random() < self.fault_rate:
+			fault = self.fault
+		if fault:
+			return 500, FAULT.format(fault=fault)
+
+		valid = full_number in self.valid
+		return 200, RESPONSE.format(
+			country_code=country_code,
+			vat_number=vat_number,
+			request_date=time.strftime("%Y-%m-%d+00:00"),
+			valid="true" if valid else "false",
+			name="Test Company Ltd" if valid else "---",
+		)
+
+	def make_handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_POST(self):
+				body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+				with server.lock:
+					server.requests += 1
+					server.active += 1
+					active = server.active
+				try:
+					if server.hang:
+						time.sleep(server.hang)
+					if server.latency:
+						time.sleep(server.latency)
+
+					if server.max_concurrent and active > server.max_concurrent:
+						status, response = 500, FAULT.format(fault="MS_MAX_CONCURRENT_REQ")
+					else:
+						country_code = get_element(body, "countryCode")
+						vat_number = get_element(body, "vatNumber")
+						if not country_code or not vat_number:
+							status, response = 500, FAULT.format(fault="INVALID_INPUT")
+						else:
+							status, response = server.check_vat(country_code, vat_number)
+
+					payload = response.encode("utf-8")
+					self.send_response(status)
+					self.send_header("Content-Type", "text/xml; charset=utf-8")
+					self.send_header("Content-Length", str(len(payload)))
+					self.end_headers()
+					self.wfile.write(payload)
+				finally:
+					with server.lock:
+						server.active -= 1
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+def get_element(body, tag):
+	match = re.search(rf"<(?:\w+:)?{tag}>\s*([^<]*?)\s*</(?:\w+:)?{tag}>", body)
+	return match.group(1) if match else None
+
+def main():
+	parser = argparse.ArgumentParser(description="Local VIES checkVatService stand-in")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8089)
+	parser.add_argument("--valid", nargs="*", default=[], help="VAT numbers reported as valid")
+	parser.add_argument("--latency", type=float, default=0)
+	parser.add_argument("--fault", help="SOAP fault injected at --fault-rate, e.g. MS_UNAVAILABLE")
+	parser.add_argument("--fault-rate", type=float, default=0)
+	parser.add_argument("--hang", type=float, default=0)
+	parser.add_argument("--max-concurrent", type=int, default=0)
+	args = parser.parse_args()
+
+	server = FakeViesServer(
+		valid=args.valid,
+		latency=args.latency,
+		fault=args.fault,
+		fault_rate=args.fault_rate,
+		hang=args.hang,
+		max_concurrent=args.max_concurrent,
+		host=args.host,
+		port=args.port,
+	)
+	print(f"Fake VIES listening on {server.url}")
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		server.stop()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,155 @@
+import frappe
+from frappe import _
+from frappe.utils.nestedset import rebuild_tree
+
+def provision_bank_accounts(connection, accounts):
+	"""
+	Create the ledger and Bank Accounts of a connection's remote accounts.
+
+	`accounts` are dicts with `account_name`, `account_no`, `iban` and
+	`currency`. The connection's Bank Accounts are read in one query and
+	matched by account number or IBAN, or by name when they have neither;
+	matched ones get IBAN and currency changes, missing ones are created
+	under the connection's parent account with a single rebuild of the
+	account tree at the end.
+	Returns {"created": n, "updated": n}.
+	"""
+	company = frappe.db.get_value("Account", connection.parent_account, "company")
+	existing = {}
+	for bank_account in frappe.db.sql(
+		"""
+		SELECT ba.name, ba.account_name, ba.bank_account_no, ba.iban, ba.account, acc.account_currency
+		FROM `tabBank Account` ba
+		LEFT JOIN `tabAccount` acc ON acc.name = ba.account
+		WHERE ba.bank = %s
+		""",
+		connection.bank,
+		as_dict=True,
+	):
+		keys = (bank_account.bank_account_no, bank_account.iban) if (bank_account.bank_account_no or bank_account.iban) else (bank_account.account_name,)
+		for key in keys:
+			if key:
+				existing.setdefault(key, bank_account)
+
+	updates = {}
+	currency_updates = {}
+	missing = []
+	for account in accounts:
+		bank_account = (
+			existing.get(account["account_no"]) or existing.get(account["iban"]) or existing.get(account["account_name"])
+		)
+		if not bank_account:
+			missing.append(account)
+			continue
+
+		changes = {
+			fieldname: account[key]
+			for fieldname, key in (("bank_account_no", "account_no"), ("iban", "iban"))
+			if account[key] and bank_account[fieldname] != account[key]
+		}
+		if changes:
+			updates[bank_account.name] = changes
+		if bank_account.account and account["currency"] and bank_account.account_currency != account["currency"]:
+			currency_updates[bank_account.account] = account["currency"]
+
+	if updates:
+		frappe.db.bulk_update("Bank Account", updates)
+	update_account_currencies(currency_updates)
+
+	if missing:
+		ledger_accounts = create_ledger_accounts(connection.parent_account, company, missing)
+		for account in missing:
+			ledger_account = ledger_accounts[(account["account_name"], account["currency"])]
+			frappe.get_doc({
+				"doctype": "Bank Account",
+				"account_name": ledger_account.account_name,
+				"account": ledger_account.name,
+				"is_company_account": 1,
+				"company": company,
+				"bank": connection.bank,
+				"bank_account_no": account["account_no"],
+				"iban": account["iban"],
+			}).insert()
+
+	return {"created": len(missing), "updated": len(updates) + len(currency_updates)}
+
+def create_ledger_accounts(parent_account, company, accounts):
+	"""
+	Bank ledger accounts for `accounts` under `parent_account`, reusing the
+	bank accounts of the same name and currency there. A new account whose
+	name is taken in the company, or used by another currency, gets its
+	currency appended. New accounts skip the per insert nested set update,
+	and the tree is rebuilt once.
+	Returns {(account_name, currency): Account with name and account_name}.
+	"""
+	keys = list(dict.fromkeys((account["account_name"], account["currency"]) for account in accounts))
+	names = {name for name, currency in keys} | {f"{name} {currency}" for name, currency in keys}
+	existing = frappe.get_all(
+		"Account",
+		filters={"company": company, "account_name": ["in", list(names)]},
+		fields=["name", "account_name", "account_currency", "account_type", "parent_account", "is_group"],
+	)
+
+	ledger_accounts = {}
+	for name, currency in keys:
+		for account_name in (name, f"{name} {currency}"):
+			ledger_account = next(
+				(
+					account for account in existing
+					if account.account_name == account_name
+					and not account.is_group
+					and account.account_type == "Bank"
+					and account.parent_account == parent_account
+					and account.account_currency == currency
+				),
+				None,
+			)
+			if ledger_account:
+				ledger_accounts[(name, currency)] = ledger_account
+				break
+
+	new_accounts = [key for key in keys if key not in ledger_accounts]
+	if not new_accounts:
+		return ledger_accounts
+
+	taken = {account.account_name for account in existing}
+	shared_names = {name for name, currency in keys if sum(1 for key in keys if key[0] == name) > 1}
+	frappe.local.flags.ignore_update_nsm = True
+	try:
+		for name, currency in new_accounts:
+			account_name = f"{name} {currency}" if name in taken or name in shared_names else name
+			taken.add(account_name)
+			ledger_account = frappe.get_doc({
+				"doctype": "Account",
+				"account_name": account_name,
+				"parent_account": parent_account,
+				"company": company,
+				"account_type": "Bank",
+				"account_currency": currency,
+			}).insert()
+			ledger_accounts[(name, currency)] = frappe._dict(name=ledger_account.name, account_name=account_name)
+	finally:
+		frappe.local.flags.ignore_update_nsm = False
+	rebuild_tree("Account")
+	return ledger_accounts
+
+def update_account_currencies(currency_updates):
+	"""Change the currency of bank ledger accounts, unless they already have ledger entries."""
+	if not currency_updates:
+		return
+	used = set(frappe.get_all(
+		"GL Entry",
+		filters={"account": ["in", list(currency_updates)], "is_cancelled": 0},
+		distinct=True,
+		pluck="account",
+	))
+	for account in used:
+		frappe.msgprint(
+			_("The currency of {0} was not changed to {1} because it already has ledger entries.").format(
+				account, currency_updates.pop(account)
+			)
+		)
+	if currency_updates:
+		frappe.db.bulk_update(
+			"Account", {account: {"account_currency": currency} for account, currency in currency_updates.items()}
+		)
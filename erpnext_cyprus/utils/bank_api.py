@@ -0,0 +1,107 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import frappe
+import requests
+from frappe.utils import cint, flt
+
+from erpnext_cyprus.utils import bank_telemetry, http_client
+from erpnext_cyprus.utils.rate_limiter import RateLimiter
+
+RATE_LIMIT_FIELDS = {
+	"Hellenic Bank": "hellenic_bank_requests_per_second",
+	"Bank Of Cyprus": "bank_of_cyprus_requests_per_second",
+}
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+# The bank did not process the request, so even payments can be sent again
+REJECTED_STATUSES = frozenset((429,))
+# The request may have been processed, only idempotent calls are sent again
+RETRY_STATUSES = frozenset((500, 502, 503, 504))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+_clients = {}
+
+class BankAPIClient:
+	"""
+	HTTP client of one bank API, safe to share between threads.
+
+	Requests are rate limited by a token bucket and retried on connection
+	errors, 429 and 5xx responses with jittered exponential backoff, honouring
+	`Retry-After`. Non-idempotent calls such as payments are only retried when
+	the bank certainly did not process them. After the last attempt the
+	response is returned, or the error raised, as by `http_client.request`.
+	"""
+
+	def __init__(self, name, rate=0, max_retries=3):
+		self.name = name
+		self.rate_limiter = RateLimiter(rate)
+		self.max_retries = max_retries
+
+	def request(self, method, url, idempotent=None, **kwargs):
+		method = method.upper()
+		if idempotent is None:
+			idempotent = method in IDEMPOTENT_METHODS
+
+		attempt = 0
+		while True:
+			self.rate_limiter.acquire()
+			started_at = time.monotonic()
+			response = error = None
+			try:
+				response = http_client.request(method, url, **kwargs)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				error = e
+			latency = time.monotonic() - started_at
+			bank_telemetry.record_response(self.name, method, url, latency, response, attempt)
+
+			if attempt >= self.max_retries or not should_retry(response, error, idempotent):
+				if error:
+					raise error
+				return response
+
+			attempt += 1
+			time.sleep(get_retry_delay(attempt, response))
+
+	def get(self, url, params=None, **kwargs):
+		return self.request("GET", url, params=params, **kwargs)
+
+	def post(self, url, data=None, json=None, **kwargs):
+		return self.request("POST", url, data=data, json=json, **kwargs)
+
+	def patch(self, url, data=None, json=None, **kwargs):
+		return self.request("PATCH", url, data=data, json=json, **kwargs)
+
+def get_bank_api_client(doctype):
+	"""Client shared by every request this worker process sends to one bank's API."""
+	settings = frappe.get_cached_doc("Erpnext Cyprus Settings")
+	rate = flt(settings.get(RATE_LIMIT_FIELDS[doctype]))
+	max_retries = cint(settings.bank_api_max_retries)
+	client = _clients.get(doctype)
+	if not client or client.rate_limiter.rate != rate or client.max_retries != max_retries:
+		client = _clients[doctype] = BankAPIClient(doctype, rate, max_retries)
+	return client
+
+def should_retry(response, error, idempotent):
+	if error is not None:
+		# A timed out read may have reached the bank
+		return idempotent or isinstance(error, requests.ConnectTimeout)
+	if response.status_code in REJECTED_STATUSES:
+		return True
+	return idempotent and response.status_code in RETRY_STATUSES
+
+def get_retry_delay(attempt, response=None):
+	"""Seconds to wait before a retry: the bank's `Retry-After`, or full jitter backoff."""
+	retry_after = response is not None and response.headers.get("Retry-After")
+	if retry_after:
+		try:
+			delay = float(retry_after)
+		except ValueError:
+			try:
+				delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+			except (TypeError, ValueError):
+				delay = None
+		if delay is not None:
+			return min(max(delay, 0), BACKOFF_MAX)
+	return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
@@ -0,0 +1,181 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, flt, now, today
+
+from erpnext_cyprus.utils.bank_api import get_bank_api_client
+from erpnext_cyprus.utils.bank_sync import (
+	SETTINGS_DOCTYPE,
+	fetch_statement,
+	get_bank_connection,
+	get_bank_connection_doc,
+	get_synced_bank_accounts,
+)
+
+SNAPSHOT_DOCTYPE = "Bank Balance Snapshot"
+BALANCES_CACHE_KEY = "bank_balances"
+SNAPSHOT_FIELDS = [
+	"name",
+	"owner",
+	"modified_by",
+	"creation",
+	"modified",
+	"bank_account",
+	"company",
+	"snapshot_on",
+	"currency",
+	"available_balance",
+	"current_balance",
+]
+
+def snapshot_bank_balances(bank_accounts=None):
+	"""
+	Record the balances of many bank accounts as Bank Balance Snapshots.
+	Requests are prepared in this thread, sent concurrently through each
+	bank's API client and the results written with a single insert.
+	Returns the number of snapshots created.
+	"""
+	if bank_accounts is None:
+		bank_accounts = get_synced_bank_accounts()
+
+	connections = {}
+	requests = []
+	for bank_account in bank_accounts:
+		try:
+			key = get_bank_connection(bank_account.bank, bank_account.company)
+			if key not in connections:
+				connections[key] = get_bank_connection_doc(bank_account.name)
+			connection = connections[key]
+			requests.append((bank_account.name, connection, connection.get_balance_request(bank_account.name)))
+		except Exception:
+			log_balance_error(bank_account.name)
+
+	companies = dict(frappe.get_all(
+		"Bank Account",
+		filters={"name": ["in", [bank_account for bank_account, connection, request in requests]]},
+		fields=["name", "company"],
+		as_list=True,
+	)) if requests else {}
+
+	snapshots = []
+	timestamp = now()
+	user = frappe.session.user
+	max_workers = cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "bank_sync_max_workers")) or 4
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		futures = {
+			executor.submit(fetch_statement, request, get_bank_api_client(connection.doctype)): (bank_account, connection)
+			for bank_account, connection, request in requests
+		}
+		for future in as_completed(futures):
+			bank_account, connection = futures[future]
+			try:
+				balance = connection.parse_balance(json.loads(future.result()))
+			except Exception:
+				log_balance_error(bank_account)
+				continue
+			snapshots.append((
+				frappe.generate_hash(length=10),
+				user,
+				user,
+				timestamp,
+				timestamp,
+				bank_account,
+				companies.get(bank_account),
+				timestamp,
+				balance["currency"],
+				flt(balance["available_balance"]),
+				flt(balance["current_balance"]),
+			))
+
+	if snapshots:
+		frappe.db.bulk_insert(SNAPSHOT_DOCTYPE, SNAPSHOT_FIELDS, snapshots)
+		frappe.db.commit()
+		frappe.cache.delete_keys(BALANCES_CACHE_KEY)
+	return len(snapshots)
+
+def snapshot_all_bank_balances():
+	"""Scheduled job recording the balances of every connected bank account."""
+	if not cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "enable_balance_snapshots")):
+		return
+	snapshot_bank_balances()
+
+def delete_old_snapshots():
+	"""Daily job keeping the snapshots of the configured number of days."""
+	retention_days = cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "bank_balance_retention_days"))
+	if retention_days:
+		frappe.db.delete(SNAPSHOT_DOCTYPE, {"snapshot_on": ["<", add_days(today(), -retention_days)]})
+
+@frappe.whitelist()
+def enqueue_balance_snapshot():
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.bank_balances.snapshot_bank_balances",
+		queue="long",
+		job_id="erpnext_cyprus_balance_snapshot",
+		deduplicate=True,
+	)
+	frappe.msgprint(_("Bank balances are being retrieved in the background."), alert=True)
+
+@frappe.whitelist()
+def get_bank_balances(company=None):
+	"""
+	Latest balance of every bank account and today's snapshots, for
+	dashboards, limited to the companies the user is permitted. Served from
+	the cache, which every new snapshot clears, so page views never reach
+	the banks or scan the snapshot history.
+	"""
+	frappe.has_permission(SNAPSHOT_DOCTYPE, "read", throw=True)
+	companies = sorted(frappe.get_list("Company", pluck="name"))
+	if company:
+		if company not in companies:
+			frappe.throw(_("Not permitted to read the balances of {0}").format(company), frappe.PermissionError)
+		companies = [company]
+	if not companies:
+		return {"balances": [], "history": {}}
+
+	return frappe.cache.get_value(
+		f"{BALANCES_CACHE_KEY}|{','.join(companies)}|{today()}",
+		generator=lambda: get_balances(companies),
+	)
+
+def get_balances(companies):
+	values = {"companies": companies, "today": today()}
+	balances = frappe.db.sql(
+		"""
+		SELECT s.bank_account, s.company, s.currency, s.snapshot_on, s.available_balance, s.current_balance
+		FROM `tabBank Balance Snapshot` s
+		JOIN (
+			SELECT bank_account, MAX(snapshot_on) AS snapshot_on
+			FROM `tabBank Balance Snapshot`
+			GROUP BY bank_account
+		) latest ON latest.bank_account = s.bank_account AND latest.snapshot_on = s.snapshot_on
+		WHERE s.company IN %(companies)s
+		ORDER BY s.bank_account
+		""",
+		values,
+		as_dict=True,
+	)
+
+	history = {}
+	for snapshot in frappe.db.sql(
+		"""
+		SELECT s.bank_account, s.snapshot_on, s.available_balance, s.current_balance
+		FROM `tabBank Balance Snapshot` s
+		WHERE s.snapshot_on >= %(today)s AND s.company IN %(companies)s
+		ORDER BY s.bank_account, s.snapshot_on
+		""",
+		values,
+		as_dict=True,
+	):
+		history.setdefault(snapshot.pop("bank_account"), []).append(snapshot)
+
+	return {"balances": balances, "history": history}
+
+def log_balance_error(bank_account):
+	frappe.log_error(
+		title=_("Could not retrieve the balance of {0}").format(bank_account),
+		reference_doctype="Bank Account",
+		reference_name=bank_account,
+	)
@@ -0,0 +1,230 @@
+import re
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+SETTINGS_DOCTYPE = "Erpnext Cyprus Settings"
+# Shortest reference worth looking up, shorter ones match by accident
+MIN_TOKEN_LENGTH = 4
+# Confidence in percent, compared with the auto_match_min_confidence setting
+AMOUNT_SCORE = 60
+REFERENCE_SCORE = 30
+UNIQUE_AMOUNT_SCORE = 10
+DEFAULT_MIN_CONFIDENCE = 90
+
+def get_reference_tokens(*texts):
+	"""Uppercase words of references and descriptions with separators removed, e.g. ACC-SINV-2026-00012 -> ACCSINV202600012."""
+	tokens = set()
+	for text in texts:
+		for word in re.findall(r"[A-Z0-9][A-Z0-9\-/.]*[A-Z0-9]", (text or "").upper()):
+			token = re.sub(r"[\-/.]", "", word)
+			if len(token) >= MIN_TOKEN_LENGTH:
+				tokens.add(token)
+	return tokens
+
+class MatchIndex:
+	"""
+	Open vouchers of one bank account, hashed by (direction, amount, currency)
+	and by reference token, so each bank transaction finds its candidates
+	with a few dictionary lookups.
+	"""
+
+	def __init__(self):
+		self.by_amount = {}
+		self.by_token = {}
+		self.used = set()
+
+	def add(self, voucher):
+		voucher.key = (voucher.direction, flt(voucher.amount, 2), voucher.currency)
+		self.by_amount.setdefault(voucher.key, []).append(voucher)
+		for token in voucher.tokens:
+			self.by_token.setdefault(token, []).append(voucher)
+
+	def match(self, transaction):
+		"""Return (voucher, confidence in percent) of the best unambiguous candidate, or (None, 0)."""
+		direction = "in" if flt(transaction.deposit) else "out"
+		amount = flt(transaction.deposit or transaction.withdrawal, 2)
+		key = (direction, amount, transaction.currency)
+		tokens = get_reference_tokens(transaction.reference_number, transaction.description)
+
+		candidates = [v for v in self.by_amount.get(key, []) if v.name not in self.used]
+		if not candidates:
+			return None, 0
+
+		referenced = set()
+		for token in tokens:
+			referenced.update(v.name for v in self.by_token.get(token, []) if v.key == key)
+
+		scored = []
+		for voucher in candidates:
+			score = AMOUNT_SCORE
+			if voucher.name in referenced:
+				score += REFERENCE_SCORE
+			if len(candidates) == 1:
+				score += UNIQUE_AMOUNT_SCORE
+			scored.append((score, voucher))
+		scored.sort(key=lambda s: s[0], reverse=True)
+
+		if len(scored) > 1 and scored[0][0] == scored[1][0]:
+			return None, 0
+		score, voucher = scored[0]
+		return voucher, score
+
+def build_match_index(bank_account):
+	"""Index the unreconciled Payment Entries and outstanding invoices a bank account can settle."""
+	account = frappe.db.get_value(
+		"Bank Account", bank_account, ["account", "company"], as_dict=True
+	)
+	index = MatchIndex()
+	if not account or not account.account:
+		return index
+	currency = frappe.get_cached_value("Account", account.account, "account_currency")
+
+	for pe in frappe.db.sql(
+		"""
+		SELECT pe.name, pe.paid_from, pe.paid_to, pe.paid_amount, pe.received_amount,
+			pe.paid_from_account_currency, pe.paid_to_account_currency, pe.reference_no
+		FROM `tabPayment Entry` pe
+		WHERE pe.docstatus = 1
+			AND pe.clearance_date IS NULL
+			AND (pe.paid_from = %(account)s OR pe.paid_to = %(account)s)
+			AND NOT EXISTS (
+				SELECT 1 FROM `tabBank Transaction Payments` btp
+				WHERE btp.payment_document = 'Payment Entry' AND btp.payment_entry = pe.name
+					AND btp.docstatus = 1
+			)
+		""",
+		{"account": account.account},
+		as_dict=True,
+	):
+		outgoing = pe.paid_from == account.account
+		pe.update({
+			"doctype": "Payment Entry",
+			"direction": "out" if outgoing else "in",
+			"amount": pe.paid_amount if outgoing else pe.received_amount,
+			"currency": pe.paid_from_account_currency if outgoing else pe.paid_to_account_currency,
+			"tokens": get_reference_tokens(pe.name, pe.reference_no),
+		})
+		index.add(pe)
+
+	for doctype, direction, reference_field in (
+		("Sales Invoice", "in", "po_no"),
+		("Purchase Invoice", "out", "bill_no"),
+	):
+		for invoice in frappe.get_all(
+			doctype,
+			filters={
+				"docstatus": 1,
+				"company": account.company,
+				"currency": currency,
+				"is_return": 0,
+				"outstanding_amount": [">", 0],
+			},
+			fields=["name", "outstanding_amount", "currency", f"{reference_field} as reference"],
+		):
+			invoice.update({
+				"doctype": doctype,
+				"direction": direction,
+				"amount": invoice.outstanding_amount,
+				"tokens": get_reference_tokens(invoice.name, invoice.reference),
+			})
+			index.add(invoice)
+
+	return index
+
+def match_bank_transactions(bank_accounts=None, min_confidence=None):
+	"""
+	Reconcile unreconciled Bank Transactions with the open voucher of the same
+	amount and currency, preferring the one whose reference appears in the
+	statement line. Matches below `min_confidence`, in percent, or ambiguous
+	ones are left to the Bank Reconciliation Tool. Invoices are settled with
+	a new Payment Entry, and each match is reconciled through the Bank
+	Transaction controller, as the Bank Reconciliation Tool does.
+	Returns the number of transactions reconciled.
+	"""
+	if min_confidence is None:
+		min_confidence = (
+			flt(frappe.db.get_single_value(SETTINGS_DOCTYPE, "auto_match_min_confidence")) or DEFAULT_MIN_CONFIDENCE
+		)
+
+	filters = {"docstatus": 1, "status": "Unreconciled", "allocated_amount": 0}
+	if bank_accounts:
+		filters["bank_account"] = ["in", bank_accounts]
+	transactions = frappe.get_all(
+		"Bank Transaction",
+		filters=filters,
+		fields=["name", "date", "bank_account", "currency", "deposit", "withdrawal", "reference_number", "description"],
+		order_by="date, name",
+	)
+
+	indexes = {}
+	matches = []
+	for transaction in transactions:
+		if transaction.bank_account not in indexes:
+			indexes[transaction.bank_account] = build_match_index(transaction.bank_account)
+		index = indexes[transaction.bank_account]
+		voucher, confidence = index.match(transaction)
+		if voucher and confidence >= min_confidence:
+			index.used.add(voucher.name)
+			matches.append((transaction, voucher))
+
+	reconciled = 0
+	for transaction, voucher in matches:
+		frappe.db.savepoint("auto_match")
+		try:
+			if voucher.doctype != "Payment Entry":
+				voucher = make_payment_entry(transaction, voucher)
+			reconcile_payment_entry(transaction.name, voucher.name, voucher.amount)
+			reconciled += 1
+		except Exception:
+			frappe.db.rollback(save_point="auto_match")
+			frappe.log_error(
+				title=_("Could not settle {0} from bank transaction {1}").format(voucher.name, transaction.name),
+				reference_doctype="Bank Transaction",
+				reference_name=transaction.name,
+			)
+
+	return reconciled
+
+def make_payment_entry(transaction, invoice):
+	"""Submit a Payment Entry settling `invoice` as shown by the bank transaction."""
+	from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+	account = frappe.db.get_value("Bank Account", transaction.bank_account, "account")
+	payment_entry = get_payment_entry(invoice.doctype, invoice.name, bank_account=account)
+	payment_entry.bank_account = transaction.bank_account
+	payment_entry.reference_no = transaction.reference_number or transaction.name
+	payment_entry.reference_date = transaction.date
+	payment_entry.posting_date = transaction.date
+	payment_entry.docstatus = 1
+	payment_entry.insert()
+	return frappe._dict(
+		name=payment_entry.name,
+		amount=payment_entry.paid_amount if invoice.direction == "out" else payment_entry.received_amount,
+	)
+
+def reconcile_payment_entry(bank_transaction, payment_entry, amount):
+	"""Link a Payment Entry to a bank transaction; the controller allocates it and clears the payment."""
+	bank_transaction = frappe.get_doc("Bank Transaction", bank_transaction)
+	bank_transaction.add_payment_entries([
+		{"payment_doctype": "Payment Entry", "payment_name": payment_entry, "amount": flt(amount)}
+	])
+	bank_transaction.save()
+
+@frappe.whitelist()
+def enqueue_auto_matching(bank_account=None):
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.bank_matching.match_bank_transactions",
+		queue="long",
+		job_id=f"erpnext_cyprus_auto_matching_{bank_account or 'all'}",
+		deduplicate=True,
+		bank_accounts=[bank_account] if bank_account else None,
+	)
+	frappe.msgprint(_("Bank transactions are being matched in the background."), alert=True)
+
+def match_synced_bank_transactions(bank_accounts):
+	"""Auto match after a bank sync, when enabled in the settings."""
+	if bank_accounts and cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "enable_auto_matching")):
+		match_bank_transactions(bank_accounts)
@@ -0,0 +1,327 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, getdate, today
+
+from erpnext_cyprus.utils.bank_api import get_bank_api_client
+from erpnext_cyprus.utils.bank_matching import match_synced_bank_transactions
+from erpnext_cyprus.utils.bank_telemetry import measure
+from erpnext_cyprus.utils.bank_transactions import import_bank_transactions
+from erpnext_cyprus.utils.statement_archive import (
+	archive_statement,
+	get_archived_bank_accounts,
+	get_archived_windows,
+	read_statement,
+)
+
+SETTINGS_DOCTYPE = "Erpnext Cyprus Settings"
+BANK_CONNECTORS = ("Hellenic Bank", "Bank Of Cyprus")
+
+class BankStatementError(frappe.ValidationError):
+	pass
+
+def get_bank_connection(bank, company=None):
+	"""
+	Return (doctype, name) of the enabled connection serving `bank`, or
+	(None, None). With `company`, only a connection whose parent account
+	belongs to it, so each legal entity uses its own subscription.
+	"""
+	for connection in get_bank_connections(bank):
+		if not company or connection.company == company:
+			return connection.doctype, connection.name
+	return None, None
+
+def get_bank_connections(bank):
+	"""Enabled connections of `bank` with the company of their parent account."""
+	connections = []
+	for doctype in BANK_CONNECTORS:
+		connections.extend(frappe.db.sql(
+			f"""
+			SELECT %(doctype)s AS doctype, c.name, acc.company
+			FROM `tab{doctype}` c
+			LEFT JOIN `tabAccount` acc ON acc.name = c.parent_account
+			WHERE c.bank = %(bank)s AND c.disabled = 0
+			ORDER BY c.creation
+			""",
+			{"doctype": doctype, "bank": bank},
+			as_dict=True,
+		))
+	return connections
+
+def validate_unique_connection(connection):
+	"""Refuse a second enabled connection for the same bank and company."""
+	if connection.disabled or not connection.bank:
+		return
+	company = frappe.db.get_value("Account", connection.parent_account, "company")
+	for other in get_bank_connections(connection.bank):
+		if other.company == company and (other.doctype, other.name) != (connection.doctype, connection.name):
+			frappe.throw(
+				_("{0} {1} already connects bank {2} for company {3}").format(
+					other.doctype, other.name, connection.bank, company
+				)
+			)
+
+def get_bank_connection_doc(bank_account):
+	bank, company = frappe.db.get_value("Bank Account", bank_account, ["bank", "company"])
+	doctype, name = get_bank_connection(bank, company)
+	if not doctype:
+		frappe.throw(_("No bank connection is configured for bank {0} and company {1}").format(bank, company))
+	return frappe.get_doc(doctype, name)
+
+@frappe.whitelist()
+def get_bank_account_connection(bank_account):
+	"""The connection serving a bank account, for the buttons of the forms."""
+	frappe.has_permission("Bank Account", "read", bank_account, throw=True)
+	bank, company = frappe.db.get_value("Bank Account", bank_account, ["bank", "company"]) or (None, None)
+	doctype, name = get_bank_connection(bank, company)
+	if not doctype:
+		return None
+	return {"doctype": doctype, "name": name, "allow_payments": frappe.db.get_value(doctype, name, "allow_payments")}
+
+def fetch_statement(request, client):
+	"""Send a statement request prepared by a bank connection. Safe to call from worker threads."""
+	response = client.request(**request)
+	if response.status_code != 200:
+		raise BankStatementError(response.text)
+	return response.content
+
+def get_date_windows(from_date, to_date, window_days=None):
+	"""Split a date range into consecutive windows of at most `window_days` days."""
+	window_days = window_days or cint(
+		frappe.db.get_single_value(SETTINGS_DOCTYPE, "bank_statement_window_days")
+	) or 31
+	windows = []
+	start, end = getdate(from_date), getdate(to_date)
+	while start <= end:
+		window_end = min(getdate(add_days(start, window_days - 1)), end)
+		windows.append((start, window_end))
+		start = getdate(add_days(window_end, 1))
+	return windows
+
+def get_statement_windows(bank_account, connection, from_date, to_date):
+	"""Prepared statement requests covering a date range, one per window."""
+	return [
+		frappe._dict(
+			bank_account=bank_account,
+			connection=connection,
+			from_date=start,
+			to_date=end,
+			request=connection.get_statement_request(bank_account, str(start), str(end)),
+		)
+		for start, end in get_date_windows(from_date, to_date)
+	]
+
+def import_statement_windows(windows, on_imported=None):
+	"""
+	Fetch statement windows concurrently and import each one as it arrives.
+
+	The HTTP calls run in a bounded thread pool through each bank's API client,
+	which rate limits and retries them, while parsing and importing stay in
+	the calling thread, which owns the database connection. Raw responses are
+	archived before they are parsed, so they can be replayed. Every window is
+	committed on its own, after `on_imported` (called with the window) has
+	run. Failed windows are logged and returned.
+	Returns (transactions created per bank account, failed windows).
+	"""
+	created = {}
+	failed = []
+	settings = frappe.get_cached_doc(SETTINGS_DOCTYPE)
+	max_workers = cint(settings.bank_sync_max_workers) or 4
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		futures = {
+			executor.submit(fetch_statement, window.request, get_bank_api_client(window.connection.doctype)): window
+			for window in windows
+		}
+		for future in as_completed(futures):
+			window = futures[future]
+			try:
+				content = future.result()
+				if cint(settings.archive_bank_statements):
+					archive_statement(window.bank_account, window.from_date, window.to_date, content)
+				with measure("ERPNext", f"import {window.connection.doctype} statement"):
+					transactions = window.connection.parse_statement(json.loads(content))
+					count = import_bank_transactions(window.bank_account, transactions)
+				created[window.bank_account] = created.get(window.bank_account, 0) + count
+				if on_imported:
+					on_imported(window)
+				frappe.db.commit()
+			except Exception:
+				log_sync_error(window.bank_account)
+				failed.append(window)
+
+	return created, failed
+
+def fetch_bank_transactions(bank_account, from_date, to_date, connection=None):
+	"""Retrieve and import the transactions of a bank account through its bank connection."""
+	connection = connection or get_bank_connection_doc(bank_account)
+	windows = get_statement_windows(bank_account, connection, from_date, to_date)
+	created, failed = import_statement_windows(windows)
+	if failed:
+		frappe.throw(
+			_("Could not retrieve transactions for {0}. Retry to resume from the failed period.").format(
+				", ".join(f"{w.from_date} - {w.to_date}" for w in failed)
+			),
+			exc=BankStatementError,
+		)
+	return created.get(bank_account, 0)
+
+def get_synced_bank_accounts():
+	"""Company bank accounts of a bank and company pair served by an enabled bank connection."""
+	connected = set()
+	for doctype in BANK_CONNECTORS:
+		connected.update(frappe.db.sql(
+			f"""
+			SELECT c.bank, acc.company
+			FROM `tab{doctype}` c
+			INNER JOIN `tabAccount` acc ON acc.name = c.parent_account
+			WHERE c.disabled = 0
+			"""
+		))
+	if not connected:
+		return []
+
+	bank_accounts = frappe.get_all(
+		"Bank Account",
+		filters={
+			"is_company_account": 1,
+			"disabled": 0,
+			"bank": ["in", list({bank for bank, company in connected})],
+		},
+		fields=["name", "bank", "company", "custom_last_synced_on"],
+	)
+	return [bank_account for bank_account in bank_accounts if (bank_account.bank, bank_account.company) in connected]
+
+def get_sync_window(last_synced_on):
+	"""Date range to fetch: from the watermark minus the overlap, or the initial window, until today."""
+	settings = frappe.get_cached_doc(SETTINGS_DOCTYPE)
+	to_date = getdate(today())
+	if last_synced_on:
+		from_date = add_days(last_synced_on, -cint(settings.bank_sync_overlap_days))
+	else:
+		from_date = add_days(to_date, -(cint(settings.bank_sync_initial_days) or 30))
+	return getdate(from_date), to_date
+
+def set_last_synced_on(bank_account, to_date):
+	frappe.db.set_value("Bank Account", bank_account, "custom_last_synced_on", to_date, update_modified=False)
+
+def sync_all_bank_accounts():
+	"""
+	Scheduled job retrieving new transactions of every connected bank account
+	from its last synced date, so reconciliation data stays current.
+	"""
+	if not cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "enable_bank_sync")):
+		return
+	sync_bank_accounts()
+
+@frappe.whitelist()
+def enqueue_bank_sync():
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.bank_sync.sync_bank_accounts",
+		queue="long",
+		job_id="erpnext_cyprus_bank_sync",
+		deduplicate=True,
+	)
+	frappe.msgprint(_("Bank accounts are being synced in the background."), alert=True)
+
+def sync_bank_accounts(bank_accounts=None):
+	"""
+	Sync many bank accounts, splitting each account's range into date windows
+	that are all fetched concurrently, so the total time approaches the
+	slowest account. An account's last synced date only advances over the
+	windows completed without a gap, so a failure resumes from there.
+	Returns the number of transactions created per bank account.
+	"""
+	if bank_accounts is None:
+		bank_accounts = get_synced_bank_accounts()
+
+	connections = {}
+	windows = []
+	completed = {}
+	for bank_account in bank_accounts:
+		try:
+			key = get_bank_connection(bank_account.bank, bank_account.company)
+			if key not in connections:
+				connections[key] = get_bank_connection_doc(bank_account.name)
+			from_date, to_date = get_sync_window(bank_account.custom_last_synced_on)
+			account_windows = get_statement_windows(bank_account.name, connections[key], from_date, to_date)
+		except Exception:
+			log_sync_error(bank_account.name)
+			continue
+
+		completed[bank_account.name] = {window.to_date: False for window in account_windows}
+		windows.extend(account_windows)
+
+	def update_last_synced_on(window):
+		account_windows = completed[window.bank_account]
+		account_windows[window.to_date] = True
+		last_synced_on = None
+		for to_date in sorted(account_windows):
+			if not account_windows[to_date]:
+				break
+			last_synced_on = to_date
+		if last_synced_on:
+			set_last_synced_on(window.bank_account, last_synced_on)
+
+	created, failed = import_statement_windows(windows, on_imported=update_last_synced_on)
+	try:
+		match_synced_bank_transactions([name for name, count in created.items() if count])
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=_("Automatic bank transaction matching failed"))
+	return created
+
+def replay_bank_transactions(bank_account, from_date=None, to_date=None):
+	"""
+	Create the transactions of a bank account again from its archived
+	statements, without calling the bank. One statement is held in memory at
+	a time and lines whose import key exists are skipped, so a replay only
+	adds what is missing. It does not correct transactions imported with a
+	wrong mapping: the existing rows are left as they are, and a fixed
+	reference, date or amount gives a new key, hence a second transaction.
+	Cancel and delete the wrong transactions of the period before replaying.
+	Returns the number of transactions created.
+	"""
+	connection = get_bank_connection_doc(bank_account)
+	created = 0
+	for window_from, window_to, digest in get_archived_windows(bank_account, from_date, to_date):
+		transactions = connection.parse_statement(read_statement(digest))
+		created += import_bank_transactions(bank_account, transactions)
+		frappe.db.commit()
+	return created
+
+@frappe.whitelist()
+def enqueue_replay(bank_account=None, from_date=None, to_date=None):
+	"""
+	Replay archived statements of one bank account, or of every archived
+	one, in the background. Only missing transactions are created, existing
+	ones are never updated.
+	"""
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.bank_sync.replay_archived_statements",
+		queue="long",
+		timeout=60 * 60,
+		bank_accounts=[bank_account] if bank_account else None,
+		from_date=from_date,
+		to_date=to_date,
+	)
+	frappe.msgprint(_("Archived bank statements are being imported in the background."), alert=True)
+
+def replay_archived_statements(bank_accounts=None, from_date=None, to_date=None):
+	for bank_account in bank_accounts or get_archived_bank_accounts():
+		try:
+			replay_bank_transactions(bank_account, from_date, to_date)
+		except Exception:
+			log_sync_error(bank_account)
+
+def log_sync_error(bank_account):
+	frappe.db.rollback()
+	frappe.log_error(
+		title=_("Bank sync failed for {0}").format(bank_account),
+		reference_doctype="Bank Account",
+		reference_name=bank_account,
+	)
@@ -0,0 +1,125 @@
+import json
+import math
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import frappe
+from frappe.utils import cint
+
+# Calls kept in memory between two flushes, the oldest are dropped first
+BUFFER_SIZE = 10000
+# Calls kept in Redis per endpoint, and for how long
+MAX_CALLS_PER_ENDPOINT = 5000
+RETENTION_SECONDS = 7 * 24 * 60 * 60
+CALLS_CACHE_KEY = "bank_api_telemetry"
+ENDPOINTS_CACHE_KEY = "bank_api_telemetry_endpoints"
+# Path segments that are account numbers, subscription or transfer ids
+ID_SEGMENT = re.compile(r"^(?=(?:\D*\d){4})[\w\-]{6,}$")
+
+_buffer = deque(maxlen=BUFFER_SIZE)
+
+def get_endpoint(method, url):
+	"""`GET /v1/accounts/{id}/statement` for any account, so calls group per endpoint."""
+	segments = ["{id}" if ID_SEGMENT.match(segment) else segment for segment in urlsplit(url).path.split("/")]
+	return f"{method} {'/'.join(segments)}"
+
+def record(api, endpoint, status, latency, request_bytes=0, response_bytes=0, attempt=0):
+	"""Buffer one call in this process; safe to call from worker threads."""
+	_buffer.append((api, endpoint, time.time(), status, latency, request_bytes, response_bytes, attempt))
+
+def record_response(api, method, url, latency, response, attempt=0):
+	"""Buffer a bank API call from its `requests` response, or None when it failed to connect."""
+	request_bytes = 0
+	if response is not None and response.request is not None:
+		body = response.request.body or b""
+		request_bytes = len(body.encode() if isinstance(body, str) else body)
+	record(
+		api,
+		get_endpoint(method, url),
+		response.status_code if response is not None else 0,
+		latency,
+		request_bytes,
+		len(response.content) if response is not None else 0,
+		attempt,
+	)
+
+@contextmanager
+def measure(api, endpoint):
+	"""Record the time spent in a block of our own code, e.g. importing a statement."""
+	started_at = time.monotonic()
+	status = 0
+	try:
+		yield
+		status = 200
+	finally:
+		record(api, endpoint, status, time.monotonic() - started_at)
+
+def flush():
+	"""
+	Move the buffered calls to Redis, in one round trip, as capped lists per
+	endpoint. Called after every request and background job.
+	"""
+	if not _buffer:
+		return
+
+	calls = {}
+	while _buffer:
+		try:
+			api, endpoint, *call = _buffer.popleft()
+		except IndexError:
+			break
+		calls.setdefault(f"{api}|{endpoint}", []).append(json.dumps(call))
+
+	cache = frappe.cache
+	pipeline = cache.pipeline()
+	endpoints_key = cache.make_key(ENDPOINTS_CACHE_KEY)
+	pipeline.sadd(endpoints_key, *calls)
+	pipeline.expire(endpoints_key, RETENTION_SECONDS)
+	for key, values in calls.items():
+		calls_key = cache.make_key(f"{CALLS_CACHE_KEY}|{key}")
+		pipeline.lpush(calls_key, *values)
+		pipeline.ltrim(calls_key, 0, MAX_CALLS_PER_ENDPOINT - 1)
+		pipeline.expire(calls_key, RETENTION_SECONDS)
+	pipeline.execute()
+
+def get_percentile(values, percentile):
+	"""Nearest rank percentile of sorted values."""
+	if not values:
+		return None
+	return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+def get_summary(minutes=60):
+	"""Calls, error rate, retries, bytes and latency percentiles per API endpoint over the last minutes."""
+	since = time.time() - cint(minutes) * 60
+	summary = []
+	for key in sorted(frappe.safe_decode(key) for key in frappe.cache.smembers(ENDPOINTS_CACHE_KEY)):
+		api, endpoint = key.split("|", 1)
+		calls = [
+			call for call in map(json.loads, frappe.cache.lrange(f"{CALLS_CACHE_KEY}|{key}", 0, -1))
+			if call[0] >= since
+		]
+		if not calls:
+			continue
+		latencies = sorted(call[2] for call in calls)
+		summary.append({
+			"api": api,
+			"endpoint": endpoint,
+			"calls": len(calls),
+			"error_rate": sum(1 for call in calls if not call[1] or call[1] >= 400) / len(calls),
+			"retries": sum(1 for call in calls if call[5]),
+			"p50": get_percentile(latencies, 50),
+			"p95": get_percentile(latencies, 95),
+			"p99": get_percentile(latencies, 99),
+			"request_bytes": sum(call[3] for call in calls),
+			"response_bytes": sum(call[4] for call in calls),
+		})
+	return summary
+
+@frappe.whitelist()
+def get_bank_api_telemetry(minutes=60):
+	frappe.only_for("System Manager")
+	flush()
+	return get_summary(minutes)
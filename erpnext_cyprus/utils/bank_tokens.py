@@ -0,0 +1,94 @@
+import json
+import time
+
+import frappe
+from frappe import _
+from redis.exceptions import LockError
+
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = 120
+LOCK_TIMEOUT = 30
+
+_tokens = {}
+
+def get_token_key(doctype, name):
+	return frappe.cache.make_key(f"bank_token|{doctype}|{name}")
+
+def get_token(doctype, name, load, refresh):
+	"""
+	Access token of a bank connection, cached in Redis with a process-local front.
+
+	`load()` returns the stored token and `refresh(token)` requests and stores a
+	new one, both as (token, expires_at). Close to expiry a single worker
+	refreshes under a Redis lock while the others keep using the current token,
+	so single use refresh tokens are never spent twice.
+	"""
+	key = get_token_key(doctype, name)
+	entry = _tokens.get(key)
+	if not is_fresh(entry):
+		entry = read_token(key)
+	if is_fresh(entry):
+		return entry["token"]
+
+	expired = not entry or entry["expires_at"] <= time.time()
+	lock = frappe.cache.lock(f"{key}|lock", timeout=LOCK_TIMEOUT)
+	if not lock.acquire(blocking=expired, blocking_timeout=LOCK_TIMEOUT):
+		if not expired:
+			# Another worker is refreshing, the current token is still valid
+			return entry["token"]
+		entry = read_token(key)
+		if not entry or entry["expires_at"] <= time.time():
+			frappe.throw(_("Timed out waiting for the {0} access token to be refreshed").format(doctype))
+		return entry["token"]
+
+	try:
+		# Another worker may have refreshed while this one waited for the lock
+		entry = read_token(key)
+		if not is_fresh(entry):
+			token, expires_at = load()
+			if not token or expires_at - REFRESH_MARGIN <= time.time():
+				token, expires_at = refresh(token)
+			entry = set_token(doctype, name, token, expires_at)
+	finally:
+		try:
+			lock.release()
+		except LockError:
+			pass
+
+	return entry["token"]
+
+def is_fresh(entry):
+	return bool(entry) and entry["expires_at"] - REFRESH_MARGIN > time.time()
+
+def read_token(key):
+	entry = frappe.cache.get(key)
+	if not entry:
+		return None
+	entry = _tokens[key] = json.loads(entry)
+	return entry
+
+def set_token(doctype, name, token, expires_at):
+	"""Cache a token until it expires, e.g. right after an authorization flow stored it."""
+	key = get_token_key(doctype, name)
+	entry = _tokens[key] = {"token": token, "expires_at": expires_at}
+	ttl = int(expires_at - time.time())
+	if ttl > 0:
+		frappe.cache.set(key, json.dumps(entry), ex=ttl)
+	return entry
+
+def clear_token(doctype, name):
+	key = get_token_key(doctype, name)
+	_tokens.pop(key, None)
+	frappe.cache.delete(key)
+
+def get_expires_at(token, issued_at=None):
+	"""Expiry of an OAuth token response as a unix timestamp, 0 if unknown."""
+	if not token:
+		return 0
+	if token.get("expires_at"):
+		expires_at = float(token["expires_at"])
+		# Hellenic Bank sends milliseconds
+		return expires_at / 1000 if expires_at > 1e11 else expires_at
+	if token.get("expires_in") and issued_at:
+		return float(issued_at) + float(token["expires_in"])
+	return 0
@@ -0,0 +1,81 @@
+import hashlib
+
+import frappe
+from frappe.utils import flt, getdate
+
+def get_import_key(bank_account, reference_number, date, amount):
+	"""
+	Hash identifying a statement line: bank account, reference, date and
+	signed amount. Stored in the unique `custom_import_key` column.
+	"""
+	key = "|".join((bank_account, reference_number or "", str(getdate(date)), f"{flt(amount, 2):.2f}"))
+	return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def import_bank_transactions(bank_account, transactions):
+	"""
+	Create submitted Bank Transactions for statement lines not imported yet.
+
+	`transactions` are dicts with `date`, `reference_number`, `description` and
+	a signed `amount` (positive for deposits). Already imported lines are
+	found with one lookup on the unique import key and skipped in memory; the
+	new ones are inserted already submitted, in one write each, through the
+	Bank Transaction controller, which names them, sets their status and
+	matches their party. A line another import inserted meanwhile is skipped
+	when the unique import key rejects it; any other error is raised.
+	Returns the number of transactions created.
+	"""
+	if not transactions:
+		return 0
+
+	keyed_transactions = {}
+	for transaction in transactions:
+		key = get_import_key(bank_account, transaction["reference_number"], transaction["date"], transaction["amount"])
+		keyed_transactions.setdefault(key, transaction)
+
+	existing = set(frappe.get_all(
+		"Bank Transaction",
+		filters={"custom_import_key": ["in", list(keyed_transactions)]},
+		pluck="custom_import_key",
+	))
+
+	new_transactions = {key: transaction for key, transaction in keyed_transactions.items() if key not in existing}
+	if not new_transactions:
+		return 0
+
+	currency = frappe.db.sql(
+		"""
+		SELECT acc.account_currency
+		FROM `tabBank Account` ba
+		LEFT JOIN `tabAccount` acc ON acc.name = ba.account
+		WHERE ba.name = %s
+		""",
+		bank_account,
+	)[0][0]
+
+	created = 0
+	for key, transaction in new_transactions.items():
+		amount = flt(transaction["amount"])
+		bank_transaction = frappe.get_doc({
+			"doctype": "Bank Transaction",
+			"date": getdate(transaction["date"]),
+			"bank_account": bank_account,
+			"currency": currency,
+			"deposit": amount if amount > 0 else 0,
+			"withdrawal": -amount if amount < 0 else 0,
+			"reference_number": transaction["reference_number"],
+			"description": transaction.get("description"),
+			"custom_import_key": key,
+			"docstatus": 1,
+		})
+		frappe.db.savepoint("import_bank_transaction")
+		try:
+			bank_transaction.insert()
+		except frappe.UniqueValidationError:
+			frappe.db.rollback(save_point="import_bank_transaction")
+			# A locking read sees the line even when another import committed it after this transaction began
+			if not frappe.db.get_value("Bank Transaction", {"custom_import_key": key}, "name", for_update=True):
+				raise
+			frappe.clear_last_message()
+			continue
+		created += 1
+	return created
@@ -0,0 +1,51 @@
+import time
+
+import frappe
+
+class CircuitBreaker:
+	"""
+	Circuit breaker shared by all workers of a site through Redis.
+
+	The breaker opens after `failure_threshold` consecutive failures and
+	rejects calls for `reset_timeout` seconds. After the cool-down a single
+	probe call is let through; its outcome closes or re-opens the breaker.
+
+	Redis keys are resolved when the breaker is created, so an instance built
+	in the request or job thread can be used from worker threads as well.
+	"""
+
+	def __init__(self, name, failure_threshold=5, reset_timeout=300):
+		self.name = name
+		self.failure_threshold = failure_threshold or 5
+		self.reset_timeout = reset_timeout or 300
+		self.cache = frappe.cache
+		self.failures_key = frappe.cache.make_key(f"circuit_breaker|{name}|failures")
+		self.open_until_key = frappe.cache.make_key(f"circuit_breaker|{name}|open_until")
+		self.probe_key = frappe.cache.make_key(f"circuit_breaker|{name}|probe")
+
+	def get_open_until(self):
+		open_until = self.cache.get(self.open_until_key)
+		return float(open_until) if open_until else 0
+
+	def is_open(self):
+		"""True while the breaker rejects calls, i.e. during the cool-down window."""
+		return time.time() < self.get_open_until()
+
+	def allow_request(self):
+		open_until = self.get_open_until()
+		if not open_until:
+			return True
+		if time.time() < open_until:
+			return False
+		# Half-open: only one caller gets to probe the remote service
+		return bool(self.cache.set(self.probe_key, 1, nx=True, ex=self.reset_timeout))
+
+	def record_success(self):
+		self.cache.delete(self.failures_key, self.open_until_key, self.probe_key)
+
+	def record_failure(self):
+		failures = self.cache.incr(self.failures_key)
+		# A failed half-open probe re-opens the breaker straight away
+		if failures >= self.failure_threshold or self.get_open_until():
+			self.cache.set(self.open_until_key, time.time() + self.reset_timeout)
+			self.cache.delete(self.probe_key)
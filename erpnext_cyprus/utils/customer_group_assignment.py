@@ -1,12 +1,67 @@
 import frappe
 import re
-import requests
 from xml.etree import ElementTree as ET
 
-def is_valid_vies_vat(vat_number: str) -> bool:
-	"""Check if a VAT number is valid using the VIES web service."""
+from erpnext_cyprus.utils import http_client
+from erpnext_cyprus.utils.circuit_breaker import CircuitBreaker
+from erpnext_cyprus.utils.vat_number import get_vat_hash, normalize_vat_number
+
+VIES_URL = 'https://ec.europa.eu/taxation_customs/vies/services/checkVatService'
+VIES_NAMESPACE = "{urn:ec.europa.eu:taxud:vies:services:checkVat:types}"
+
+VIES_VALID = "Valid"
+VIES_INVALID = "Invalid"
+VIES_UNKNOWN = "Unknown"
+
+# SOAP faults meaning VIES could not answer, as opposed to the number being invalid
+VIES_UNAVAILABLE_FAULTS = {
+	"MS_UNAVAILABLE",
+	"MS_MAX_CONCURRENT_REQ",
+	"GLOBAL_MAX_CONCURRENT_REQ",
+	"SERVICE_UNAVAILABLE",
+	"TIMEOUT",
+}
+
+VIES_PENDING_CACHE_KEY = "erpnext_cyprus_vies_pending_customers"
+# VIES answers reused for customers sharing a VAT number within a day
+VIES_STATUS_CACHE_KEY = "erpnext_cyprus_vies_status"
+VIES_STATUS_TTL = 24 * 60 * 60
+
+EU_COUNTRIES = [
+	"Austria", "Belgium", "Bulgaria", "Croatia", "Czech Republic",
+	"Denmark", "Estonia", "Finland", "France", "Germany", "Greece",
+	"Hungary", "Ireland", "Italy", "Latvia", "Lithuania", "Luxembourg",
+	"Malta", "Netherlands", "Poland", "Portugal", "Romania",
+	"Slovakia", "Slovenia", "Spain", "Sweden",
+]
+
+def get_vies_circuit_breaker():
+	settings = frappe.get_cached_doc("Erpnext Cyprus Settings")
+	return CircuitBreaker(
+		"vies",
+		failure_threshold=settings.vies_failure_threshold,
+		reset_timeout=settings.vies_cooldown_seconds,
+	)
+
+def get_vies_url():
+	"""VIES endpoint, overridable with `vies_url` in site config (e.g. to use a local stand-in)."""
+	return frappe.conf.get("vies_url") or VIES_URL
+
+def check_vies_vat(vat_number: str, circuit_breaker=None, url=None) -> str:
+	"""
+	Check a VAT number using the VIES web service.
+	Returns VIES_VALID, VIES_INVALID, or VIES_UNKNOWN when VIES could not answer.
+	Pass `circuit_breaker` and `url` when calling from worker threads.
+	"""
+	vat_number = normalize_vat_number(vat_number)
 	if not vat_number or len(vat_number) < 3:
-		return False
+		return VIES_INVALID
+
+	circuit_breaker = circuit_breaker or get_vies_circuit_breaker()
+	url = url or get_vies_url()
+	if not circuit_breaker.allow_request():
+		return VIES_UNKNOWN
+
 	country_code = vat_number[:2]
 	number = vat_number[2:]
 	envelope = f"""<?xml version="1.0" encoding="UTF-8"?>
@@ -20,16 +75,45 @@ def is_valid_vies_vat(vat_number: str) -> bool:
 		</soapenv:Body>
 	</soapenv:Envelope>"""
 	headers = {'Content-Type': 'text/xml'}
-	url = 'https://ec.europa.eu/taxation_customs/vies/services/checkVatService'
 	try:
-		response = requests.post(url, headers=headers, data=envelope, timeout=10)
-		if response.status_code == 200:
-			root = ET.fromstring(response.content)
-			valid = root.find(".//{urn:ec.europa.eu:taxud:vies:services:checkVat:types}valid")
-			return valid is not None and valid.text == "true"
+		response = http_client.post(url, headers=headers, data=envelope, timeout=10)
+		root = ET.fromstring(response.content)
 	except Exception:
-		pass
-	return False
+		circuit_breaker.record_failure()
+		return VIES_UNKNOWN
+
+	if response.status_code == 200:
+		circuit_breaker.record_success()
+		valid = root.find(f".//{VIES_NAMESPACE}valid")
+		return VIES_VALID if valid is not None and valid.text == "true" else VIES_INVALID
+
+	fault = root.find(".//faultstring")
+	if fault is not None and fault.text and fault.text.strip() not in VIES_UNAVAILABLE_FAULTS:
+		# VIES answered, it just rejected the input (e.g. INVALID_INPUT)
+		circuit_breaker.record_success()
+		return VIES_INVALID
+
+	circuit_breaker.record_failure()
+	return VIES_UNKNOWN
+
+def is_valid_vies_vat(vat_number: str) -> bool:
+	"""Check if a VAT number is valid using the VIES web service."""
+	return check_vies_vat(vat_number) == VIES_VALID
+
+def queue_vies_recheck(*customers):
+	"""Remember customers whose VAT number could not be checked, to retry once VIES is back."""
+	if customers:
+		frappe.cache.sadd(VIES_PENDING_CACHE_KEY, *customers)
+
+def get_recent_vies_status(vat_number):
+	"""VIES status of a VAT number checked within VIES_STATUS_TTL, if any."""
+	return frappe.cache.get_value(f"{VIES_STATUS_CACHE_KEY}:{get_vat_hash(vat_number)}")
+
+def set_recent_vies_status(vat_number, status):
+	if status != VIES_UNKNOWN:
+		frappe.cache.set_value(
+			f"{VIES_STATUS_CACHE_KEY}:{get_vat_hash(vat_number)}", status, expires_in_sec=VIES_STATUS_TTL
+		)
 
 def assign_customer_group_based_on_vat(doc, method=None):
 	"""
@@ -47,8 +131,19 @@ def assign_customer_group_based_on_vat(doc, method=None):
 	# Only proceed if tax_id changed and is not empty
 	if not tax_id_changed or not doc.tax_id:
 		return
-		
-	if is_valid_vies_vat(doc.tax_id):
+
+	status = get_recent_vies_status(doc.tax_id)
+	if not status:
+		status = check_vies_vat(doc.tax_id)
+		set_recent_vies_status(doc.tax_id, status)
+	if status == VIES_UNKNOWN:
+		# Keep the current group instead of downgrading while VIES is unavailable
+		queue_vies_recheck(doc.name)
+		if frappe.session.user != 'Administrator' and frappe.session.user != 'Guest' and frappe.db.get_value("User", frappe.session.user, "user_type") == "Website User":
+			frappe.msgprint("Your VAT number could not be verified right now. It will be checked again shortly.")
+		return
+
+	if status == VIES_VALID:
 		doc.customer_group = "Commercial"
 		doc.customer_type = "Company"
 		if frappe.session.user != 'Administrator' and frappe.session.user != 'Guest' and frappe.db.get_value("User", frappe.session.user, "user_type") == "Website User":
@@ -59,9 +154,18 @@ def assign_customer_group_based_on_vat(doc, method=None):
 		if frappe.session.user != 'Administrator' and frappe.session.user != 'Guest' and frappe.db.get_value("User", frappe.session.user, "user_type") == "Website User":
 			frappe.msgprint("Invalid VAT number format. Please check the VAT number and try again.")
 
+def get_territory_for_country(country):
+	if country == "Cyprus":
+		return "Cyprus"
+	if country in EU_COUNTRIES:
+		return "EU"
+	return "Rest Of The World"
+
 def assign_customer_territory_based_on_country(doc, method=None):
 	"""
 	Assigns territory based on the billing country of the customer.
+	Only the territory column is updated; the Customer is not re-saved, so
+	the VIES validation hook does not run again, and no commit is forced.
 	"""
 
 	# Get the customer lined to the address
@@ -72,26 +176,58 @@ def assign_customer_territory_based_on_country(doc, method=None):
 			break
 	if not customer_name:
 		return
-	
-	# Get the customer document
-	customer_doc = frappe.get_doc("Customer", customer_name)
-	if not customer_doc:
-		return
 
-	country = doc.country
-
-	if country:
-		if country == "Cyprus":
-			customer_doc.territory = "Cyprus"
-		elif country in ["Austria", "Belgium", "Bulgaria", "Croatia", "Czech Republic",
-			"Denmark", "Estonia", "Finland", "France", "Germany", "Greece",
-			"Hungary", "Ireland", "Italy", "Latvia", "Lithuania", "Luxembourg",
-			"Malta", "Netherlands", "Poland", "Portugal", "Romania",
-			"Slovakia", "Slovenia", "Spain", "Sweden"]:
-			customer_doc.territory = "EU"
-		else:
-			customer_doc.territory = "Rest Of The World"
-	else:
-		customer_doc.territory = "Rest Of The World"
-	customer_doc.save(ignore_permissions=True)
-	frappe.db.commit()
+	frappe.db.set_value("Customer", customer_name, "territory", get_territory_for_country(doc.country))
+
+def bulk_assign_customer_territory(customers=None, chunk_size=1000):
+	"""
+	Set the territory of customers from the country of their addresses with
+	set-based SQL. The primary address wins, otherwise the latest created one.
+	Returns the number of customers whose territory changed.
+	"""
+	conditions = "dl.link_doctype = 'Customer' AND dl.parenttype = 'Address'"
+	values = {}
+	if customers is not None:
+		if not customers:
+			return 0
+		conditions += " AND dl.link_name IN %(customers)s"
+		values["customers"] = tuple(customers)
+
+	addresses = frappe.db.sql(
+		f"""
+		SELECT dl.link_name AS customer, cust.territory, addr.country
+		FROM `tabDynamic Link` dl
+		INNER JOIN `tabAddress` addr ON addr.name = dl.parent
+		INNER JOIN `tabCustomer` cust ON cust.name = dl.link_name
+		WHERE {conditions}
+		ORDER BY dl.link_name, addr.is_primary_address, addr.creation
+		""",
+		values,
+		as_dict=True,
+	)
+
+	# Later rows win, so each customer ends up with its preferred address
+	territories = {}
+	current_territories = {}
+	for address in addresses:
+		territories[address.customer] = get_territory_for_country(address.country)
+		current_territories[address.customer] = address.territory
+
+	customers_by_territory = {}
+	for customer, territory in territories.items():
+		if current_territories[customer] != territory:
+			customers_by_territory.setdefault(territory, []).append(customer)
+
+	updated = 0
+	for territory, names in customers_by_territory.items():
+		for i in range(0, len(names), chunk_size):
+			frappe.db.sql(
+				"""
+				UPDATE `tabCustomer`
+				SET territory = %s, modified = %s
+				WHERE name IN %s
+				""",
+				(territory, frappe.utils.now(), tuple(names[i : i + chunk_size])),
+			)
+		updated += len(names)
+	return updated
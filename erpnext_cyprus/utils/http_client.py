@@ -0,0 +1,81 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout applied when the caller does not pass one
+DEFAULT_TIMEOUT = (5, 30)
+# Maximum open connections per host and worker process
+POOL_MAXSIZE = 10
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+
+def get_session(url):
+	"""
+	Return the keep-alive session for the host of `url`.
+
+	One session is kept per host and worker process, and it is safe to share
+	between threads: cookies are never stored, and the connection pool blocks
+	once POOL_MAXSIZE connections to the host are in use.
+	"""
+	global _sessions_pid
+
+	parts = urlsplit(url)
+	host = f"{parts.scheme}://{parts.netloc}"
+	with _lock:
+		if _sessions_pid != os.getpid():
+			# Connections must not be shared with a forked parent process
+			_sessions.clear()
+			_sessions_pid = os.getpid()
+
+		session = _sessions.get(host)
+		if not session:
+			session = requests.Session()
+			session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+			session.mount(host, adapter)
+			_sessions[host] = session
+	return session
+
+def request(method, url, timeout=None, **kwargs):
+	return get_session(url).request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+def get(url, params=None, **kwargs):
+	return request("GET", url, params=params, **kwargs)
+
+def post(url, data=None, json=None, **kwargs):
+	return request("POST", url, data=data, json=json, **kwargs)
+
+def patch(url, data=None, json=None, **kwargs):
+	return request("PATCH", url, data=data, json=json, **kwargs)
+
+def get_connection_stats():
+	"""Return requests sent and connections opened per host by this worker process."""
+	stats = {}
+	with _lock:
+		sessions = dict(_sessions) if _sessions_pid == os.getpid() else {}
+	for host, session in sessions.items():
+		adapter = session.get_adapter(host)
+		num_requests = num_connections = 0
+		for key in adapter.poolmanager.pools.keys():
+			pool = adapter.poolmanager.pools.get(key)
+			if pool:
+				num_requests += pool.num_requests
+				num_connections += pool.num_connections
+		stats[host] = {
+			"requests": num_requests,
+			"connections": num_connections,
+			"reused": max(num_requests - num_connections, 0),
+		}
+	return stats
+
+@frappe.whitelist()
+def get_http_pool_stats():
+	frappe.only_for("System Manager")
+	return get_connection_stats()
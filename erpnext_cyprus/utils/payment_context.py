@@ -0,0 +1,81 @@
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+# Currency of the SEPA credit transfers the bank connections send
+PAYMENT_CURRENCY = "EUR"
+
+class BankPaymentError(frappe.ValidationError):
+	"""
+	A payment the bank did not confirm. `transfer_status` tells how far it
+	got when the bank may hold it, with its `payment_id` once one was given.
+	"""
+
+	def __init__(self, message, payment_id=None, transfer_status=None):
+		super().__init__(message)
+		self.payment_id = payment_id
+		self.transfer_status = transfer_status
+
+class PaymentContext:
+	"""
+	Master data and funds checks shared by the payments of one run.
+
+	Bank accounts are resolved together with their bank's BIC in one joined
+	query, so a payment needs no lookups of its own. Funds confirmed by the
+	bank for an amount are reserved by the payments that follow until they
+	are used up.
+	"""
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.bank_accounts = {}
+		self.confirmed_funds = {}
+		self.reserved_funds = {}
+
+	def get_bank_accounts(self, *bank_accounts):
+		missing = [name for name in bank_accounts if name and name not in self.bank_accounts]
+		if missing:
+			for row in frappe.db.sql(
+				"""
+				SELECT ba.name, ba.iban, ba.bank_account_no, ba.bank, b.swift_number AS bic,
+					acc.account_currency AS currency
+				FROM `tabBank Account` ba
+				LEFT JOIN `tabBank` b ON b.name = ba.bank
+				LEFT JOIN `tabAccount` acc ON acc.name = ba.account
+				WHERE ba.name IN %(names)s
+				""",
+				{"names": missing},
+				as_dict=True,
+			):
+				self.bank_accounts[row.name] = row
+
+		for name in bank_accounts:
+			if name not in self.bank_accounts:
+				frappe.throw(_("Bank Account {0} does not exist").format(name))
+		return [self.bank_accounts[name] for name in bank_accounts]
+
+	def get_bank_account(self, bank_account):
+		return self.get_bank_accounts(bank_account)[0]
+
+	def validate_currency(self, bank_account):
+		"""Refuse to pay from an account whose currency the transfers are not sent in."""
+		currency = self.get_bank_account(bank_account).currency
+		if currency != PAYMENT_CURRENCY:
+			frappe.throw(
+				_("Bank transfers are sent in {0}, bank account {1} is in {2}").format(
+					PAYMENT_CURRENCY, bank_account, currency
+				)
+			)
+
+	def reserve_funds(self, bank_account, amount):
+		"""
+		Reserve `amount` from the funds of `bank_account`. The bank is only asked
+		again when earlier confirmations do not cover the reservations so far.
+		"""
+		reserved = self.reserved_funds.get(bank_account, 0) + flt(amount)
+		if reserved > self.confirmed_funds.get(bank_account, 0):
+			iban = self.get_bank_account(bank_account).iban
+			if not self.connection.funds_availability(bank_account, reserved, iban=iban):
+				frappe.throw(_("Not enough funds available in the selected bank account."))
+			self.confirmed_funds[bank_account] = reserved
+		self.reserved_funds[bank_account] = reserved
@@ -0,0 +1,253 @@
+import frappe
+from frappe import _
+from frappe.utils import flt, nowdate
+
+from erpnext_cyprus.utils.bank_sync import get_bank_connection, get_bank_connection_doc
+from erpnext_cyprus.utils.payment_context import PAYMENT_CURRENCY, PaymentContext
+
+# Claimed by a payment run while it is sent to the bank; left behind only
+# when the run died, so reset by hand like an unknown transfer
+TRANSFER_PROCESSING = "Processing"
+TRANSFER_PENDING = "Pending"
+# Created at the bank but not executed, the next payment run executes it
+TRANSFER_INITIATED = "Initiated"
+# The bank did not answer, so the payment may have been made: never sent
+# again, polled when it has an id and otherwise reset by hand
+TRANSFER_UNKNOWN = "Unknown"
+TRANSFER_COMPLETED = "Completed"
+TRANSFER_REJECTED = "Rejected"
+
+# Bank statuses that end a transfer, anything else is still pending. Hellenic
+# Bank reports words, Bank of Cyprus ISO 20022 codes.
+BANK_TRANSFER_STATUSES = {
+	"EXECUTED": TRANSFER_COMPLETED,
+	"COMPLETED": TRANSFER_COMPLETED,
+	"CPLT": TRANSFER_COMPLETED,
+	"ACSC": TRANSFER_COMPLETED,
+	"ACCC": TRANSFER_COMPLETED,
+	"REJECTED": TRANSFER_REJECTED,
+	"FAILED": TRANSFER_REJECTED,
+	"CANCELLED": TRANSFER_REJECTED,
+	"RJCT": TRANSFER_REJECTED,
+	"CANC": TRANSFER_REJECTED,
+}
+# Bank statuses of a payment created but not executed yet
+BANK_INITIATED_STATUSES = frozenset(("PNDG",))
+
+@frappe.whitelist()
+def create_payment_run(payment_entries):
+	"""
+	Claim submitted Payment Entries and pay them in the background through
+	their bank connections. Returns the claimed Payment Entries.
+	"""
+	claimed = claim_payment_entries(frappe.parse_json(payment_entries))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.payment_run.send_payment_run",
+		queue="long",
+		timeout=60 * 60,
+		claimed=claimed,
+		notify=True,
+	)
+	return list(claimed)
+
+@frappe.whitelist()
+def pay_payment_entry(payment_entry):
+	"""Pay one submitted Payment Entry through its bank connection, as a payment run of one."""
+	return send_payment_run(claim_payment_entries([payment_entry]))
+
+def claim_payment_entries(names):
+	"""
+	Lock and validate Payment Entries for payment, then mark them processing
+	and commit before any bank is called, so a concurrent payment run or wire
+	transfer cannot pay them again.
+	Returns {Payment Entry: its transfer status before the claim}.
+	"""
+	if names:
+		frappe.db.sql("SELECT name FROM `tabPayment Entry` WHERE name IN %(names)s FOR UPDATE", {"names": names})
+	payment_entries = get_payment_run_entries(names)
+	for pe in payment_entries:
+		frappe.has_permission("Payment Entry", "submit", doc=pe.name, throw=True)
+
+	frappe.db.bulk_update(
+		"Payment Entry",
+		{pe.name: {"custom_bank_transfer_status": TRANSFER_PROCESSING} for pe in payment_entries},
+		update_modified=False,
+	)
+	frappe.db.commit()
+	return {pe.name: pe.custom_bank_transfer_status for pe in payment_entries}
+
+def send_payment_run(claimed, notify=False):
+	"""
+	Pay claimed Payment Entries, with one funds availability check per bank
+	account for its total. Hellenic Bank sends each account's payments as
+	one mass transfer, Bank of Cyprus sends them concurrently under one
+	subscription token. The entries are marked pending until
+	`update_pending_transfers` reads their outcome, or initiated or unknown
+	as the connection reports them; the ones no bank holds are released.
+	Each bank account is committed on its own, so a failure does not undo
+	the payments the banks already accepted.
+	Returns {"transfers": {Payment Entry: transfer id}, "errors": [...]}.
+	"""
+	by_bank_account = {}
+	for pe in get_payment_entries(list(claimed)):
+		if pe.custom_bank_transfer_status != TRANSFER_PROCESSING:
+			continue
+		# Initiated payments are executed under their existing id
+		pe.custom_bank_transfer_status = claimed[pe.name]
+		by_bank_account.setdefault(pe.bank_account, []).append(pe)
+
+	transfers = {}
+	errors = []
+	for bank_account, entries in by_bank_account.items():
+		try:
+			connection = get_bank_connection_doc(bank_account)
+			if not connection.get("allow_payments"):
+				frappe.throw(_("Payments are not enabled for bank account {0}").format(bank_account))
+
+			context = PaymentContext(connection)
+			context.reserve_funds(bank_account, sum(flt(pe.paid_amount) for pe in entries))
+			transfer_ids, transfer_errors = connection.submit_payment_run(bank_account, entries, nowdate(), context)
+		except Exception as e:
+			frappe.db.rollback()
+			frappe.log_error(title=_("Payment run failed for {0}").format(bank_account))
+			errors.append(_("{0}: {1}").format(bank_account, e))
+			transfer_ids, transfer_errors = {}, []
+
+		updates = {
+			# Released, no bank holds the payment
+			pe.name: {"custom_bank_transfer_status": claimed[pe.name]}
+			for pe in entries
+			if pe.name not in transfer_ids
+		}
+		updates.update(
+			(name, {"custom_bank_transfer_id": transfer_id, "custom_bank_transfer_status": status})
+			for name, (transfer_id, status) in transfer_ids.items()
+		)
+		frappe.db.bulk_update("Payment Entry", updates, update_modified=False)
+		frappe.db.commit()
+		transfers.update(
+			(name, transfer_id) for name, (transfer_id, status) in transfer_ids.items() if status == TRANSFER_PENDING
+		)
+		errors.extend(transfer_errors)
+
+	if notify and errors:
+		frappe.publish_realtime("msgprint", "<br>".join(errors), user=frappe.session.user)
+	return {"transfers": transfers, "errors": errors}
+
+def get_payment_entries(names):
+	"""Payment Entries with their beneficiary details."""
+	return frappe.db.sql(
+		"""
+		SELECT pe.name, pe.docstatus, pe.payment_type, pe.bank_account, pe.paid_amount,
+			pe.reference_no, pe.party_name, pe.paid_from_account_currency,
+			pe.custom_bank_transfer_status, pe.custom_bank_transfer_id,
+			pba.iban AS beneficiary_account, pb.swift_number AS beneficiary_bic
+		FROM `tabPayment Entry` pe
+		LEFT JOIN `tabBank Account` pba ON pba.name = pe.party_bank_account
+		LEFT JOIN `tabBank` pb ON pb.name = pba.bank
+		WHERE pe.name IN %(names)s
+		ORDER BY pe.name
+		""",
+		{"names": names},
+		as_dict=True,
+	)
+
+def get_payment_run_entries(names):
+	"""Payment Entries with their beneficiary details, validated for a payment run."""
+	if not names:
+		frappe.throw(_("Select the Payment Entries to pay"))
+
+	payment_entries = get_payment_entries(names)
+
+	errors = []
+	if len(payment_entries) != len(set(names)):
+		found = {pe.name for pe in payment_entries}
+		errors.extend(_("{0} does not exist").format(name) for name in set(names) - found)
+	for pe in payment_entries:
+		if pe.docstatus != 1 or pe.payment_type != "Pay":
+			errors.append(_("{0} must be a submitted payment").format(pe.name))
+		elif pe.custom_bank_transfer_status in (TRANSFER_PENDING, TRANSFER_COMPLETED):
+			errors.append(_("{0} has already been transferred").format(pe.name))
+		elif pe.custom_bank_transfer_status == TRANSFER_PROCESSING:
+			errors.append(_("{0} is being transferred").format(pe.name))
+		elif pe.custom_bank_transfer_status == TRANSFER_UNKNOWN:
+			errors.append(_("{0} may have been transferred, check it with the bank first").format(pe.name))
+		elif pe.paid_from_account_currency != PAYMENT_CURRENCY:
+			errors.append(
+				_("{0} is paid in {1}, bank transfers are sent in {2}").format(
+					pe.name, pe.paid_from_account_currency, PAYMENT_CURRENCY
+				)
+			)
+		elif not pe.beneficiary_account:
+			errors.append(_("{0} has no party bank account with an IBAN").format(pe.name))
+		elif not pe.bank_account:
+			errors.append(_("{0} has no company bank account").format(pe.name))
+
+	if errors:
+		frappe.throw("<br>".join(errors), title=_("Cannot create payment run"))
+	return payment_entries
+
+def update_pending_transfers():
+	"""
+	Scheduled job updating pending Payment Entries, and unknown ones the bank
+	gave an id, from their banks' transfer statuses. An unknown transfer the
+	bank still holds unexecuted becomes initiated, to be executed again.
+	"""
+	pending = frappe.get_all(
+		"Payment Entry",
+		filters={
+			"docstatus": 1,
+			"custom_bank_transfer_status": ["in", [TRANSFER_PENDING, TRANSFER_UNKNOWN]],
+			"custom_bank_transfer_id": ["is", "set"],
+		},
+		fields=["name", "bank_account", "custom_bank_transfer_id", "custom_bank_transfer_status"],
+	)
+	transfer_statuses = {pe.name: pe.custom_bank_transfer_status for pe in pending}
+
+	bank_accounts = {
+		bank_account.name: bank_account
+		for bank_account in frappe.get_all(
+			"Bank Account",
+			filters={"name": ["in", list({pe.bank_account for pe in pending})]},
+			fields=["name", "bank", "company"],
+		)
+	} if pending else {}
+	by_connection = {}
+	for pe in pending:
+		bank_account = bank_accounts.get(pe.bank_account) or frappe._dict()
+		by_connection.setdefault(get_bank_connection(bank_account.bank, bank_account.company), []).append(pe)
+
+	for (doctype, name), entries in by_connection.items():
+		if not doctype:
+			continue
+		try:
+			statuses = frappe.get_doc(doctype, name).get_transfer_statuses(entries)
+
+			updates = {}
+			for pe_name, bank_status in statuses.items():
+				bank_status = (bank_status or "").upper()
+				status = BANK_TRANSFER_STATUSES.get(bank_status)
+				if not status and transfer_statuses[pe_name] == TRANSFER_UNKNOWN and bank_status in BANK_INITIATED_STATUSES:
+					status = TRANSFER_INITIATED
+				if status:
+					updates[pe_name] = {"custom_bank_transfer_status": status}
+			if updates:
+				frappe.db.bulk_update("Payment Entry", updates, update_modified=False)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=_("Could not update bank transfers of {0}").format(name))
+
+@frappe.whitelist()
+def reset_bank_transfer(payment_entry):
+	"""
+	Allow a transfer of unknown outcome, or one left processing by a payment
+	run that died, to be paid again once the bank confirmed it was not made.
+	"""
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	payment_entry = frappe.get_doc("Payment Entry", payment_entry)
+	if payment_entry.custom_bank_transfer_status not in (TRANSFER_PROCESSING, TRANSFER_UNKNOWN):
+		frappe.throw(_("Only bank transfers of unknown outcome can be reset"))
+
+	payment_entry.db_set({"custom_bank_transfer_status": None, "custom_bank_transfer_id": None})
+	payment_entry.add_comment("Info", _("Bank transfer reset after checking that the bank did not make it"))
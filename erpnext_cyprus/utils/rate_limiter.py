@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+class RateLimiter:
+	"""Thread-safe token bucket limiting calls to `rate` per second."""
+
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate) if rate and rate > 0 else 0
+		self.capacity = float(burst or max(self.rate, 1))
+		self.tokens = self.capacity
+		self.updated_at = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""Block until a token is available. A rate of 0 means unlimited."""
+		if not self.rate:
+			return
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+				self.updated_at = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
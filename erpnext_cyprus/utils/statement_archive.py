@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+import os
+from urllib.parse import quote, unquote
+
+import frappe
+from frappe.utils import getdate
+
+ARCHIVE_FOLDER = "bank_statements"
+
+def get_archive_path(*parts):
+	return frappe.get_site_path("private", ARCHIVE_FOLDER, *parts)
+
+def get_statement_path(digest):
+	return get_archive_path("objects", digest[:2], f"{digest}.json.gz")
+
+def get_account_path(bank_account):
+	return get_archive_path("accounts", quote(bank_account, safe=""))
+
+def archive_statement(bank_account, from_date, to_date, content):
+	"""
+	Store a raw statement response gzip compressed under its SHA-256, so
+	identical responses are kept once, and point the account's window at it.
+	Returns the digest.
+	"""
+	digest = hashlib.sha256(content).hexdigest()
+	path = get_statement_path(digest)
+	if not os.path.exists(path):
+		write_atomic(path, gzip.compress(content))
+
+	window = f"{getdate(from_date)}_{getdate(to_date)}"
+	write_atomic(os.path.join(get_account_path(bank_account), window), digest.encode())
+	return digest
+
+def write_atomic(path, content):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	temp_path = f"{path}.{os.getpid()}.tmp"
+	with open(temp_path, "wb") as f:
+		f.write(content)
+	os.replace(temp_path, path)
+
+def get_archived_windows(bank_account, from_date=None, to_date=None):
+	"""(from_date, to_date, digest) of an account's archived statements overlapping the range, in date order."""
+	account_path = get_account_path(bank_account)
+	if not os.path.isdir(account_path):
+		return []
+
+	from_date = from_date and getdate(from_date)
+	to_date = to_date and getdate(to_date)
+	windows = []
+	for window in os.listdir(account_path):
+		if window.endswith(".tmp"):
+			continue
+		window_from, window_to = (getdate(d) for d in window.split("_"))
+		if (from_date and window_to < from_date) or (to_date and window_from > to_date):
+			continue
+		with open(os.path.join(account_path, window)) as f:
+			windows.append((window_from, window_to, f.read().strip()))
+	return sorted(windows)
+
+def get_archived_bank_accounts():
+	accounts_path = get_archive_path("accounts")
+	if not os.path.isdir(accounts_path):
+		return []
+	return sorted(unquote(name) for name in os.listdir(accounts_path))
+
+def read_statement(digest):
+	with gzip.open(get_statement_path(digest), "rb") as f:
+		return json.load(f)
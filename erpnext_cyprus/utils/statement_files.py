@@ -0,0 +1,213 @@
+import re
+from datetime import datetime
+from io import TextIOWrapper
+from itertools import islice
+from xml.etree.ElementTree import iterparse
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from erpnext_cyprus.utils.bank_matching import match_synced_bank_transactions
+from erpnext_cyprus.utils.bank_sync import BankStatementError
+from erpnext_cyprus.utils.bank_transactions import import_bank_transactions
+
+# Statement lines sent to import_bank_transactions and committed at a time
+BATCH_SIZE = 1000
+# :61:YYMMDD[MMDD]{C|D|RC|RD}[funds code]amount{N|F|S}xxx customer reference[//bank reference]
+MT940_LINE = re.compile(
+	r"(?P<date>\d{6})(?P<entry_date>\d{4})?(?P<mark>R?[CD])[A-Z]?(?P<amount>\d+,\d*)"
+	r"[NFS][A-Z0-9]{3}(?P<reference>.*?)(?://(?P<bank_reference>.*))?$"
+)
+MT940_TAG = re.compile(r"^:(\d{2}[A-Z]?):(.*)$")
+
+def get_local_name(tag):
+	return tag.rsplit("}", 1)[-1]
+
+def get_text(elem, *path):
+	"""Text of the first descendant along `path` of local tag names, ignoring XML namespaces."""
+	for name in path:
+		elem = next((child for child in elem if get_local_name(child.tag) == name), None)
+		if elem is None:
+			return None
+	return (elem.text or "").strip() or None
+
+def iter_camt053(f):
+	"""
+	Yield (account, line) for each booked entry of a CAMT.053 statement, or a
+	CAMT.052 report. Entries are parsed as they end and removed from the tree,
+	so memory stays flat whatever the size of the file.
+	"""
+	document = statement = account = None
+	for event, elem in iterparse(f, events=("start", "end")):
+		name = get_local_name(elem.tag)
+		if event == "start":
+			if name in ("BkToCstmrStmt", "BkToCstmrAcctRpt"):
+				document = elem
+			elif name in ("Stmt", "Rpt"):
+				statement = elem
+			continue
+
+		if name == "Acct" and statement is not None and any(child is elem for child in statement):
+			account = get_text(elem, "Id", "IBAN") or get_text(elem, "Id", "Othr", "Id")
+		elif name == "Ntry":
+			status = get_text(elem, "Sts", "Cd") or get_text(elem, "Sts")
+			if status in (None, "BOOK"):
+				yield account, parse_camt_entry(elem)
+			elem.clear()
+			if statement is not None:
+				statement.remove(elem)
+		elif name in ("Stmt", "Rpt"):
+			elem.clear()
+			if document is not None:
+				document.remove(elem)
+			statement = None
+
+def parse_camt_entry(entry):
+	amount = flt(get_text(entry, "Amt"))
+	if get_text(entry, "CdtDbtInd") == "DBIT":
+		amount = -amount
+
+	details = next((child for child in entry.iter() if get_local_name(child.tag) == "TxDtls"), entry)
+	remittance = " ".join(
+		(child.text or "").strip() for child in details.iter() if get_local_name(child.tag) == "Ustrd"
+	)
+	date = (
+		get_text(entry, "ValDt", "Dt") or get_text(entry, "ValDt", "DtTm")
+		or get_text(entry, "BookgDt", "Dt") or get_text(entry, "BookgDt", "DtTm")
+	)
+	if not date:
+		raise BankStatementError(
+			_("Statement entry {0} has neither a value nor a booking date").format(
+				get_text(entry, "AcctSvcrRef") or get_text(entry, "NtryRef") or get_text(entry, "Amt")
+			)
+		)
+	return {
+		"date": date[:10],
+		"reference_number": (
+			get_text(entry, "AcctSvcrRef") or get_text(details, "Refs", "AcctSvcrRef")
+			or get_text(details, "Refs", "EndToEndId") or get_text(entry, "NtryRef")
+		),
+		"description": remittance or get_text(entry, "AddtlNtryInf") or get_text(details, "AddtlTxInf"),
+		"amount": amount,
+	}
+
+def iter_mt940_fields(f):
+	"""Yield (tag, value) of each field of an MT940 file, joining continuation lines."""
+	tag = value = None
+	for line in f:
+		line = line.rstrip("\r\n")
+		match = MT940_TAG.match(line)
+		if match or line.startswith("-"):
+			if tag:
+				yield tag, value
+			tag, value = match.groups() if match else (None, None)
+		elif tag:
+			value += "\n" + line
+	if tag:
+		yield tag, value
+
+def iter_mt940(f):
+	"""Yield (account, line) for each :61: statement line of an MT940 file, reading it line by line."""
+	account = pending = None
+	for tag, value in iter_mt940_fields(f):
+		# :86: holds the information of the :61: line right before it
+		if tag == "86" and pending:
+			pending[1]["description"] = " ".join(value.split())
+		if pending:
+			yield pending
+			pending = None
+
+		if tag == "25":
+			account = value.split("/")[-1].strip()
+		elif tag == "61":
+			pending = (account, parse_mt940_line(value))
+	if pending:
+		yield pending
+
+def parse_mt940_line(value):
+	first_line, __, supplementary = value.partition("\n")
+	match = MT940_LINE.match(first_line)
+	if not match:
+		raise BankStatementError(_("Unrecognised MT940 statement line: {0}").format(first_line))
+
+	amount = flt(match.group("amount").replace(",", "."))
+	# A debit, or the reversal of a credit, takes money out of the account
+	if match.group("mark") in ("D", "RC"):
+		amount = -amount
+	reference = match.group("reference").strip()
+	if not reference or reference == "NONREF":
+		reference = (match.group("bank_reference") or "").strip() or None
+	return {
+		"date": datetime.strptime(match.group("date"), "%y%m%d").date(),
+		"reference_number": reference,
+		"description": supplementary.strip() or None,
+		"amount": amount,
+	}
+
+def iter_statement_file(f):
+	"""Detect whether a binary file is CAMT XML or MT940 text and stream its lines."""
+	head = f.read(512)
+	f.seek(0)
+	if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+		return iter_camt053(f)
+	return iter_mt940(TextIOWrapper(f, encoding="utf-8", errors="replace"))
+
+def normalize_account(account):
+	"""Uppercase an IBAN or account number and strip spaces, dashes and other separators."""
+	return re.sub(r"[^A-Z0-9]", "", (account or "").upper())
+
+def validate_statement_account(bank_account, account):
+	"""Refuse a statement of another account, when the file names one."""
+	if not account:
+		return
+	iban, account_no = frappe.db.get_value("Bank Account", bank_account, ["iban", "bank_account_no"])
+	account = normalize_account(account)
+	known = {normalize_account(value) for value in (iban, account_no)} - {""}
+	if known and account not in known:
+		raise BankStatementError(
+			_("The statement file is for account {0}, not {1}").format(account, bank_account)
+		)
+
+def import_statement_file(bank_account, file_url, batch_size=BATCH_SIZE):
+	"""
+	Import a CAMT.053 or MT940 file downloaded from e-banking into Bank
+	Transactions. Lines go through import_bank_transactions in batches that
+	are committed one by one, so the lines of an earlier import of an
+	overlapping file are skipped and a failure keeps the batches done so far.
+	Returns the number of transactions created.
+	"""
+	file_doc = frappe.get_doc("File", {"file_url": file_url})
+	created = 0
+	accounts = set()
+
+	def iter_lines(lines):
+		for account, line in lines:
+			if account not in accounts:
+				validate_statement_account(bank_account, account)
+				accounts.add(account)
+			yield line
+
+	with open(file_doc.get_full_path(), "rb") as f:
+		lines = iter_lines(iter_statement_file(f))
+		while batch := list(islice(lines, batch_size)):
+			created += import_bank_transactions(bank_account, batch)
+			frappe.db.commit()
+
+	match_synced_bank_transactions([bank_account] if created else [])
+	frappe.db.commit()
+	return created
+
+@frappe.whitelist()
+def enqueue_statement_file_import(bank_account, file_url):
+	frappe.only_for(("Accounts Manager", "System Manager"))
+	frappe.enqueue(
+		"erpnext_cyprus.utils.statement_files.import_statement_file",
+		queue="long",
+		timeout=60 * 60,
+		job_id=f"erpnext_cyprus_statement_file_{file_url}",
+		deduplicate=True,
+		bank_account=bank_account,
+		file_url=file_url,
+	)
+	frappe.msgprint(_("The statement file is being imported in the background."), alert=True)
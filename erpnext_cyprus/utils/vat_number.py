@@ -0,0 +1,57 @@
+import hashlib
+import re
+
+import frappe
+from frappe import _
+
+# VIES uses EL for Greece while users often type the ISO code
+COUNTRY_PREFIX_ALIASES = {"GR": "EL"}
+
+def normalize_vat_number(vat_number):
+	"""Uppercase a VAT number and strip spaces, dots, dashes and other separators."""
+	if not vat_number:
+		return ""
+	normalized = re.sub(r"[^A-Z0-9]", "", vat_number.upper())
+	prefix = normalized[:2]
+	if prefix in COUNTRY_PREFIX_ALIASES:
+		normalized = COUNTRY_PREFIX_ALIASES[prefix] + normalized[2:]
+	return normalized
+
+def get_vat_hash(vat_number):
+	normalized = normalize_vat_number(vat_number)
+	return hashlib.sha1(normalized.encode("utf-8")).hexdigest() if normalized else None
+
+def find_duplicate_customers(vat_number, exclude=None, fields=None):
+	"""Customers sharing the normalised VAT number, found through the indexed hash column."""
+	vat_hash = get_vat_hash(vat_number)
+	if not vat_hash:
+		return []
+	filters = {"custom_tax_id_hash": vat_hash}
+	if exclude:
+		filters["name"] = ["!=", exclude]
+	return frappe.get_all("Customer", filters=filters, fields=fields or ["name"], order_by="creation")
+
+def set_customer_vat_hash(doc, method=None):
+	"""Customer validate hook: keep the VAT hash current and warn about duplicates."""
+	doc.custom_tax_id_hash = get_vat_hash(doc.tax_id)
+	if not doc.custom_tax_id_hash or not doc.has_value_changed("custom_tax_id_hash"):
+		return
+
+	# The names of other customers are only shown to desk users
+	if frappe.get_cached_value("User", frappe.session.user, "user_type") != "System User":
+		return
+
+	duplicates = find_duplicate_customers(doc.tax_id, exclude=doc.name)
+	if duplicates:
+		frappe.msgprint(
+			_("VAT number {0} is already used by customer {1}").format(
+				doc.tax_id, ", ".join(d.name for d in duplicates)
+			),
+			indicator="orange",
+			alert=True,
+		)
+
+@frappe.whitelist()
+def get_customers_by_vat_number(vat_number):
+	frappe.has_permission("Customer", throw=True)
+	return find_duplicate_customers(vat_number, fields=["name", "customer_name", "tax_id", "customer_group"])
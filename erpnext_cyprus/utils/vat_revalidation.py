@@ -0,0 +1,191 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, now
+
+from erpnext_cyprus.utils.customer_group_assignment import (
+	VIES_PENDING_CACHE_KEY,
+	VIES_UNKNOWN,
+	VIES_VALID,
+	check_vies_vat,
+	get_vies_circuit_breaker,
+	get_vies_url,
+	queue_vies_recheck,
+)
+from erpnext_cyprus.utils.rate_limiter import RateLimiter
+
+SETTINGS_DOCTYPE = "Erpnext Cyprus Settings"
+
+@frappe.whitelist()
+def revalidate_customer_vat_numbers(restart=0):
+	"""Enqueue the bulk VIES revalidation of all customer VAT numbers."""
+	frappe.only_for("System Manager")
+
+	if cint(restart):
+		frappe.db.set_single_value(SETTINGS_DOCTYPE, "vat_revalidation_checkpoint", "")
+
+	enqueue_vat_revalidation()
+	frappe.msgprint(_("VAT number revalidation has been queued."), alert=True)
+
+def enqueue_vat_revalidation():
+	frappe.enqueue(
+		"erpnext_cyprus.utils.vat_revalidation.run_vat_revalidation",
+		queue="long",
+		timeout=4 * 60 * 60,
+		job_id="erpnext_cyprus_vat_revalidation",
+		deduplicate=True,
+	)
+
+def run_vat_revalidation():
+	"""
+	Revalidate every customer tax_id through VIES and update customer groups.
+	Progress is checkpointed after each batch, so an interrupted run resumes
+	after the last committed customer. If the VIES circuit breaker opens, the
+	run pauses and `retry_pending_vies_checks` resumes it once VIES is back.
+	"""
+	settings = frappe.get_single(SETTINGS_DOCTYPE)
+	batch_size = cint(settings.vat_revalidation_batch_size) or 500
+	max_workers = cint(settings.vies_max_workers) or 4
+	limiter = RateLimiter(flt(settings.vies_requests_per_second))
+	circuit_breaker = get_vies_circuit_breaker()
+	vies_url = get_vies_url()
+
+	checkpoint = settings.vat_revalidation_checkpoint or ""
+	summary = json.loads(settings.vat_revalidation_summary or "{}") if checkpoint else {}
+	if not summary:
+		summary = {"started_on": now(), "checked": 0, "changed": []}
+
+	total = frappe.db.sql(
+		"""SELECT COUNT(*) FROM `tabCustomer` WHERE name > %s AND IFNULL(tax_id, '') != ''""",
+		checkpoint,
+	)[0][0]
+	processed = 0
+
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		while True:
+			customers = frappe.db.sql(
+				"""
+				SELECT name, tax_id, customer_group
+				FROM `tabCustomer`
+				WHERE name > %s AND IFNULL(tax_id, '') != ''
+				ORDER BY name
+				LIMIT %s
+				""",
+				(checkpoint, batch_size),
+				as_dict=True,
+			)
+			if not customers:
+				break
+
+			results = executor.map(
+				partial(check_vat_number, limiter, circuit_breaker, vies_url), [c.tax_id for c in customers]
+			)
+			changes = get_customer_group_changes(customers, results, summary)
+			update_customer_groups(changes)
+
+			checkpoint = customers[-1].name
+			processed += len(customers)
+			summary["checked"] += len(customers)
+			save_progress(checkpoint, summary)
+			frappe.db.commit()
+
+			frappe.publish_progress(
+				percent=int(processed * 100 / total) if total else 100,
+				title=_("Revalidating VAT Numbers"),
+				description=_("Checked {0} of {1} customers").format(processed, total),
+			)
+
+			if circuit_breaker.is_open():
+				summary["paused_on"] = now()
+				save_progress(checkpoint, summary)
+				frappe.db.commit()
+				return summary
+
+	summary.pop("paused_on", None)
+	summary["completed_on"] = now()
+	save_progress("", summary)
+	frappe.db.commit()
+	frappe.publish_realtime("vat_revalidation_completed", summary)
+	return summary
+
+def retry_pending_vies_checks():
+	"""
+	Scheduled job rechecking customers whose VIES status was unknown, and
+	resuming a paused bulk revalidation, once the circuit breaker closes.
+	"""
+	circuit_breaker = get_vies_circuit_breaker()
+	if circuit_breaker.is_open():
+		return
+
+	if frappe.db.get_single_value(SETTINGS_DOCTYPE, "vat_revalidation_checkpoint"):
+		enqueue_vat_revalidation()
+
+	pending = list(frappe.cache.smembers(VIES_PENDING_CACHE_KEY))
+	if not pending:
+		return
+	pending = [frappe.safe_decode(customer) for customer in pending]
+	frappe.cache.srem(VIES_PENDING_CACHE_KEY, *pending)
+
+	customers = frappe.get_all(
+		"Customer",
+		filters={"name": ["in", pending], "tax_id": ["is", "set"]},
+		fields=["name", "tax_id", "customer_group"],
+	)
+	results = [check_vies_vat(customer.tax_id, circuit_breaker) for customer in customers]
+	changes = get_customer_group_changes(customers, results)
+	update_customer_groups(changes)
+	frappe.db.commit()
+
+def check_vat_number(limiter, circuit_breaker, vies_url, tax_id):
+	if circuit_breaker.is_open():
+		return VIES_UNKNOWN
+	limiter.acquire()
+	return check_vies_vat(tax_id, circuit_breaker, vies_url)
+
+def get_customer_group_changes(customers, results, summary=None):
+	"""
+	Map each target customer group to the customers moving into it.
+	Customers with an unknown VIES status keep their group and are queued for a recheck.
+	"""
+	changes = {}
+	unknown = []
+	for customer, status in zip(customers, results):
+		if status == VIES_UNKNOWN:
+			unknown.append(customer.name)
+			continue
+		customer_group = "Commercial" if status == VIES_VALID else "Individual"
+		if customer.customer_group == customer_group:
+			continue
+		changes.setdefault(customer_group, []).append(customer.name)
+		if summary is not None:
+			summary["changed"].append({
+				"customer": customer.name,
+				"tax_id": customer.tax_id,
+				"from": customer.customer_group,
+				"to": customer_group,
+			})
+
+	queue_vies_recheck(*unknown)
+	return changes
+
+def update_customer_groups(changes):
+	"""Apply group changes with one UPDATE per target customer group."""
+	for customer_group, customers in changes.items():
+		customer_type = "Company" if customer_group == "Commercial" else "Individual"
+		frappe.db.sql(
+			"""
+			UPDATE `tabCustomer`
+			SET customer_group = %s, customer_type = %s, modified = %s
+			WHERE name IN %s
+			""",
+			(customer_group, customer_type, now(), tuple(customers)),
+		)
+
+def save_progress(checkpoint, summary):
+	frappe.db.set_single_value(SETTINGS_DOCTYPE, {
+		"vat_revalidation_checkpoint": checkpoint,
+		"vat_revalidation_summary": json.dumps(summary),
+	})